@@ -0,0 +1,317 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from sqlite_config import get_engine, is_sqlite, prepare_review_tables
+
+try:
+    import duckdb
+except ImportError:  # optional dependency: pip install duckdb pyarrow
+    duckdb = None
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(__file__), 'analytics_snapshot')
+
+AGGREGATE_PATTERN = re.compile(r"\b(COUNT|SUM|AVG|MIN|MAX|GROUP\s+BY)\b", re.IGNORECASE)
+WRITE_PATTERN = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|CREATE|DROP|ALTER|REPLACE|ATTACH|PRAGMA|VACUUM|COPY)\b", re.IGNORECASE
+)
+# Functions whose SQLite semantics differ in DuckDB (e.g. strftime argument order)
+SQLITE_ONLY_PATTERN = re.compile(r"\b(strftime|julianday|date|datetime|printf|instr)\s*\(", re.IGNORECASE)
+TABLE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_][A-Za-z0-9_]*)", re.IGNORECASE)
+# SQLite's LIKE ignores case; DuckDB's LIKE does not, so routed queries use ILIKE (string literals kept)
+LIKE_PATTERN = re.compile(r"\bLIKE\b", re.IGNORECASE)
+STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+# Columns filled in shortly after a review is inserted (near-duplicate cluster, derived dates): a row exported
+# before that happened is exported again once the primary database has the value
+LATE_COLUMNS = ('ClusterId', 'DatePublishedISO', 'DatePublishedMonth', 'DateFlownMonth')
+
+# One refresh at a time per snapshot directory, across every AnalyticsEngine in the process
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def refresh_lock(snapshot_dir):
+    with _refresh_locks_guard:
+        return _refresh_locks.setdefault(os.path.abspath(snapshot_dir), threading.RLock())
+
+
+class AnalyticsEngine:
+    """Columnar Parquet snapshot of ryanair_reviews queried through DuckDB.
+
+    The snapshot is a directory of Parquet parts. refresh() appends rows with ids
+    above the snapshot's high-water mark as a new part. Rows whose sentiment was
+    written or replaced since the last refresh (review_sentiment.AnalyzedAt), or whose
+    LATE_COLUMNS were filled in after export, are exported again as an update part
+    that replaces them, so the primary database is never rescanned in full. The
+    snapshot is tied to the database through analytics_snapshot_state, which is
+    dropped with the reviews: a reload, or another database, rebuilds it. Read-only
+    aggregate queries over ryanair_reviews are routed here; everything else runs on the primary database.
+    Routed queries keep the primary's semantics: / on integers is integer division
+    and, for SQLite, LIKE ignores case.
+    """
+
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR, chunk_size=200000, refresh_interval=60):
+        if duckdb is None:
+            raise ImportError("The analytical engine needs duckdb and pyarrow: pip install duckdb pyarrow")
+        self.snapshot_dir = snapshot_dir
+        self.chunk_size = chunk_size
+        self.engine = get_engine()
+        self.lock = threading.Lock()
+        self.refresh_lock = refresh_lock(snapshot_dir)
+        self.connection = None
+        self.refresh_interval = refresh_interval
+        self.last_refresh = 0.0
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+    # ------------------------------
+    # Snapshot maintenance
+    # ------------------------------
+    @property
+    def state_path(self):
+        return os.path.join(self.snapshot_dir, 'state.json')
+
+    def load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                return json.load(f)
+        return self.empty_state()
+
+    @staticmethod
+    def empty_state():
+        return {"snapshot_id": None, "high_water_id": -1, "parts": 0, "overlays": 0, "analyzed_since": None}
+
+    def database_snapshot_id(self):
+        """Id of the snapshot this database's reviews belong to; a new one after the reviews are reloaded"""
+        with self.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE IF NOT EXISTS analytics_snapshot_state (snapshot_id TEXT NOT NULL)"))
+            snapshot_id = conn.execute(text("SELECT snapshot_id FROM analytics_snapshot_state")).scalar()
+            if snapshot_id is None:
+                snapshot_id = uuid.uuid4().hex
+                conn.execute(text("INSERT INTO analytics_snapshot_state (snapshot_id) VALUES (:snapshot_id)"),
+                             {'snapshot_id': snapshot_id})
+        return snapshot_id
+
+    def save_state(self, state):
+        with open(self.state_path, 'w') as f:
+            json.dump(state, f)
+
+    @staticmethod
+    def is_numeric(column_type):
+        try:
+            return column_type.python_type in (int, float)
+        except NotImplementedError:
+            return False
+
+    def normalize_types(self, df, columns):
+        """Give every part the same schema regardless of which values a chunk contains"""
+        for column in columns:
+            if column['name'] == 'id':
+                df['id'] = df['id'].astype('int64')
+            elif self.is_numeric(column['type']):
+                df[column['name']] = pd.to_numeric(df[column['name']], errors='coerce').astype('float64')
+            else:
+                df[column['name']] = df[column['name']].astype('string')
+        return df
+
+    def refresh(self):
+        """Incrementally bring the snapshot up to date; returns the number of new and updated rows"""
+        # Concurrent refreshes would write the same part files
+        with self.refresh_lock:
+            return self.refresh_snapshot()
+
+    def refresh_snapshot(self):
+        """refresh() without the lock"""
+        prepare_review_tables(self.engine)
+        state = self.load_state()
+        columns = [c for c in inspect(self.engine).get_columns('ryanair_reviews')]
+        names = [c['name'] for c in columns]
+        snapshot_id = self.database_snapshot_id()
+        with self.engine.connect() as conn:
+            max_id = conn.execute(text("SELECT MAX(id) FROM ryanair_reviews")).scalar()
+            # Taken before any row is read: results written during this refresh are picked up by the next
+            analyzed_since = conn.execute(text("SELECT MAX(AnalyzedAt) FROM review_sentiment")).scalar()
+        max_id = -1 if max_id is None else int(max_id)
+        if (state['parts'] or state['overlays']) and (
+                state.get('snapshot_id') != snapshot_id or state.get('columns') != names
+                or state['high_water_id'] > max_id):
+            # Reviews reloaded, another database, or the schema changed (e.g. new derived columns): start over
+            for path in glob.glob(os.path.join(self.snapshot_dir, '*.parquet')):
+                os.remove(path)
+            state = self.empty_state()
+        exported_high_water = state['high_water_id']
+        state.update(snapshot_id=snapshot_id, columns=names)
+        select_list = ', '.join(f'"{name}"' for name in names)
+
+        # New rows: everything above the high-water mark, one Parquet part per chunk
+        new_rows = 0
+        query = text(f"""
+            SELECT {select_list} FROM ryanair_reviews
+            WHERE id > :high_water_id ORDER BY id
+        """)
+        for chunk in pd.read_sql(query, self.engine, params={'high_water_id': state['high_water_id']},
+                                 chunksize=self.chunk_size):
+            if chunk.empty:
+                continue
+            chunk = self.normalize_types(chunk, columns)
+            state['parts'] += 1
+            chunk.to_parquet(os.path.join(self.snapshot_dir, f"part-{state['parts']:06d}.parquet"), index=False)
+            state['high_water_id'] = int(chunk['id'].max())
+            new_rows += len(chunk)
+
+        # Rows changed since they were exported: sentiment written or replaced, late columns filled in
+        updated_rows = 0
+        if exported_high_water >= 0:
+            changed = self.changed_ids(state, names, exported_high_water)
+            for start in range(0, len(changed), 900):
+                params = {f'id{i}': int(v) for i, v in enumerate(changed[start:start + 900])}
+                updates = pd.read_sql(text(f"""
+                    SELECT {select_list} FROM ryanair_reviews
+                    WHERE id IN ({', '.join(':' + name for name in params)})
+                """), self.engine, params=params)
+                if updates.empty:
+                    continue
+                state['overlays'] += 1
+                self.normalize_types(updates, columns).to_parquet(
+                    os.path.join(self.snapshot_dir, f"update-{state['overlays']:06d}.parquet"), index=False
+                )
+                updated_rows += len(updates)
+        state['analyzed_since'] = None if analyzed_since is None else str(analyzed_since)
+
+        self.save_state(state)
+        self.last_refresh = time.time()
+        with self.lock:
+            self.create_view()
+        print(f"Analytics snapshot refreshed: {new_rows} new rows, {updated_rows} updated rows")
+        return new_rows, updated_rows
+
+    def snapshot_values(self, ids, columns):
+        """{id: tuple of columns} as the snapshot has them"""
+        values = {}
+        with self.lock:
+            for start in range(0, len(ids), 900):
+                rows = self.connect().execute(
+                    f"SELECT id, {', '.join(columns)} FROM ryanair_reviews "
+                    f"WHERE id IN ({', '.join(str(int(v)) for v in ids[start:start + 900])})"
+                ).fetchall()
+                values.update((int(row[0]), row[1:]) for row in rows)
+        return values
+
+    def changed_ids(self, state, names, high_water_id):
+        """Ids of rows up to high_water_id (exported by earlier refreshes) that changed on the primary database
+        since the last refresh"""
+        # Sentiment written or replaced since then. AnalyzedAt is compared inclusively, so a result saved in the
+        # same second as the previous refresh's newest one is not missed; only rows whose values differ from
+        # the snapshot's are exported again.
+        since = "AnalyzedAt >= :since" if state['analyzed_since'] else "AnalyzedAt IS NOT NULL"
+        with self.engine.connect() as conn:
+            results = {int(row[0]): tuple(row[1:]) for row in conn.execute(text(f"""
+                SELECT review_id, Sentiment, SentimentReason FROM review_sentiment
+                WHERE {since} AND review_id <= :high_water_id
+            """), {'since': state['analyzed_since'], 'high_water_id': high_water_id})}
+        exported = self.snapshot_values(sorted(results), ['Sentiment', 'SentimentReason'])
+        changed = {review_id for review_id, values in results.items() if exported.get(review_id) != values}
+
+        # Late columns still empty in the snapshot that the primary database has filled in since
+        late = [name for name in names if name.lower() in {column.lower() for column in LATE_COLUMNS}]
+        if not late:
+            return sorted(changed)
+        with self.lock:
+            missing = self.connect().execute(
+                f"SELECT id FROM ryanair_reviews WHERE id <= {int(high_water_id)} "
+                f"AND ({' OR '.join(f'{name} IS NULL' for name in late)})"
+            ).fetchdf()
+        missing = sorted(set(missing['id'].astype(int)) - changed)
+        filled = ' OR '.join(f'"{name}" IS NOT NULL' for name in late)
+        with self.engine.connect() as conn:
+            for start in range(0, len(missing), 900):
+                params = {f'id{i}': v for i, v in enumerate(missing[start:start + 900])}
+                rows = conn.execute(text(f"""
+                    SELECT id, {', '.join(f'"{name}"' for name in late)} FROM ryanair_reviews
+                    WHERE id IN ({', '.join(':' + name for name in params)}) AND ({filled})
+                """), params).fetchall()
+                exported = self.snapshot_values([int(row[0]) for row in rows], late)
+                changed.update(int(row[0]) for row in rows if any(
+                    value is not None and old is None for value, old in zip(row[1:], exported.get(int(row[0]), ()))
+                ))
+        return sorted(changed)
+
+    def maybe_refresh(self):
+        """Refresh if the snapshot is older than refresh_interval seconds"""
+        if time.time() - self.last_refresh < self.refresh_interval:
+            return
+        with self.refresh_lock:
+            # Another agent may have refreshed while this one waited for the lock
+            if time.time() - self.last_refresh >= self.refresh_interval:
+                self.refresh()
+
+    # ------------------------------
+    # DuckDB execution
+    # ------------------------------
+    def connect(self):
+        if self.connection is None:
+            self.connection = duckdb.connect()
+            # SQLite and PostgreSQL divide integers as integers (5 / 2 = 2)
+            self.connection.execute("SET integer_division = true")
+            self.create_view()
+        return self.connection
+
+    def create_view(self):
+        """(Re)define the ryanair_reviews view over the base parts, each row replaced by its latest update"""
+        connection = self.connection or self.connect()
+        parts = os.path.join(self.snapshot_dir, 'part-*.parquet')
+        overlays = os.path.join(self.snapshot_dir, 'update-*.parquet')
+        if not glob.glob(parts):
+            return
+        if glob.glob(overlays):
+            # Update parts are numbered, so the latest file name holds a row's newest version
+            connection.execute(f"""
+                CREATE OR REPLACE VIEW ryanair_reviews AS
+                WITH updates AS (
+                    SELECT * EXCLUDE (filename) FROM read_parquet('{overlays}', filename = true)
+                    QUALIFY row_number() OVER (PARTITION BY id ORDER BY filename DESC) = 1
+                )
+                SELECT b.* FROM read_parquet('{parts}') b WHERE b.id NOT IN (SELECT id FROM updates)
+                UNION ALL
+                SELECT * FROM updates
+            """)
+        else:
+            connection.execute(f"CREATE OR REPLACE VIEW ryanair_reviews AS SELECT * FROM read_parquet('{parts}')")
+
+    def should_route(self, sql):
+        """True for single read-only aggregate statements over ryanair_reviews only"""
+        statement = sql.strip().rstrip(';')
+        if ';' in statement or not re.match(r"^\s*(SELECT|WITH)\b", statement, re.IGNORECASE):
+            return False
+        if WRITE_PATTERN.search(statement) or SQLITE_ONLY_PATTERN.search(statement):
+            return False
+        tables = {t.lower() for t in TABLE_PATTERN.findall(statement)}
+        if tables - {'ryanair_reviews'}:
+            return False
+        return bool(AGGREGATE_PATTERN.search(statement)) and self.load_state()['parts'] > 0
+
+    def duckdb_sql(self, sql):
+        """sql with the primary database's LIKE semantics"""
+        if not is_sqlite(self.engine):
+            return sql
+        parts = STRING_LITERAL.split(sql)
+        return ''.join(part if i % 2 else LIKE_PATTERN.sub('ILIKE', part) for i, part in enumerate(parts))
+
+    def query(self, sql):
+        """Run SQL on the DuckDB snapshot and return a DataFrame"""
+        with self.lock:
+            return self.connect().execute(self.duckdb_sql(sql.strip().rstrip(';'))).fetchdf()
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    AnalyticsEngine().refresh()
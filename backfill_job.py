@@ -0,0 +1,312 @@
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+import pandas as pd
+from sqlalchemy import text
+
+from near_duplicates import representative_sentiment
+from review_topics import save_review_topics
+from sentiment_agent import SentimentAgent, save_sentiments
+from sqlite_config import autoincrement_pk, get_engine, is_sqlite, prepare_review_tables
+
+
+# ==============================
+# Job tables
+# ==============================
+def create_job_tables(engine=None):
+    """Create the tables that track backfill jobs, leased id ranges and per-review failures"""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        if is_sqlite(engine):
+            # WAL lets the workers write while the coordinator reads progress
+            conn.execute(text("PRAGMA journal_mode=WAL"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS sentiment_jobs (
+                job_id {autoincrement_pk(engine)},
+                status TEXT DEFAULT 'RUNNING',
+                total_reviews INTEGER,
+                chunk_size INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS sentiment_job_ranges (
+                job_id INTEGER NOT NULL,
+                range_start INTEGER NOT NULL,
+                range_end INTEGER NOT NULL,
+                status TEXT DEFAULT 'PENDING',
+                worker TEXT,
+                leased_at TIMESTAMP,
+                checkpoint_id INTEGER,
+                processed INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                PRIMARY KEY (job_id, range_start)
+            )
+        """))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS sentiment_job_failures (
+                id {autoincrement_pk(engine)},
+                job_id INTEGER NOT NULL,
+                review_id INTEGER NOT NULL,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        conn.commit()
+
+
+def create_job(chunk_size=500):
+    """Split all pending review ids into ranges of chunk_size reviews and register a new job"""
+    engine = get_engine()
+    create_job_tables(engine)
+    prepare_review_tables(engine)
+
+    ids = pd.read_sql("SELECT review_id FROM review_pending ORDER BY review_id", engine)['review_id'].tolist()
+    if not ids:
+        print("All reviews already have sentiment analysis!")
+        return None
+
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            INSERT INTO sentiment_jobs (total_reviews, chunk_size) VALUES (:total, :chunk_size)
+            RETURNING job_id
+        """), {'total': len(ids), 'chunk_size': chunk_size})
+        job_id = result.scalar()
+        ranges = [
+            {'job_id': job_id, 'range_start': int(ids[i]), 'range_end': int(ids[min(i + chunk_size, len(ids)) - 1])}
+            for i in range(0, len(ids), chunk_size)
+        ]
+        conn.execute(text("""
+            INSERT INTO sentiment_job_ranges (job_id, range_start, range_end)
+            VALUES (:job_id, :range_start, :range_end)
+        """), ranges)
+        conn.commit()
+
+    print(f"Created job {job_id}: {len(ids)} reviews in {len(ranges)} ranges")
+    return job_id
+
+
+# ==============================
+# Worker
+# ==============================
+def lease_range(engine, job_id, worker):
+    """Atomically lease the next pending range for this worker; returns a row or None"""
+    with engine.connect() as conn:
+        conn.execute(text("""
+            UPDATE sentiment_job_ranges
+            SET status = 'LEASED', worker = :worker, leased_at = CURRENT_TIMESTAMP
+            WHERE job_id = :job_id AND status = 'PENDING' AND range_start = (
+                SELECT range_start FROM sentiment_job_ranges
+                WHERE job_id = :job_id AND status = 'PENDING'
+                ORDER BY range_start LIMIT 1
+            )
+        """), {'job_id': job_id, 'worker': worker})
+        conn.commit()
+        return conn.execute(text("""
+            SELECT range_start, range_end, checkpoint_id FROM sentiment_job_ranges
+            WHERE job_id = :job_id AND worker = :worker AND status = 'LEASED'
+        """), {'job_id': job_id, 'worker': worker}).first()
+
+
+def process_range(engine, agent, job_id, range_start, range_end, checkpoint_id):
+    """Analyze every pending review in a leased range, checkpointing after each review"""
+    start_after = checkpoint_id if checkpoint_id is not None else range_start - 1
+    df = pd.read_sql(text("""
+        SELECT r.id, r.Comment as comment
+        FROM review_pending p JOIN ryanair_reviews r ON r.id = p.review_id
+        WHERE p.review_id > :start_after AND p.review_id <= :range_end
+        ORDER BY p.review_id
+    """), engine, params={'start_after': int(start_after), 'range_end': int(range_end)})
+
+    for _, row in df.iterrows():
+        review_id = int(row['id'])
+        sentiment_result, error = representative_sentiment(engine, [review_id]).get(review_id), None
+        if not sentiment_result:
+            sentiment_result, error = agent.try_sentiment(row['comment'])
+
+        # The review update and the checkpoint move together, so a crash never loses or repeats work
+        with engine.begin() as conn:
+            if sentiment_result:
+                row = agent.result_row(review_id, sentiment_result)
+                save_sentiments(conn, [row])
+                save_review_topics(conn, review_id, row['reason'])
+            else:
+                conn.execute(text("""
+                    INSERT INTO sentiment_job_failures (job_id, review_id, error)
+                    VALUES (:job_id, :review_id, :error)
+                """), {'job_id': job_id, 'review_id': review_id, 'error': error[:500]})
+            conn.execute(text(f"""
+                UPDATE sentiment_job_ranges
+                SET checkpoint_id = :review_id,
+                    {'processed = processed + 1' if sentiment_result else 'failed = failed + 1'}
+                WHERE job_id = :job_id AND range_start = :range_start
+            """), {'review_id': review_id, 'job_id': job_id, 'range_start': range_start})
+
+    with engine.connect() as conn:
+        conn.execute(text("""
+            UPDATE sentiment_job_ranges SET status = 'DONE'
+            WHERE job_id = :job_id AND range_start = :range_start
+        """), {'job_id': job_id, 'range_start': range_start})
+        conn.commit()
+
+
+def worker_loop(job_id, worker, ollama_urls):
+    """Lease and process ranges until the job has no pending ranges left"""
+    # Ctrl-C is handled by the coordinator, which terminates the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = get_engine()
+    agent = SentimentAgent(ollama_urls=ollama_urls)
+    while True:
+        leased = lease_range(engine, job_id, worker)
+        if leased is None:
+            # A concurrent worker may have won the same range; stop only when none are left
+            with engine.connect() as conn:
+                pending = conn.execute(text("""
+                    SELECT COUNT(*) FROM sentiment_job_ranges WHERE job_id = :job_id AND status = 'PENDING'
+                """), {'job_id': job_id}).scalar()
+            if not pending:
+                return
+            continue
+        process_range(engine, agent, job_id, *leased)
+
+
+# ==============================
+# Coordinator
+# ==============================
+def job_progress(engine, job_id):
+    """Return (total_reviews, processed, failed, ranges_left) for a job"""
+    row = pd.read_sql(text("""
+        SELECT j.total_reviews,
+               COALESCE(SUM(r.processed), 0) AS processed,
+               COALESCE(SUM(r.failed), 0) AS failed,
+               SUM(CASE WHEN r.status != 'DONE' THEN 1 ELSE 0 END) AS ranges_left
+        FROM sentiment_jobs j JOIN sentiment_job_ranges r ON r.job_id = j.job_id
+        WHERE j.job_id = :job_id
+        GROUP BY j.job_id
+    """), engine, params={'job_id': job_id})
+    if row.empty:
+        return None
+    r = row.iloc[0]
+    return int(r['total_reviews']), int(r['processed']), int(r['failed']), int(r['ranges_left'] or 0)
+
+
+def print_status(job_id):
+    """Print the progress of a job and its recorded failures"""
+    engine = get_engine()
+    create_job_tables(engine)
+    progress = job_progress(engine, job_id)
+    if progress is None:
+        print(f"Job {job_id} not found")
+        return
+    total, processed, failed, ranges_left = progress
+    print(f"Job {job_id}: {processed + failed}/{total} reviews done "
+          f"({processed} analyzed, {failed} failed), {ranges_left} ranges left")
+
+
+def run_job(job_id, workers=None, ollama_urls=None):
+    """Run (or resume) a job with N worker processes, printing progress and ETA until it finishes"""
+    engine = get_engine()
+    create_job_tables(engine)
+    workers = workers or os.cpu_count() or 1
+    ollama_urls = ollama_urls or ["http://localhost:11434"]
+
+    progress = job_progress(engine, job_id)
+    if progress is None:
+        print(f"Job {job_id} not found")
+        return
+
+    # Ranges leased by a previous (crashed or interrupted) run go back to the pool;
+    # their checkpoint_id makes the next lease resume right after the last finished review
+    with engine.connect() as conn:
+        conn.execute(text("""
+            UPDATE sentiment_job_ranges SET status = 'PENDING', worker = NULL
+            WHERE job_id = :job_id AND status = 'LEASED'
+        """), {'job_id': job_id})
+        conn.execute(text("UPDATE sentiment_jobs SET status = 'RUNNING' WHERE job_id = :job_id"),
+                     {'job_id': job_id})
+        conn.commit()
+
+    total, processed, failed, _ = progress
+    done_at_start = processed + failed
+    print(f"Running job {job_id} with {workers} workers across {len(ollama_urls)} model server(s)")
+
+    processes = [
+        multiprocessing.Process(
+            target=worker_loop,
+            args=(job_id, f"{os.getpid()}-{i}", ollama_urls),
+            daemon=True
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    start = time.time()
+    try:
+        while any(process.is_alive() for process in processes):
+            time.sleep(2)
+            total, processed, failed, ranges_left = job_progress(engine, job_id)
+            done = processed + failed
+            rate = (done - done_at_start) / (time.time() - start)
+            eta = (total - done) / rate if rate > 0 else float('inf')
+            eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta != float('inf') else '--:--:--'
+            print(f"Progress: {done}/{total} ({100 * done / total:.1f}%), "
+                  f"{failed} failed, {rate:.2f} reviews/s, ETA {eta_text}")
+    except KeyboardInterrupt:
+        print("\nInterrupted - resume later with: python backfill_job.py resume", job_id)
+        for process in processes:
+            process.terminate()
+        return
+
+    # Workers also exit when one of them crashed: a range it leased is still unfinished
+    ranges_left = job_progress(engine, job_id)[3]
+    with engine.connect() as conn:
+        if ranges_left:
+            conn.execute(text("UPDATE sentiment_jobs SET status = 'FAILED' WHERE job_id = :job_id"),
+                         {'job_id': job_id})
+        else:
+            conn.execute(text("""
+                UPDATE sentiment_jobs SET status = 'DONE', finished_at = CURRENT_TIMESTAMP
+                WHERE job_id = :job_id
+            """), {'job_id': job_id})
+        conn.commit()
+    print_status(job_id)
+    if ranges_left:
+        print(f"Workers exited with {ranges_left} ranges unfinished - resume with: python backfill_job.py resume",
+              job_id)
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumable multi-process sentiment backfill")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    start_parser = subparsers.add_parser("start", help="Create a job for all pending reviews and run it")
+    start_parser.add_argument("--chunk-size", type=int, default=500)
+
+    resume_parser = subparsers.add_parser("resume", help="Resume an interrupted job")
+    resume_parser.add_argument("job_id", type=int)
+
+    status_parser = subparsers.add_parser("status", help="Show job progress")
+    status_parser.add_argument("job_id", type=int)
+
+    for sub in (start_parser, resume_parser):
+        sub.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+        sub.add_argument("--ollama-url", action="append", dest="ollama_urls",
+                         help="Model server URL; repeat to load-balance across servers")
+
+    args = parser.parse_args()
+    if args.command == "start":
+        job_id = create_job(args.chunk_size)
+        if job_id is not None:
+            run_job(job_id, args.workers, args.ollama_urls)
+    elif args.command == "resume":
+        run_job(args.job_id, args.workers, args.ollama_urls)
+    elif args.command == "status":
+        print_status(args.job_id)
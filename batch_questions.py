@@ -0,0 +1,130 @@
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from query_agent import QueryAgent
+
+
+# ==============================
+# Input
+# ==============================
+def load_questions(path):
+    """Questions from a text file (one per line, '#' comments allowed) or JSON Lines with a "question" field.
+
+    JSON Lines records may carry an "id"; other questions are numbered by line.
+    """
+    questions = []
+    with open(path, encoding='utf-8') if path != '-' else sys.stdin as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('{'):
+                record = json.loads(line)
+                questions.append({'id': record.get('id', line_number), 'question': record['question']})
+            else:
+                questions.append({'id': line_number, 'question': line})
+    return questions
+
+
+# ==============================
+# Batch runner
+# ==============================
+class BatchRunner:
+    """Answers questions concurrently with at most `workers` in flight.
+
+    Each answer's SQL, result and timings come back in its own QueryResult. Every
+    worker thread still gets its own agent, so the LLM clients and the prompt token
+    counts are not shared; the engine's connection pool and the LLM endpoints are.
+    """
+
+    def __init__(self, workers=4, max_rows=100, quiet=True):
+        self.workers = workers
+        self.max_rows = max_rows
+        self.quiet = quiet
+        self.local = threading.local()
+        self.init_lock = threading.Lock()
+
+    def agent(self):
+        if not hasattr(self.local, 'agent'):
+            on_event = (lambda kind, message: None) if self.quiet else None
+            # One at a time: QueryAgent() runs the schema migrations (date columns, log tables)
+            with self.init_lock:
+                self.local.agent = QueryAgent(on_event=on_event)
+            # Nobody watches a batch answer arrive: skip the estimate and run the exact query only
+            self.local.agent.progressive = False
+        return self.local.agent
+
+    def result_records(self, df):
+        """Result rows as JSON-safe records, capped at max_rows"""
+        if df is None:
+            return None, 0
+        rows = df.head(self.max_rows).to_json(orient='records', date_format='iso')
+        return json.loads(rows), len(df)
+
+    def answer(self, item):
+        """Answer one question; never raises, failures are reported in the record"""
+        start = time.perf_counter()
+        record = {'id': item['id'], 'question': item['question'], 'sql': None, 'answer': None,
+                  'result': None, 'row_count': 0, 'repairs': 0, 'timings': {}, 'error': None}
+        try:
+            agent = self.agent()
+            result = agent.answer_question(item['question'])
+            record['answer'] = result.answer
+            record['sql'] = result.sql
+            record['result'], record['row_count'] = self.result_records(result.df)
+            record['repairs'] = result.repairs
+            record['timings'] = dict(result.timings)
+            if result.df is not None and 'UnfixableError' in result.df.columns:
+                record['error'] = str(result.df['UnfixableError'].iloc[0])
+            elif result.sql is None:
+                record['error'] = record['answer']
+        except Exception as e:
+            record['error'] = str(e)
+        record['timings']['total_ms'] = int((time.perf_counter() - start) * 1000)
+        return record
+
+    def run(self, questions, output):
+        """Answer all questions and write one JSON line per question to output, in input order.
+
+        Returns the number of questions that failed.
+        """
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for record in executor.map(self.answer, questions):
+                output.write(json.dumps(record, default=str) + '\n')
+                output.flush()
+                failed += record['error'] is not None
+                status = 'FAILED' if record['error'] else 'ok'
+                print(f"[{record['id']}] {status} in {record['timings']['total_ms']} ms "
+                      f"({record['repairs']} repairs): {record['question'][:60]}", file=sys.stderr)
+        return failed
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions concurrently and write JSON Lines")
+    parser.add_argument("questions", help="Text file with one question per line, or JSON Lines ('-' for stdin)")
+    parser.add_argument("--output", "-o", default="-", help="JSON Lines output path (default stdout)")
+    parser.add_argument("--workers", type=int, default=4, help="Questions answered in parallel")
+    parser.add_argument("--max-rows", type=int, default=100, help="Result rows kept per question")
+    parser.add_argument("--verbose", action="store_true", help="Print the agent's progress messages")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    runner = BatchRunner(args.workers, args.max_rows, quiet=not args.verbose)
+    start = time.time()
+    output = open(args.output, 'w', encoding='utf-8') if args.output != '-' else sys.stdout
+    try:
+        failed = runner.run(questions, output)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Answered {len(questions) - failed}/{len(questions)} questions in {time.time() - start:.1f}s "
+          f"with {args.workers} workers", file=sys.stderr)
+    sys.exit(1 if failed else 0)
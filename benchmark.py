@@ -0,0 +1,611 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+from sqlalchemy import text
+
+import sqlite_config
+from prompt_builder import (DEFAULT_TOKEN_BUDGET, FEW_SHOT_EXAMPLES, build_query_prompt, build_repair_prompt,
+                            estimate_tokens)
+from sentiment_agent import SentimentAgent, load_sentiment_data
+from sqlite_config import REVIEWS_TABLE, get_dialect, get_engine, reset_engine, setup_sqlite_db
+
+# ==============================
+# Legacy prompts (baseline for comparisons)
+# ==============================
+LEGACY_SENTIMENT_PROMPT = """You are a sentiment analysis expert. You will receive customer reviews and classify sentiment as "Positive", "Neutral", or "Negative". Respond ONLY in JSON format.
+
+Examples:
+Review: "The check-in process was smooth and the flight was on time. Great service overall!"
+{{"review": "The check-in process was smooth and the flight was on time. Great service overall!", "sentiment": "Positive", "reason": "smooth check-in, on time, great service"}}
+
+Review: "It was okay, nothing special. Seats were a bit cramped."
+{{"review": "It was okay, nothing special. Seats were a bit cramped.", "sentiment": "Neutral", "reason": "okay experience, minor complaint about seats"}}
+
+Review: "Very disappointed with the delay and rude staff."
+{{"review": "Very disappointed with the delay and rude staff.", "sentiment": "Negative", "reason": "disappointed, delay, rude staff"}}
+
+Now analyze this review:
+Review: "{review_text}"
+"""
+
+
+BENCHMARK_QUESTIONS = [
+    "How many customers from the United States were happy?",
+    "What's the average rating by country?",
+    "Which aircraft has the most complaints?",
+    "How many reviews mention delays?",
+    "What is the average value for money for business travellers?",
+    "Which routes have the worst seat comfort?",
+    "How many passengers complained about rude staff?",
+    "What percentage of reviews recommend Ryanair?",
+    "How many negative reviews were published in 2023?",
+    "Which countries complain most about baggage fees?",
+]
+
+
+def load_sample_reviews(limit):
+    """Load a sample of review comments for benchmarking"""
+    engine = get_engine()
+    query = text("""
+        SELECT Comment as comment FROM ryanair_reviews
+        WHERE Comment IS NOT NULL AND Comment != ''
+        ORDER BY id LIMIT :limit
+    """)
+    return pd.read_sql(query, engine, params={'limit': limit})['comment'].tolist()
+
+
+# ==============================
+# Sentiment output tokens per review
+# ==============================
+def bench_sentiment_tokens(limit=20):
+    """Compare output tokens per review for the legacy (echoing) and compact sentiment contracts"""
+    agent = SentimentAgent()
+    reviews = load_sample_reviews(limit)
+
+    try:
+        requests.get(f"{agent.ollama_url}/api/tags", timeout=2)
+        live = True
+    except requests.RequestException:
+        live = False
+        print(f"⚠️ Ollama not reachable at {agent.ollama_url}; using estimated token counts")
+
+    legacy_tokens, compact_tokens = [], []
+    legacy_time, compact_time = 0.0, 0.0
+    for comment in reviews:
+        if live:
+            start = time.perf_counter()
+            response = requests.post(
+                f"{agent.ollama_url}/api/generate",
+                json={
+                    "model": agent.model,
+                    "prompt": LEGACY_SENTIMENT_PROMPT.format(review_text=comment),
+                    "stream": False
+                }
+            )
+            legacy_time += time.perf_counter() - start
+            legacy_tokens.append(response.json().get('eval_count', 0))
+
+            start = time.perf_counter()
+            agent.analyze_sentiment(comment)
+            compact_time += time.perf_counter() - start
+            compact_tokens.append(agent.last_output_tokens)
+        else:
+            reason = "delay, rude staff, extra fees"
+            legacy_tokens.append(estimate_tokens(
+                f'{{"review": "{comment}", "sentiment": "Negative", "reason": "{reason}"}}'
+            ))
+            compact_tokens.append(estimate_tokens(f'{{"label": "neg", "reason": "{reason}"}}'))
+
+    n = len(reviews)
+    legacy_avg = sum(legacy_tokens) / n
+    compact_avg = sum(compact_tokens) / n
+    print(f"\n📊 Sentiment output tokens per review ({n} reviews)")
+    print(f"Legacy contract:  {legacy_avg:.1f} tokens/review")
+    print(f"Compact contract: {compact_avg:.1f} tokens/review")
+    print(f"Reduction:        {100 * (1 - compact_avg / legacy_avg):.1f}%")
+    if live:
+        print(f"Latency: legacy {legacy_time / n:.2f}s/review, compact {compact_time / n:.2f}s/review")
+
+
+# ==============================
+# Query prompt size
+# ==============================
+def bench_prompt_tokens(limit=20, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Compare prompt tokens for the full fixed prompt and the question-specific prompt"""
+    questions = BENCHMARK_QUESTIONS[:limit]
+    full_total, compact_total = 0, 0
+
+    print(f"\n📊 Query prompt tokens (budget {token_budget})")
+    for question in questions:
+        _, full_tokens = build_query_prompt(question, token_budget=None)
+        _, compact_tokens = build_query_prompt(question, token_budget=token_budget)
+        full_total += full_tokens
+        compact_total += compact_tokens
+        print(f"{full_tokens:>5} → {compact_tokens:>4}  {question}")
+
+    _, repair_compact = build_repair_prompt("SELECT ...", "no such column", questions[0], token_budget=token_budget)
+
+    n = len(questions)
+    print(f"Average generate_sql prompt: {full_total / n:.0f} → {compact_total / n:.0f} tokens "
+          f"({100 * (1 - compact_total / full_total):.1f}% smaller)")
+    print(f"repair_sql prompt per attempt: {repair_compact} tokens")
+
+
+# ==============================
+# SQL repair rate with and without retrieved examples
+# ==============================
+def run_questions(agent, questions):
+    """Answer each question with fresh stats; returns (stats, seconds per question)"""
+    agent.stats = {"questions": 0, "repaired": 0, "failed": 0, "repair_attempts": 0}
+    start = time.perf_counter()
+    for question in questions:
+        agent.answer_question(question)
+    return agent.stats, (time.perf_counter() - start) / len(questions)
+
+
+def print_repair_stats(label, stats, seconds):
+    print(f"{label}: repair rate {100 * stats['repaired'] / stats['questions']:.1f}% "
+          f"({stats['repaired']}/{stats['questions']}), {stats['repair_attempts']} repair attempts, "
+          f"unfixable {stats['failed']}, {seconds:.2f}s/question")
+
+
+def bench_repair_rate(limit=20):
+    """Run the benchmark questions with retrieval off, then on, and report how often repair_sql was needed"""
+    from query_agent import QueryAgent
+
+    questions = BENCHMARK_QUESTIONS[:limit]
+    agent = QueryAgent()
+    # Both passes see the index as loaded: answers from the first must not become examples for the second,
+    # nor land in the production query_success_log
+    agent.log_successes = False
+    print(f"\n📊 SQL repair rate ({len(questions)} questions, {len(agent.example_index)} verified examples indexed)")
+
+    for use_retrieval in (False, True):
+        agent.use_retrieval = use_retrieval
+        stats, seconds = run_questions(agent, questions)
+        print_repair_stats("with retrieval   " if use_retrieval else "without retrieval", stats, seconds)
+
+
+def bench_dialect_repairs(limit=20):
+    """Compare repair attempts when prompts name the wrong dialect vs the active backend's dialect"""
+    from query_agent import QueryAgent
+
+    questions = BENCHMARK_QUESTIONS[:limit]
+    agent = QueryAgent()
+    agent.use_retrieval = False
+    agent.log_successes = False
+    actual = agent.dialect
+    mismatched = "PostgreSQL" if actual != "PostgreSQL" else "SQLite"
+    print(f"\n📊 Repair attempts by prompt dialect ({len(questions)} questions, backend {actual})")
+
+    for dialect in (mismatched, actual):
+        agent.dialect = dialect
+        stats, seconds = run_questions(agent, questions)
+        print_repair_stats(f"prompts say {dialect:<10}", stats, seconds)
+
+
+# ==============================
+# Throughput across Ollama endpoints
+# ==============================
+class StandInOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for an Ollama server that serves one generation at a time"""
+
+    latency = 0.2
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"models": []}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        # A CPU-only box generates one reply at a time
+        with self.server.slot:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.end_headers()
+        for token in ['{"label": "', 'neg', '", "reason": "', 'delay', ', rude staff', '"}']:
+            self.wfile.write((json.dumps({"response": token, "done": False}) + "\n").encode())
+
+
+def start_stand_in_servers(count, latency=0.2):
+    """Start stand-in Ollama servers on free local ports; returns their URLs"""
+    urls = []
+    for _ in range(count):
+        handler = type("Handler", (StandInOllamaHandler,), {"latency": latency})
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        server.slot = threading.Lock()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls.append(f"http://127.0.0.1:{server.server_port}")
+    return urls
+
+
+def bench_endpoint_scaling(limit=20, endpoints=4, ollama_urls=None):
+    """Measure sentiment throughput as endpoints are added to the pool"""
+    urls = ollama_urls or start_stand_in_servers(endpoints)
+    reviews = load_sample_reviews(limit)
+
+    print(f"\n📊 Sentiment throughput by endpoint count ({len(reviews)} reviews)")
+    baseline = None
+    for n in range(1, len(urls) + 1):
+        agent = SentimentAgent(ollama_urls=urls[:n])
+        start = time.perf_counter()
+        agent.analyze_many(reviews)
+        throughput = len(reviews) / (time.perf_counter() - start)
+        baseline = baseline or throughput
+        requests_per_endpoint = [e['requests'] for e in agent.pool.stats()]
+        print(f"{n} endpoint(s): {throughput:.2f} reviews/s ({throughput / baseline:.2f}x), "
+              f"requests per endpoint {requests_per_endpoint}")
+
+
+class StandInChatHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions server standing in for the Hugging Face models.
+
+    With break_generation every generated query fails, and each repair reply is valid with
+    probability repair_success; reply latency varies by +-50% around latency.
+    """
+
+    latency = 0.3
+    sql = "SELECT Sentiment, COUNT(*) AS Reviews FROM ryanair_reviews GROUP BY Sentiment;"
+    broken_sql = "SELECT Sentiment, COUNT(*) AS Reviews FROM ryanair_review GROUP BY Sentiment;"
+    break_generation = False
+    repair_success = 1.0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+        prompt = body["messages"][-1]["content"]
+        repair = "Broken SQL:" in prompt
+        with self.server.lock:
+            self.server.calls += 1
+            self.server.repair_calls += repair
+            jitter, draw = self.server.rng.uniform(0.5, 1.5), self.server.rng.random()
+        time.sleep(self.latency * jitter)
+        # interpret_question gets the question back unchanged, everything else an aggregate query
+        if "Rewritten:" in prompt:
+            content = prompt.split("User:", 1)[1].split("Rewritten:", 1)[0].strip()
+        elif repair:
+            content = self.sql if draw < self.repair_success else self.broken_sql
+        else:
+            content = self.broken_sql if self.break_generation else self.sql
+        data = json.dumps({
+            "id": "stand-in", "object": "chat.completion", "created": int(time.time()), "model": "stand-in",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 10, "total_tokens": len(prompt) // 4 + 10},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_stand_in_chat_server(latency=0.3, seed=42, **behaviour):
+    """Start a stand-in chat completions server on a free local port and point QueryAgent at it"""
+    handler = type("Handler", (StandInChatHandler,), {"latency": latency, **behaviour})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.lock, server.calls, server.repair_calls, server.rng = threading.Lock(), 0, 0, random.Random(seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ['QUERY_MAIN_MODEL'] = os.environ['QUERY_REPAIR_MODEL'] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault('HF_API_KEY', 'stand-in')
+    return server
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+
+def bench_service_load(limit=80, distinct=4, workers=4, latency=0.3):
+    """Burst of concurrent requests for a few trending questions against the HTTP query service,
+    with and without single-flight coalescing, answered by a stand-in LLM server"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    from query_service import QueryService, start_server
+
+    llm = start_stand_in_chat_server(latency)
+    questions = [BENCHMARK_QUESTIONS[i % distinct] for i in range(limit)]
+
+    print(f"\n📊 Query service under a burst of {limit} requests for {distinct} distinct questions "
+          f"({workers} workers, stand-in LLM latency {latency}s)")
+    for coalesce in (False, True):
+        service = QueryService(workers, max_pending=limit, coalesce=coalesce)
+        server = start_server(service, port=0)
+        endpoint = f"http://127.0.0.1:{server.server_port}"
+
+        def ask(question):
+            start = time.perf_counter()
+            response = requests.post(f"{endpoint}/ask", json={"question": question}, timeout=600)
+            return response.status_code, (time.perf_counter() - start) * 1000
+
+        with ThreadPoolExecutor(max_workers=limit) as clients:
+            # Warm-up: one question per worker builds every worker's QueryAgent
+            list(clients.map(ask, [f"warm-up question {i}" for i in range(workers)]))
+            calls_before = llm.calls
+            start = time.perf_counter()
+            results = list(clients.map(ask, questions))
+            elapsed = time.perf_counter() - start
+
+        latencies = [ms for _, ms in results]
+        metrics = requests.get(f"{endpoint}/metrics", timeout=10).json()
+        server.shutdown()
+        print(f"coalescing {'on ' if coalesce else 'off'}: {limit / elapsed:.1f} req/s, "
+              f"p50 {statistics.median(latencies):.0f} ms, p95 {percentile(latencies, 0.95):.0f} ms, "
+              f"LLM calls {llm.calls - calls_before}, coalesced {metrics['coalesced']}, "
+              f"non-200 {sum(status != 200 for status, _ in results)}")
+
+
+def bench_repair_latency(limit=20, candidates=5, latency=0.5, repair_success=0.35, seed=42):
+    """Repair latency on failing queries: five sequential repair attempts vs speculative parallel candidates"""
+    from query_agent import QueryAgent
+
+    llm = start_stand_in_chat_server(latency, seed, break_generation=True, repair_success=repair_success)
+    agent = QueryAgent(on_event=lambda kind, message: None)
+    agent.use_retrieval = False
+    questions = [BENCHMARK_QUESTIONS[i % len(BENCHMARK_QUESTIONS)] for i in range(limit)]
+
+    print(f"\n📊 SQL repair latency on {limit} failing queries (stand-in LLM {latency}s +-50%, "
+          f"each repair valid with p={repair_success})")
+    p95 = {}
+    for label, k in (("sequential (5 attempts)", 0), (f"speculative ({candidates} parallel)", candidates)):
+        agent.speculative_repairs = k
+        llm.rng.seed(seed)
+        calls_before, timings, fixed = llm.repair_calls, [], 0
+        for question in questions:
+            result = agent.answer_question(question)
+            timings.append(result.timings.get("repair_ms", 0))
+            fixed += result.sql is not None
+        p95[k] = percentile(timings, 0.95)
+        print(f"{label}: p50 {statistics.median(timings):.0f} ms, p95 {p95[k]:.0f} ms, max {max(timings):.0f} ms, "
+              f"fixed {fixed}/{limit}, repair calls {llm.repair_calls - calls_before}")
+    print(f"p95 repair latency {100 * (1 - p95[candidates] / p95[0]):.0f}% lower with speculative repair")
+
+
+ANALYTICS_QUERIES = [
+    "SELECT PassengerCountry, AVG(OverallRating) AS avg_rating, COUNT(*) AS reviews FROM ryanair_reviews "
+    "GROUP BY PassengerCountry ORDER BY reviews DESC",
+    "SELECT Sentiment, COUNT(*) AS reviews FROM ryanair_reviews GROUP BY Sentiment",
+    "SELECT TypeOfTraveller, AVG(SeatComfort) AS seat, AVG(ValueForMoney) AS value FROM ryanair_reviews "
+    "GROUP BY TypeOfTraveller",
+]
+
+
+def bench_analytics(repeat=5):
+    """Compare aggregate query latency on the primary database vs the DuckDB/Parquet snapshot"""
+    from analytics_engine import AnalyticsEngine
+
+    analytics = AnalyticsEngine()
+    analytics.refresh()
+    engine = get_engine()
+
+    print(f"\n📊 Aggregate query latency, best of {repeat} (primary {get_dialect(engine)} vs DuckDB snapshot)")
+    for sql in ANALYTICS_QUERIES:
+        timings = {}
+        for name, run in (("primary", lambda: pd.read_sql(sql, engine)), ("duckdb", lambda: analytics.query(sql))):
+            best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                best = min(best, time.perf_counter() - start)
+            timings[name] = best
+        print(f"{sql[:60]}...: primary {1000 * timings['primary']:.1f} ms, duckdb {1000 * timings['duckdb']:.1f} ms "
+              f"({timings['primary'] / timings['duckdb']:.1f}x)")
+
+
+DATA_SCALE_QUERIES = {
+    "topic (fees)": FEW_SHOT_EXAMPLES[0]["sql"],
+    "avg rating by country": ANALYTICS_QUERIES[0],
+    "negatives by aircraft": next(e["sql"] for e in FEW_SHOT_EXAMPLES if "aircraft" in e["question"]),
+    "monthly trend 2023": next(e["sql"] for e in FEW_SHOT_EXAMPLES if "per month" in e["question"]),
+}
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    print(f"  {label}: {time.perf_counter() - start:.2f}s")
+    return result
+
+
+def bench_data_scale(scales=(10000, 100000), excel_rows=1000, seed=42):
+    """Ingestion, dashboard and query timings on synthetic databases of growing size"""
+    import synthetic_reviews
+
+    workdir = tempfile.mkdtemp(prefix="ryanair_scale_")
+    excel_path = os.path.join(workdir, "upload.xlsx")
+    synthetic_reviews.write_excel(excel_path, excel_rows, seed)
+
+    for rows in scales:
+        print(f"\n📊 {rows:,} synthetic reviews (files in {workdir})")
+        csv_path = os.path.join(workdir, f"reviews_{rows}.csv")
+        synthetic_reviews.write_csv(csv_path, rows, seed)
+
+        # Point the shared engine at a scratch database for this scale
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, f'reviews_{rows}.db')}"
+        reset_engine()
+        timed("setup_sqlite_db (CSV -> SQLite)", setup_sqlite_db, csv_path)
+
+        agent = timed("schema upkeep on start (date columns, indexes)", SentimentAgent)
+        agent.add_sentiment_column()
+
+        # Label 90% of the reviews from their rating so the dashboard has something to load
+        with get_engine().begin() as conn:
+            conn.execute(text(f"""
+                INSERT INTO review_sentiment (review_id, Sentiment, Model)
+                SELECT id, CASE WHEN OverallRating >= 7 THEN 'Positive'
+                                WHEN OverallRating >= 4 THEN 'Neutral' ELSE 'Negative' END, 'rating'
+                FROM {REVIEWS_TABLE} WHERE id % 10 != 0
+            """))
+            conn.execute(text("DELETE FROM review_pending WHERE review_id % 10 != 0"))
+
+        df = timed("load_sentiment_data", load_sentiment_data)
+        print(f"    {len(df):,} analyzed reviews loaded")
+        for label, sql in DATA_SCALE_QUERIES.items():
+            timed(f"query: {label}", pd.read_sql, text(sql), get_engine())
+        ids = timed(f"add_reviews_from_excel ({excel_rows} rows)", agent.add_reviews_from_excel, excel_path)
+        print(f"    {len(ids):,} reviews added")
+
+
+TEXT_STORAGE_QUERIES = {
+    "avg rating by country": ANALYTICS_QUERIES[0],
+    "negatives by aircraft": "SELECT Aircraft, COUNT(*) AS Reviews FROM ryanair_reviews WHERE Sentiment = 'Negative' "
+                             "GROUP BY Aircraft",
+    "search Comment for fees": "SELECT COUNT(*) FROM ryanair_reviews WHERE LOWER(Comment) LIKE '%fee%'",
+    "one review's Comment": "SELECT Comment FROM ryanair_reviews WHERE id = 4242",
+}
+
+
+def bytes_read():
+    """Bytes this process has read so far (Linux); every SQLite page-cache miss is one page-sized read"""
+    with open('/proc/self/io') as f:
+        return int(next(line for line in f if line.startswith('rchar:')).split()[1])
+
+
+def page_cache_stats(path, sql, cache_mb, repeat):
+    """(pages read on a cold connection, page-cache hit rate over `repeat` further runs, best ms)"""
+    conn = sqlite3.connect(path)
+    sqlite_config.register_sqlite_functions(conn, None)
+    sqlite_config.create_text_view(conn)
+    conn.execute(f"PRAGMA cache_size = -{cache_mb * 1024}")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    before = bytes_read()
+    conn.execute(sql).fetchall()
+    cold = (bytes_read() - before) // page_size
+    misses, best = 0, float('inf')
+    for _ in range(repeat):
+        before, start = bytes_read(), time.perf_counter()
+        conn.execute(sql).fetchall()
+        best = min(best, time.perf_counter() - start)
+        misses += (bytes_read() - before) // page_size
+    conn.close()
+    return cold, 1 - misses / (repeat * cold) if cold else 1.0, 1000 * best
+
+
+def bench_text_storage(rows=100000, cache_mb=32, repeat=3, seed=42):
+    """Database size, page-cache hit rate and latency with plain vs zstd-compressed review text"""
+    import shutil
+    import synthetic_reviews
+    from review_text import compress_review_text, storage_report, vacuum
+
+    workdir = tempfile.mkdtemp(prefix="ryanair_text_")
+    paths = {"plain": os.path.join(workdir, "plain.db"), "compressed": os.path.join(workdir, "compressed.db")}
+    synthetic_reviews.write_sqlite(paths["plain"], rows, seed)
+    sizes = {}
+    for label, path in paths.items():
+        if label == "compressed":
+            shutil.copy(paths["plain"], path)
+        os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+        reset_engine()
+        engine = get_engine()
+        sqlite_config.prepare_review_tables(engine)
+        if label == "compressed":
+            compress_review_text(engine)
+        vacuum(engine)
+        sizes[label] = storage_report(engine)
+        engine.dispose()
+
+    print(f"\n📊 {rows:,} synthetic reviews, plain vs compressed text (files in {workdir})")
+    for label, report in sizes.items():
+        print(f"{label}: file {report['file'] / 2**20:.1f} MB, {REVIEWS_TABLE} {report[REVIEWS_TABLE] / 2**20:.1f} MB"
+              + (f", review_text {report['review_text'] / 2**20:.1f} MB" if 'review_text' in report else ""))
+    print(f"Queries with a {cache_mb} MB SQLite page cache: pages read cold, hit rate and best time of {repeat} warm runs")
+    for name, sql in TEXT_STORAGE_QUERIES.items():
+        results = {label: page_cache_stats(path, sql, cache_mb, repeat) for label, path in paths.items()}
+        print(f"{name}: " + "; ".join(f"{label} {cold:,} pages, {hit_rate:.0%} hits, {ms:.1f} ms"
+                                      for label, (cold, hit_rate, ms) in results.items()))
+
+
+COLD_START_SCRIPTS = {
+    "CLI (import + build both agents)": """
+import main_agents
+from sentiment_agent import SentimentAgent
+from query_agent import QueryAgent
+SentimentAgent(); QueryAgent()
+print('heavy UI/LLM modules loaded:', [m for m in ('streamlit', 'huggingface_hub') if m in sys.modules])
+""",
+    "Streamlit app (first script run)": """
+from streamlit.testing.v1 import AppTest
+AppTest.from_file('streamlit_app.py', default_timeout=120).run()
+""",
+}
+
+
+def bench_cold_start(repeat=3):
+    """Wall time of fresh interpreters starting the CLI core and running the Streamlit script once"""
+    print(f"\n📊 Cold start, median of {repeat} fresh processes")
+    for label, script in COLD_START_SCRIPTS.items():
+        timings, output = [], ""
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable, "-c", "import sys\n" + script], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)))
+            timings.append(time.perf_counter() - start)
+            output = result.stdout if result.returncode == 0 else result.stderr[-500:]
+        print(f"{label}: {statistics.median(timings):.2f}s")
+        for line in output.splitlines():
+            if line.startswith("heavy") or result.returncode != 0:
+                print(f"  {line}")
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ryanair review analysis benchmarks")
+    parser.add_argument("benchmark", choices=["sentiment-tokens", "prompt-tokens", "repair-rate", "dialect-repairs",
+                                              "endpoint-scaling", "analytics", "data-scale",
+                                              "cold-start", "service-load", "repair-latency", "text-storage"])
+    parser.add_argument("--limit", type=int, default=20, help="Number of reviews/questions to use")
+    parser.add_argument("--endpoints", type=int, default=4, help="Stand-in Ollama servers to start")
+    parser.add_argument("--ollama-url", action="append", dest="ollama_urls",
+                        help="Use real model servers instead of stand-ins (repeatable)")
+    parser.add_argument("--token-budget", type=int, default=DEFAULT_TOKEN_BUDGET, help="Prompt token budget")
+    parser.add_argument("--scales", default="10000,100000",
+                        help="Comma-separated synthetic review counts for data-scale (e.g. 10000,100000,1000000)")
+    parser.add_argument("--excel-rows", type=int, default=1000, help="Rows in the data-scale upload file")
+    parser.add_argument("--workers", type=int, default=4, help="Query service workers for service-load")
+    parser.add_argument("--candidates", type=int, default=5, help="Parallel repair candidates for repair-latency")
+    parser.add_argument("--distinct", type=int, default=4, help="Distinct questions in the service-load burst")
+    parser.add_argument("--rows", type=int, default=100000, help="Synthetic reviews for text-storage")
+    parser.add_argument("--cache-mb", type=int, default=32, help="SQLite page cache for text-storage")
+    args = parser.parse_args()
+
+    if args.benchmark == "sentiment-tokens":
+        bench_sentiment_tokens(args.limit)
+    elif args.benchmark == "prompt-tokens":
+        bench_prompt_tokens(args.limit, args.token_budget)
+    elif args.benchmark == "repair-rate":
+        bench_repair_rate(args.limit)
+    elif args.benchmark == "dialect-repairs":
+        bench_dialect_repairs(args.limit)
+    elif args.benchmark == "endpoint-scaling":
+        bench_endpoint_scaling(args.limit, args.endpoints, args.ollama_urls)
+    elif args.benchmark == "analytics":
+        bench_analytics()
+    elif args.benchmark == "data-scale":
+        bench_data_scale([int(rows) for rows in args.scales.split(",")], args.excel_rows)
+    elif args.benchmark == "cold-start":
+        bench_cold_start()
+    elif args.benchmark == "service-load":
+        bench_service_load(args.limit, args.distinct, args.workers)
+    elif args.benchmark == "repair-latency":
+        bench_repair_latency(args.limit, args.candidates)
+    elif args.benchmark == "text-storage":
+        bench_text_storage(args.rows, args.cache_mb)
@@ -0,0 +1,251 @@
+import re
+import time
+
+import pandas as pd
+
+from prompt_builder import COLUMNS, select_columns, tokenize
+
+# Columns a follow-up may filter on by naming one of their values ("now only Germany")
+FILTER_COLUMNS = ['PassengerCountry', 'Aircraft', 'TypeOfTraveller', 'SeatType', 'Sentiment', 'Origin',
+                  'Destination', 'TripVerified', 'Recommended']
+# Columns a follow-up may regroup by ("by aircraft instead")
+GROUP_COLUMNS = ['PassengerCountry', 'Aircraft', 'TypeOfTraveller', 'SeatType', 'Origin', 'Destination',
+                 'Sentiment', 'TripVerified', 'Recommended', 'DatePublishedMonth', 'DateFlownMonth']
+VALUES_TTL = 600  # seconds the distinct filter values are cached
+
+FOLLOWUP_CUE = re.compile(
+    r"^\s*(now|then|and|also|ok(ay)?|same|what about|how about|only|just|but|sort|order|rank|top|bottom|first|"
+    r"last|show|group|break|split|by|per|limit|exclude|excluding|without|except|lowest|highest|least|most|"
+    r"worst|best)\b", re.IGNORECASE
+)
+MAX_FOLLOWUP_WORDS = 10
+# Words a follow-up may contain besides the values, columns and numbers its patterns consume; a question
+# with any other word asks for more than a refinement and is answered from scratch
+FOLLOWUP_WORDS = tokenize(
+    "now then and also ok okay same what how about only just but instead please the it them me show results "
+    "rows sort sorted order ordered rank ranked top bottom first last group grouped break down split by per "
+    "limit to exclude excluding without except not for from in asc ascending desc descending lowest highest "
+    "least most worst best smallest largest fewest increasing decreasing"
+)
+SQL_KEYWORDS = ['where', 'group', 'order', 'join', 'left', 'inner', 'on', 'limit', 'having', 'union']
+
+_filter_values = {'loaded_at': 0.0, 'values': []}
+
+
+def split_words(column):
+    """'AvgRating' -> 'avg rating'"""
+    return re.sub(r"([a-z])([A-Z])", r"\1 \2", column.strip('"')).replace('_', ' ').lower()
+
+
+def filter_values(engine):
+    """(value, column) pairs of the filterable columns, longest value first; cached for VALUES_TTL"""
+    if time.time() - _filter_values['loaded_at'] > VALUES_TTL:
+        values = []
+        for column in FILTER_COLUMNS:
+            df = pd.read_sql(f"SELECT DISTINCT {column} FROM ryanair_reviews WHERE {column} IS NOT NULL", engine)
+            values += [(str(v), column) for v in df.iloc[:, 0] if len(str(v)) >= 3]
+        _filter_values['values'] = sorted(values, key=lambda item: -len(item[0]))
+        _filter_values['loaded_at'] = time.time()
+    return _filter_values['values']
+
+
+def restrict_reviews(sql, condition, source='ryanair_reviews'):
+    """sql reading ryanair_reviews through (SELECT * FROM source WHERE condition), keeping any alias the query
+    gives it; None when the query does not read ryanair_reviews"""
+    keywords = '|'.join(SQL_KEYWORDS)
+    pattern = rf"\b(FROM|JOIN)\s+ryanair_reviews\b(?:\s+(?:AS\s+)?(?!(?:{keywords})\b)(\w+))?"
+    rewritten, count = re.subn(
+        pattern,
+        lambda m: f"{m.group(1)} (SELECT * FROM {source} WHERE {condition}) AS {m.group(2) or 'ryanair_reviews'}",
+        sql, flags=re.IGNORECASE
+    )
+    return rewritten if count else None
+
+
+class Conversation:
+    """State of one chat tab: the last SQL and its result.
+
+    Short refinements of the previous answer are applied without a new LLM round trip:
+    - filter ("now only Germany", "excluding Business"): on the cached DataFrame when the
+      value is in it, else as a subquery around ryanair_reviews in the cached SQL
+    - group change ("by aircraft instead"): the single GROUP BY column is swapped in the SQL
+    - sort ("sort by rating", "lowest first") and top-N ("top 5"): on the DataFrame
+    Only questions made up entirely of these patterns count as follow-ups; anything else goes through
+    QueryAgent.answer_question as before.
+    """
+
+    def __init__(self):
+        self.question = None
+        self.sql = None
+        self.df = None
+
+    def ask(self, agent, question):
+        """Answer a question, refining the previous result when it is a recognized follow-up"""
+        if self.df is not None:
+            try:
+                answer = self.answer_followup(agent, question)
+                if answer is not None:
+                    return answer
+            except Exception as e:
+                print(f"Follow-up could not be applied, asking from scratch: {e}")
+
+        result = agent.answer_question(question)
+        self.question = question
+        self.sql = result.sql
+        self.df = result.df if result.sql else None
+        return result.answer
+
+    # ------------------------------
+    # Follow-ups
+    # ------------------------------
+    def answer_followup(self, agent, question):
+        """Refined answer, or None when the question is not a follow-up this class understands"""
+        text = question.strip().rstrip('?.!').lower()
+        if not FOLLOWUP_CUE.match(text) or len(text.split()) > MAX_FOLLOWUP_WORDS:
+            return None
+
+        start = time.perf_counter()
+        sql, df, steps = self.sql, self.df, []
+
+        group_column = self.group_target(text)
+        value_filter = self.filter_target(agent, text, None if group_column else df)
+        if self.unexplained_words(text, group_column, value_filter):
+            return None
+
+        if group_column:
+            sql = self.regroup_sql(sql, group_column)
+            if sql is None:
+                return None
+            steps.append(f"grouped by {group_column}")
+
+        if value_filter:
+            column, value, exclude = value_filter
+            mask = df[column].astype(str).str.lower() == value.lower() if column in df.columns else None
+            if sql == self.sql and mask is not None and mask.any():
+                df = df[~mask] if exclude else df[mask]
+            else:
+                sql = self.filter_sql(sql, column, value, exclude)
+                if sql is None:
+                    return None
+            steps.append(f"{'excluding' if exclude else 'only'} {column} = {value}")
+
+        if sql != self.sql:
+            df = agent.run_sql(sql)
+
+        sort = self.sort_target(text, df)
+        if sort:
+            column, ascending = sort
+            df = df.sort_values(column, ascending=ascending, na_position='last')
+            steps.append(f"sorted by {column} {'ascending' if ascending else 'descending'}")
+
+        top = re.search(r"\b(top|first|bottom|last|show(?: me)?(?: only)?(?: the)?|limit(?: to)?)\s+(\d+)\b", text)
+        if top:
+            n = int(top.group(2))
+            if top.group(1) in ('top', 'bottom') and not sort:
+                numeric = df.select_dtypes('number').columns
+                if len(numeric):
+                    df = df.sort_values(numeric[-1], ascending=top.group(1) == 'bottom', na_position='last')
+            df = df.tail(n) if top.group(1) == 'last' else df.head(n)
+            steps.append(f"{top.group(1).split()[0]} {n}")
+
+        if not steps:
+            return None
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        agent.notify("caption", f"↪️ Refined the previous result ({', '.join(steps)}) in {elapsed_ms:.0f} ms")
+        if sql != self.sql:
+            agent.notify("code", sql)
+        self.sql, self.df = sql, df.reset_index(drop=True)
+        return agent.format_answer(self.df)
+
+    def group_target(self, text):
+        match = re.search(r"\b(?:group(?:ed)?|break(?: it)? down|split(?: it)?)\s+by\s+(.+)$|^(?:now\s+|and\s+)?"
+                          r"(?:by|per)\s+(.+)$", text)
+        if not match:
+            return None
+        phrase = re.sub(r"\binstead\b", "", match.group(1) or match.group(2))
+        columns = [c for c in select_columns(phrase) if c in GROUP_COLUMNS]
+        return columns[0] if columns else None
+
+    def filter_target(self, agent, text, df):
+        """(column, value, exclude) for "only X" / "excluding X", matched against known column values"""
+        match = re.search(r"\b(only|just|for|from|in|about|excluding|except|without|not)\s+(.+)$", text)
+        if not match:
+            return None
+        phrase = match.group(2)
+        exclude = match.group(1) in ('excluding', 'except', 'without', 'not')
+        # Values present in the cached result first, then any value of a filterable column
+        candidates = []
+        if df is not None:
+            for column in df.select_dtypes(exclude='number').columns:
+                candidates += [(str(v), column) for v in df[column].dropna().unique() if len(str(v)) >= 3]
+        candidates += filter_values(agent.engine)
+        for value, column in sorted(candidates, key=lambda item: -len(item[0])):
+            if re.search(rf"(?<!\w){re.escape(value.lower())}(?!\w)", phrase):
+                return column, value, exclude
+        return None
+
+    def unexplained_words(self, text, group_column, value_filter):
+        """Words of the question that no recognized filter, grouping, sort or top-N accounts for"""
+        explained = set(FOLLOWUP_WORDS)
+        if group_column:
+            explained |= tokenize(split_words(group_column)) | COLUMNS.get(group_column, ('', '', set()))[2]
+        if value_filter:
+            explained |= tokenize(value_filter[1])
+        phrase = self.sort_phrase(text)
+        if phrase:
+            columns = list(self.df.columns) + ([group_column] if group_column else [])
+            explained |= tokenize(phrase) & {w for c in columns for w in tokenize(split_words(c))}
+        return [w for w in re.findall(r"[a-z0-9]+", text) if not w.isdigit() and not tokenize(w) & explained]
+
+    @staticmethod
+    def sort_phrase(text):
+        """What follows "sort by" / "order by", without the direction words; None when there is no sort"""
+        match = re.search(r"\b(?:sort(?:ed)?|order(?:ed)?|rank(?:ed)?)(?:\s+(?:it|them))?(?:\s+by\s+(.+))?$", text)
+        if not match and not re.search(r"\b(lowest|highest|least|most|fewest|worst|best) first\b", text):
+            return None
+        phrase = (match.group(1) if match and match.group(1) else '') or ''
+        return re.sub(r"\b(asc|ascending|desc|descending|lowest|highest|first)\b", "", phrase).strip()
+
+    def sort_target(self, text, df):
+        """(column, ascending) for "sort by rating" / "lowest first", matched against the result's columns"""
+        phrase = self.sort_phrase(text)
+        if phrase is None:
+            return None
+        direction = re.search(r"\b(asc|ascending|lowest|least|worst|smallest|fewest|increasing)\b", text)
+        descending = re.search(r"\b(desc|descending|highest|most|best|largest|decreasing)\b", text)
+        words = set(phrase.split())
+        scored = [(len(words & set(split_words(c).split())), c) for c in df.columns] if words else []
+        scored = [item for item in scored if item[0]]
+        if scored:
+            column = max(scored, key=lambda item: item[0])[1]
+        else:
+            numeric = df.select_dtypes('number').columns
+            if not len(numeric):
+                return None
+            column = numeric[-1]
+        numeric_column = pd.api.types.is_numeric_dtype(df[column])
+        ascending = bool(direction) or (not descending and not numeric_column)
+        return column, ascending
+
+    # ------------------------------
+    # SQL rewrites
+    # ------------------------------
+    @staticmethod
+    def regroup_sql(sql, column):
+        """Swap the single GROUP BY column for another everywhere it appears; None if there is not exactly one"""
+        match = re.search(r"\bGROUP\s+BY\s+(.+?)(?=\bHAVING\b|\bORDER\b|\bLIMIT\b|;|$)", sql,
+                          re.IGNORECASE | re.DOTALL)
+        if not match:
+            return None
+        grouped = [g.strip() for g in match.group(1).split(',')]
+        if len(grouped) != 1 or not re.fullmatch(r'(\w+\.)?"?[\w&]+"?', grouped[0]):
+            return None
+        old = grouped[0]
+        prefix = old.split('.')[0] + '.' if '.' in old else ''
+        return re.sub(rf'(?<![\w".]){re.escape(old)}(?![\w"])', prefix + column, sql, flags=re.IGNORECASE)
+
+    @staticmethod
+    def filter_sql(sql, column, value, exclude):
+        """Read ryanair_reviews through a filtered subquery, keeping any alias the query gives it"""
+        literal = "'" + value.replace("'", "''") + "'"
+        return restrict_reviews(sql, f"{column} {'!=' if exclude else '='} {literal}")
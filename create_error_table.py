@@ -1,15 +1,15 @@
 from datetime import datetime
-from sqlite_config import get_sqlite_engine
+from sqlite_config import autoincrement_pk, get_engine
 from sqlalchemy import text
 
 def create_error_log_table():
     """Create table to log query errors and attempts"""
     try:
-        engine = get_sqlite_engine()
+        engine = get_engine()
         with engine.connect() as conn:
-            conn.execute(text("""
+            conn.execute(text(f"""
                 CREATE TABLE IF NOT EXISTS query_error_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id {autoincrement_pk(engine)},
                     user_question TEXT NOT NULL,
                     original_sql TEXT,
                     attempt_1_sql TEXT,
@@ -23,18 +23,18 @@ def create_error_log_table():
                     attempt_5_sql TEXT,
                     attempt_5_error TEXT,
                     final_status TEXT DEFAULT 'FAILED',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """))
             
-            conn.execute(text("""
+            conn.execute(text(f"""
                 CREATE TABLE IF NOT EXISTS query_success_log (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id {autoincrement_pk(engine)},
                     user_question TEXT NOT NULL,
                     sql_query TEXT NOT NULL,
                     answer_text TEXT NOT NULL,
                     execution_time_ms INTEGER,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             """))
             
@@ -47,7 +47,7 @@ def create_error_log_table():
 def log_query_error(user_question, attempts):
     """Log failed query attempts to database"""
     try:
-        engine = get_sqlite_engine()
+        engine = get_engine()
         with engine.connect() as conn:
             # Prepare data for insertion
             insert_data = {
@@ -94,7 +94,7 @@ def log_query_error(user_question, attempts):
 def log_successful_query(user_question, sql_query, answer_text, execution_time_ms=None):
     """Log successful query and answer to database"""
     try:
-        engine = get_sqlite_engine()
+        engine = get_engine()
         with engine.connect() as conn:
             conn.execute(text("""
                 INSERT INTO query_success_log (user_question, sql_query, answer_text, execution_time_ms)
@@ -1,50 +1,102 @@
+import io
+import re
+import time
+
 import pandas as pd
 import psycopg2
 from sqlalchemy import create_engine, inspect
 
+from review_dates import normalize_date_flown, normalize_date_published
+from sqlite_config import POSTGRES_CONFIG
+
 # ==============================
 # Database Configuration
 # ==============================
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'ryanaircs',
-    'user': 'postgres',
-    'password': 'admin',  # change if needed
-    'port': '5432'
+# Shared with the application backend (see sqlite_config.py)
+DB_CONFIG = POSTGRES_CONFIG
+
+
+# The application's column names (PassengerCountry, Food&Beverages, ...) as PostgreSQL stores the
+# unquoted identifiers the agents and prompts use: lowercase, without '&'. The derived date columns
+# are the ones review_dates.py maintains. Sentiment lives in review_sentiment (created by the agents).
+REVIEW_COLUMNS = [
+    'datepublished', 'overallrating', 'passengercountry', 'tripverified',
+    'commenttitle', 'comment', 'aircraft', 'typeoftraveller', 'seattype',
+    'origin', 'destination', 'dateflown', 'seatcomfort', 'cabinstaffservice',
+    'foodbeverages', 'groundservice', 'valueformoney', 'recommended',
+    'inflightentertainment', 'wificonnectivity',
+    'datepublishediso', 'datepublishedmonth', 'dateflownmonth'
+]
+
+NUMERIC_COLUMNS = [
+    'overallrating', 'seatcomfort', 'cabinstaffservice',
+    'foodbeverages', 'groundservice', 'valueformoney',
+    'inflightentertainment', 'wificonnectivity'
+]
+
+# Secondary indexes for the filters and groupings the dashboard and QueryAgent use
+# (the date indexes are review_dates.py's, created when the agents start)
+REVIEW_INDEXES = {
+    'passenger_country': ['passengercountry'],
+    'aircraft': ['aircraft'],
+    'route': ['origin', 'destination'],
+    'type_of_traveller': ['typeoftraveller'],
 }
 
 
-# ==============================
-# Create Table
-# ==============================
-def create_table():
-    """Creates the ryanair_reviews table in PostgreSQL"""
-    create_table_sql = """
-    DROP TABLE IF EXISTS ryanair_reviews;
-    CREATE TABLE ryanair_reviews (
+def review_table_sql(table_name):
+    """CREATE TABLE statement for the reviews table (or its staging copy)"""
+    return f"""
+    CREATE TABLE {table_name} (
         id SERIAL PRIMARY KEY,
-        date_published DATE,
-        overall_rating INTEGER,
-        passenger_country VARCHAR(100),
-        trip_verified VARCHAR(20),
-        comment_title TEXT,
+        datepublished VARCHAR(50),
+        overallrating INTEGER,
+        passengercountry VARCHAR(100),
+        tripverified VARCHAR(20),
+        commenttitle TEXT,
         comment TEXT,
         aircraft VARCHAR(100),
-        type_of_traveller VARCHAR(100),
-        seat_type VARCHAR(100),
+        typeoftraveller VARCHAR(100),
+        seattype VARCHAR(100),
         origin VARCHAR(100),
         destination VARCHAR(100),
-        date_flown VARCHAR(50),
-        seat_comfort DECIMAL(3,1),
-        cabin_staff_service DECIMAL(3,1),
-        food_beverages DECIMAL(3,1),
-        ground_service DECIMAL(3,1),
-        value_for_money DECIMAL(3,1),
+        dateflown VARCHAR(50),
+        seatcomfort DECIMAL(3,1),
+        cabinstaffservice DECIMAL(3,1),
+        foodbeverages DECIMAL(3,1),
+        groundservice DECIMAL(3,1),
+        valueformoney DECIMAL(3,1),
         recommended VARCHAR(10),
-        inflight_entertainment DECIMAL(3,1),
-        wifi_connectivity DECIMAL(3,1)
+        inflightentertainment DECIMAL(3,1),
+        wificonnectivity DECIMAL(3,1),
+        datepublishediso TEXT,
+        datepublishedmonth TEXT,
+        dateflownmonth TEXT
     );
     """
+
+
+# The agents turn a loaded ryanair_reviews table into a view over reviews_base and
+# review_sentiment (see sqlite_config.split_review_sentiment); a reload replaces all three
+DROP_REVIEWS_SQL = """
+    DO $$ BEGIN
+        IF EXISTS (SELECT 1 FROM information_schema.views WHERE table_name = 'ryanair_reviews') THEN
+            DROP VIEW ryanair_reviews;
+        END IF;
+    END $$;
+    DROP TABLE IF EXISTS ryanair_reviews, reviews_base, review_sentiment, review_pending, review_sample,
+        review_sample_state, review_topics, review_lsh, rating_driver_state, rating_driver_sentiment,
+        analytics_snapshot_state CASCADE;
+"""
+
+
+# ==============================
+# Create Table
+# ==============================
+def create_table():
+    """Creates the ryanair_reviews table in PostgreSQL"""
+    create_table_sql = DROP_REVIEWS_SQL + review_table_sql('ryanair_reviews')
+    conn = None
     try:
         conn = psycopg2.connect(**DB_CONFIG)
         cursor = conn.cursor()
@@ -70,30 +122,15 @@ def import_csv_data(csv_file_path):
         print(f"📄 Loaded CSV with {len(df)} rows and {len(df.columns)} columns")
 
         # Step 2: Clean column names
-        df.columns = (
-            df.columns
-            .str.strip()
-            .str.replace(' ', '_')
-            .str.replace('&', '')
-            .str.replace('__', '_')  # ✅ fix double underscores
-            .str.lower()
-        )
+        df.columns = [clean_column_name(col) for col in df.columns]
 
         # Step 3: Drop unwanted columns
-        for col in ['unnamed:_0', 'id']:
+        for col in ['unnamed0', 'id']:
             if col in df.columns:
                 df = df.drop(col, axis=1)
 
         # Step 4: Convert types
-        if 'date_published' in df.columns:
-            df['date_published'] = pd.to_datetime(df['date_published'], errors='coerce')
-
-        numeric_cols = [
-            'overall_rating', 'seat_comfort', 'cabin_staff_service',
-            'food_beverages', 'ground_service', 'value_for_money',
-            'inflight_entertainment', 'wifi_connectivity'
-        ]
-        for col in numeric_cols:
+        for col in NUMERIC_COLUMNS:
             if col in df.columns:
                 df[col] = pd.to_numeric(df[col], errors='coerce')
 
@@ -127,10 +164,95 @@ def import_csv_data(csv_file_path):
         print(f"❌ Error importing data: {e}")
 
 
+# ==============================
+# Bulk Load with COPY
+# ==============================
+def clean_column_name(name):
+    """Map CSV headers ('Food&Beverages', 'Type Of Traveller', 'DatePublished') to table columns"""
+    return re.sub(r'[^a-z0-9]', '', name.lower())
+
+
+def clean_chunk(df):
+    """Clean and type-convert one CSV chunk into the table's column order"""
+    df = df.rename(columns=clean_column_name)
+    for col in REVIEW_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+    df = df[REVIEW_COLUMNS].copy()
+
+    # '2/3/2024' -> '2024-02-03' and '23-Oct' -> '2023-10', so date questions are index range scans
+    df['datepublishediso'] = df['datepublished'].map(normalize_date_published)
+    df['datepublishedmonth'] = df['datepublishediso'].str[:7]
+    df['dateflownmonth'] = df['dateflown'].map(normalize_date_flown)
+    for col in NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    # INTEGER columns must not be sent as '10.0'
+    df['overallrating'] = df['overallrating'].round().astype('Int64')
+    return df
+
+
+def copy_csv_data(csv_file_path, chunk_size=50000):
+    """Stream a CSV into PostgreSQL with COPY FROM STDIN through a staging table.
+
+    Chunks are cleaned and converted with pandas and copied into a fresh staging
+    table; indexes are built once after the load, then the staging table replaces
+    ryanair_reviews in a single transaction. Re-running the load is idempotent:
+    readers see either the old table or the complete new one.
+    """
+    staging = 'ryanair_reviews_staging'
+    columns = ', '.join(REVIEW_COLUMNS)
+    conn = None
+    try:
+        start = time.time()
+        conn = psycopg2.connect(**DB_CONFIG)
+        cursor = conn.cursor()
+
+        # Step 1: Fresh staging table (left-overs from an interrupted load are discarded)
+        cursor.execute(f"DROP TABLE IF EXISTS {staging};" + review_table_sql(staging))
+        conn.commit()
+
+        # Step 2: Stream chunks through COPY
+        total = 0
+        for chunk in pd.read_csv(csv_file_path, chunksize=chunk_size, keep_default_na=True):
+            df = clean_chunk(chunk)
+            buffer = io.StringIO()
+            df.to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+            total += len(df)
+            print(f"📄 Copied {total} rows...")
+        conn.commit()
+
+        # Step 3: Build indexes after the data is in place (much cheaper than per-row maintenance)
+        for name, index_columns in REVIEW_INDEXES.items():
+            cursor.execute(f"CREATE INDEX idx_{staging}_{name} ON {staging} ({', '.join(index_columns)})")
+        cursor.execute(f"ANALYZE {staging}")
+        conn.commit()
+
+        # Step 4: Swap staging in atomically and give its indexes the final names
+        cursor.execute(DROP_REVIEWS_SQL)
+        cursor.execute(f"ALTER TABLE {staging} RENAME TO ryanair_reviews")
+        cursor.execute(f"ALTER INDEX {staging}_pkey RENAME TO ryanair_reviews_pkey")
+        for name in REVIEW_INDEXES:
+            cursor.execute(f"ALTER INDEX idx_{staging}_{name} RENAME TO idx_ryanair_reviews_{name}")
+        conn.commit()
+
+        print(f"✅ Loaded {total} records into 'ryanair_reviews' in {time.time() - start:.1f}s")
+        return total
+
+    except Exception as e:
+        if conn:
+            conn.rollback()
+        print(f"❌ Error bulk loading data: {e}")
+        return 0
+    finally:
+        if conn:
+            conn.close()
+
+
 # ==============================
 # Run Script
 # ==============================
 if __name__ == "__main__":
-    create_table()
     csv_file_path = r"c:\Users\SarahAljudaibi\Downloads\KDDRAG\ryanair_reviews.csv"
-    import_csv_data(csv_file_path)
+    copy_csv_data(csv_file_path)
@@ -0,0 +1,213 @@
+import argparse
+import re
+import statistics
+import time
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from prompt_builder import FEW_SHOT_EXAMPLES
+from sqlite_config import REVIEWS_TABLE, get_dialect, get_engine, is_sqlite, prepare_review_tables
+
+# Queries read the ryanair_reviews view; plans scan, and indexes go on, the table under it
+TABLE = REVIEWS_TABLE
+# Long free-text columns are never worth carrying in an index
+TEXT_COLUMNS = {'comment', 'commenttitle', 'sentimentreason'}
+MAX_INDEX_COLUMNS = 6
+CLAUSE_END = r"(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|\bUNION\b|\)\s*$|;|$)"
+
+
+# ==============================
+# Workload
+# ==============================
+def load_workload(engine, limit=200):
+    """Distinct SQL from query_success_log, most frequent first; falls back to the prompt examples"""
+    if inspect(engine).has_table('query_success_log'):
+        df = pd.read_sql(text("""
+            SELECT sql_query, COUNT(*) AS runs FROM query_success_log
+            GROUP BY sql_query ORDER BY runs DESC LIMIT :limit
+        """), engine, params={'limit': limit})
+        if not df.empty:
+            return list(zip(df['sql_query'], df['runs']))
+    print("query_success_log is empty - using the SQL of the prompt's few-shot examples as the workload")
+    return [(example['sql'], 1) for example in FEW_SHOT_EXAMPLES]
+
+
+# ==============================
+# Plans and timings
+# ==============================
+def full_scans(conn, sql):
+    """Plan lines that scan ryanair_reviews without an index"""
+    statement = sql.strip().rstrip(';')
+    if is_sqlite(conn.engine):
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {statement}")).fetchall()
+        details = [row[-1] for row in rows]
+        return [d for d in details if re.match(rf"SCAN (TABLE )?{TABLE}\b", d) and 'INDEX' not in d]
+    rows = conn.execute(text(f"EXPLAIN {statement}")).fetchall()
+    return [row[0].strip() for row in rows if f"Seq Scan on {TABLE}" in row[0]]
+
+
+def time_query(conn, sql, repeat=3):
+    """Median latency of a query in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(text(sql.strip().rstrip(';'))).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+# ==============================
+# Index proposals
+# ==============================
+def clause(sql, keyword):
+    match = re.search(rf"\b{keyword}\b(.*?){CLAUSE_END}", sql, re.IGNORECASE | re.DOTALL)
+    return match.group(1) if match else ''
+
+
+def column_pattern(column):
+    return rf'(?<![\w"]){re.escape(column)}(?![\w])|"{re.escape(column)}"'
+
+
+def propose_index(sql, columns):
+    """Candidate index for one query: equality columns, then GROUP BY columns, then one range column,
+    then the remaining referenced columns so the index covers the query; IS NOT NULL / != '' filters
+    become the WHERE clause of a partial index. Returns (columns, partial_where) or None."""
+    where = clause(sql, 'WHERE')
+    group_by = clause(sql, r'GROUP\s+BY')
+    equality, ranges, partial, grouped, referenced = [], [], [], [], []
+
+    for column in columns:
+        pattern = column_pattern(column)
+        if not re.search(pattern, sql, re.IGNORECASE):
+            continue
+        referenced.append(column)
+        if re.search(rf"({pattern})\s*(=|\bIN\b|\bLIKE\s+'[^%_])", where, re.IGNORECASE):
+            equality.append(column)
+        elif re.search(rf"({pattern})\s*(<|>|\bBETWEEN\b)", where, re.IGNORECASE):
+            ranges.append(column)
+        if re.search(rf"({pattern})\s*(IS\s+NOT\s+NULL|!=\s*''|<>\s*'')", where, re.IGNORECASE):
+            quoted = f'"{column}"' if not re.match(r'^\w+$', column) else column
+            partial.append(f"{quoted} IS NOT NULL AND {quoted} != ''")
+        if re.search(pattern, group_by, re.IGNORECASE):
+            grouped.append(column)
+
+    key = equality + [c for c in grouped if c not in equality] + ranges[:1]
+    key = [c for c in key if c.lower() not in TEXT_COLUMNS]
+    covering = [c for c in referenced if c not in key and c.lower() not in TEXT_COLUMNS and c != 'id']
+    if not key and partial:
+        # Nothing to seek on, but a partial covering index is still much narrower than the table
+        key, covering = covering[:MAX_INDEX_COLUMNS], []
+    if not key:
+        return None
+    index_columns = key + covering if len(key) + len(covering) <= MAX_INDEX_COLUMNS else key
+    return tuple(index_columns[:MAX_INDEX_COLUMNS]), ' AND '.join(sorted(set(partial)))
+
+
+def index_name(index_columns, partial_where):
+    name = 'idx_advisor_' + '_'.join(re.sub(r'\W', '', c).lower() for c in index_columns)
+    return name + ('_partial' if partial_where else '')
+
+
+def index_sql(index_columns, partial_where):
+    column_list = ', '.join(f'"{c}"' for c in index_columns)
+    sql = f"CREATE INDEX IF NOT EXISTS {index_name(index_columns, partial_where)} ON {TABLE} ({column_list})"
+    return sql + (f" WHERE {partial_where}" if partial_where else '')
+
+
+def merge_proposals(proposals):
+    """Drop proposals whose columns are a prefix of another proposal with the same partial filter"""
+    unique = sorted(set(proposals), key=lambda p: -len(p[0]))
+    kept = []
+    for index_columns, partial_where in unique:
+        if not any(where == partial_where and cols[:len(index_columns)] == index_columns for cols, where in kept):
+            kept.append((index_columns, partial_where))
+    return kept
+
+
+# ==============================
+# Advisor
+# ==============================
+def advise(apply=False, limit=200, repeat=3):
+    """Replay the logged workload, propose indexes for queries that full-scan ryanair_reviews,
+    and report each query's latency before and after. Indexes are only kept with apply=True."""
+    engine = get_engine()
+    prepare_review_tables(engine)
+    columns = [c['name'] for c in inspect(engine).get_columns(TABLE)]
+    workload = load_workload(engine, limit)
+    print(f"Replaying {len(workload)} queries on {get_dialect(engine)}")
+
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        if is_sqlite(engine):
+            # pysqlite only opens transactions before DML; without this the CREATE INDEX would autocommit
+            conn.exec_driver_sql("BEGIN")
+        results, proposals = [], []
+        for sql, runs in workload:
+            # A failed statement aborts a PostgreSQL transaction: each replay gets its own savepoint to roll back to
+            savepoint = conn.begin_nested()
+            try:
+                scans = full_scans(conn, sql)
+                before = time_query(conn, sql, repeat)
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                print(f"Skipping query that no longer runs: {e}")
+                continue
+            proposal = propose_index(sql, columns) if scans else None
+            if proposal:
+                proposals.append(proposal)
+            results.append({'sql': sql, 'runs': runs, 'full_scan': bool(scans), 'before_ms': before})
+
+        proposals = merge_proposals(proposals)
+        if not proposals:
+            print("No full scans that an index would help - nothing to propose")
+            transaction.rollback()
+            return results
+
+        print("\nProposed indexes:")
+        for proposal in proposals:
+            statement = index_sql(*proposal)
+            print(f"  {statement};")
+            conn.execute(text(statement))
+        conn.execute(text("ANALYZE"))
+
+        for result in results:
+            savepoint = conn.begin_nested()
+            try:
+                result['after_ms'] = time_query(conn, result['sql'], repeat)
+                result['full_scan_after'] = bool(full_scans(conn, result['sql']))
+                savepoint.commit()
+            except Exception as e:
+                savepoint.rollback()
+                print(f"Query failed after indexing: {e}")
+                result['after_ms'], result['full_scan_after'] = float('nan'), result['full_scan']
+
+        # DDL is transactional in both SQLite and PostgreSQL, so a dry run leaves no trace
+        if apply:
+            transaction.commit()
+            print(f"\nCreated {len(proposals)} indexes")
+        else:
+            transaction.rollback()
+            print("\nDry run - rerun with --apply to create these indexes")
+
+    print("\nLatency per logged query (median ms):")
+    for result in results:
+        first_line = ' '.join(result['sql'].split())[:70]
+        scan = 'scan' if result['full_scan'] else 'index'
+        scan_after = 'scan' if result['full_scan_after'] else 'index'
+        print(f"  {result['before_ms']:8.2f} ({scan:5}) -> {result['after_ms']:8.2f} ({scan_after:5}) "
+              f"x{result['runs']}  {first_line}")
+    return results
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index advisor driven by the queries in query_success_log")
+    parser.add_argument("--apply", action="store_true", help="Create the proposed indexes")
+    parser.add_argument("--limit", type=int, default=200, help="Most frequent distinct queries to replay")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per query")
+    args = parser.parse_args()
+    advise(args.apply, args.limit, args.repeat)
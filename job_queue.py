@@ -0,0 +1,251 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+from sqlalchemy import text
+
+from near_duplicates import fetch_in
+from sqlite_config import get_engine, is_sqlite
+
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'job_uploads')
+# A RUNNING job whose updated_at is older than this belongs to a process that died; live workers touch it
+# every LEASE_TIMEOUT / 4 seconds
+LEASE_TIMEOUT = 300
+# A sentiment job stops after this many reviews in a row could not be analyzed (model server down)
+MAX_CONSECUTIVE_FAILURES = 5
+INTERRUPTED_INGEST = ("Interrupted while adding reviews; the rows added before that are kept and queued for "
+                      "sentiment analysis - check them before uploading the file again")
+
+
+def create_job_queue_table(engine=None):
+    """Create the table that persists background ingestion and sentiment jobs"""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS background_jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                parent_id TEXT,
+                status TEXT DEFAULT 'QUEUED',
+                payload TEXT,
+                progress INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                message TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        conn.execute(text("""
+            CREATE INDEX IF NOT EXISTS idx_background_jobs_status
+            ON background_jobs (status, created_at)
+        """))
+        conn.commit()
+
+
+def stale_filter(engine, seconds=LEASE_TIMEOUT):
+    """WHERE condition for RUNNING jobs whose lease has expired"""
+    if is_sqlite(engine):
+        return f"status = 'RUNNING' AND updated_at < datetime('now', '-{int(seconds)} seconds')"
+    return f"status = 'RUNNING' AND updated_at < CURRENT_TIMESTAMP - INTERVAL '{int(seconds)} seconds'"
+
+
+class JobQueue:
+    """Persistent job queue served by worker threads, shared through the database.
+
+    Jobs live in the background_jobs table, so they survive page refreshes and
+    restarts, and several server processes can serve one queue: a job is claimed with
+    a conditional UPDATE, and its worker keeps touching updated_at while it runs.
+    Sentiment jobs whose lease expired (their process died) are re-queued and resume
+    after their last finished review. An interrupted ingest cannot tell which rows it
+    already inserted, so it is marked FAILED rather than replayed (that would insert
+    them twice).
+    Kinds:
+    - "ingest": load an uploaded Excel file, then queue a "sentiment" job for the new reviews
+    - "sentiment": run sentiment analysis for a list of review ids
+    """
+
+    def __init__(self, sentiment_agent, workers=2, poll_interval=0.5):
+        self.sentiment_agent = sentiment_agent
+        self.engine = get_engine()
+        self.poll_interval = poll_interval
+        self.last_recovery = 0.0
+        create_job_queue_table(self.engine)
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        self.recover_stale_jobs()
+
+        self.handlers = {"ingest": self.run_ingest, "sentiment": self.run_sentiment}
+        self.threads = [threading.Thread(target=self.worker_loop, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    # ------------------------------
+    # Client API
+    # ------------------------------
+    def submit(self, kind, payload, parent_id=None):
+        """Queue a job and return its id immediately"""
+        job_id = str(uuid.uuid4())
+        with self.engine.connect() as conn:
+            conn.execute(text("""
+                INSERT INTO background_jobs (job_id, kind, parent_id, payload)
+                VALUES (:job_id, :kind, :parent_id, :payload)
+            """), {'job_id': job_id, 'kind': kind, 'parent_id': parent_id, 'payload': json.dumps(payload)})
+            conn.commit()
+        return job_id
+
+    def submit_upload(self, file_name, data):
+        """Persist an uploaded file under job_uploads/ and queue its ingestion"""
+        path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}_{os.path.basename(file_name)}")
+        with open(path, "wb") as f:
+            f.write(data)
+        return self.submit("ingest", {"path": path, "file_name": file_name})
+
+    def get(self, job_id):
+        """Return a job row as a dict, or None"""
+        df = pd.read_sql(text("SELECT * FROM background_jobs WHERE job_id = :job_id"), self.engine,
+                         params={'job_id': job_id})
+        return None if df.empty else df.iloc[0].to_dict()
+
+    def recent(self, job_ids=None, limit=20):
+        """Return the most recent jobs (optionally restricted to job_ids and their child jobs) as a DataFrame"""
+        if job_ids is not None:
+            if not job_ids:
+                return pd.DataFrame()
+            params = {f'id{i}': job_id for i, job_id in enumerate(job_ids)}
+            placeholders = ", ".join(f":{name}" for name in params)
+            return pd.read_sql(text(
+                f"SELECT * FROM background_jobs WHERE job_id IN ({placeholders}) OR parent_id IN ({placeholders}) "
+                "ORDER BY created_at DESC"
+            ), self.engine, params=params)
+        return pd.read_sql(
+            text("SELECT * FROM background_jobs ORDER BY created_at DESC LIMIT :limit"), self.engine,
+            params={'limit': limit}
+        )
+
+    # ------------------------------
+    # Workers
+    # ------------------------------
+    def update(self, job_id, **fields):
+        """Set fields of a job and renew its lease (no fields: just renew it)"""
+        assignments = "".join(f"{name} = :{name}, " for name in fields)
+        with self.engine.connect() as conn:
+            conn.execute(text(f"""
+                UPDATE background_jobs SET {assignments}updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = :job_id
+            """), {**fields, 'job_id': job_id})
+            conn.commit()
+
+    def recover_stale_jobs(self):
+        """Fail interrupted ingests and re-queue other jobs whose lease expired; jobs that a live process
+        (this one or another) is running keep their status"""
+        self.last_recovery = time.time()
+        stale = stale_filter(self.engine)
+        with self.engine.connect() as conn:
+            interrupted = conn.execute(text(
+                f"SELECT job_id, payload FROM background_jobs WHERE {stale} AND kind = 'ingest'"
+            )).fetchall()
+            for job_id, payload in interrupted:
+                failed = conn.execute(text(f"""
+                    UPDATE background_jobs SET status = 'FAILED', message = :message, updated_at = CURRENT_TIMESTAMP
+                    WHERE job_id = :job_id AND {stale}
+                """), {'message': INTERRUPTED_INGEST, 'job_id': job_id}).rowcount
+                conn.commit()
+                path = json.loads(payload)['path']
+                if failed and os.path.exists(path):
+                    os.remove(path)
+            conn.execute(text(
+                f"UPDATE background_jobs SET status = 'QUEUED', updated_at = CURRENT_TIMESTAMP WHERE {stale}"
+            ))
+            conn.commit()
+
+    def claim(self):
+        """Claim the oldest queued job; returns (job_id, kind, payload) or None"""
+        df = pd.read_sql("""
+            SELECT job_id, kind, payload FROM background_jobs
+            WHERE status = 'QUEUED' ORDER BY created_at LIMIT 1
+        """, self.engine)
+        if df.empty:
+            return None
+        job = df.iloc[0]
+        with self.engine.connect() as conn:
+            claimed = conn.execute(text("""
+                UPDATE background_jobs SET status = 'RUNNING', updated_at = CURRENT_TIMESTAMP
+                WHERE job_id = :job_id AND status = 'QUEUED'
+            """), {'job_id': job['job_id']}).rowcount
+            conn.commit()
+        if not claimed:
+            return None  # another worker, maybe in another process, claimed it first
+        return job['job_id'], job['kind'], json.loads(job['payload'])
+
+    def heartbeat(self, job_id, stop):
+        """Touch a running job's updated_at until stop is set, so its lease does not expire"""
+        while not stop.wait(LEASE_TIMEOUT / 4):
+            try:
+                self.update(job_id)
+            except Exception as e:
+                print(f"Error renewing lease of job {job_id}: {e}")
+
+    def worker_loop(self):
+        while True:
+            try:
+                if time.time() - self.last_recovery >= LEASE_TIMEOUT:
+                    self.recover_stale_jobs()
+                job = self.claim()
+            except Exception as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            job_id, kind, payload = job
+            stop = threading.Event()
+            threading.Thread(target=self.heartbeat, args=(job_id, stop), daemon=True).start()
+            try:
+                message = self.handlers[kind](job_id, payload)
+                self.update(job_id, status='DONE', message=message)
+            except Exception as e:
+                print(f"Job {job_id} failed: {e}")
+                self.update(job_id, status='FAILED', message=str(e))
+            finally:
+                stop.set()
+
+    def run_ingest(self, job_id, payload):
+        """Insert the reviews from an uploaded Excel file and queue their sentiment analysis"""
+        path = payload['path']
+        try:
+            review_ids = self.sentiment_agent.add_reviews_from_excel(path)
+        finally:
+            # The upload is no longer needed once its rows are in the database
+            if os.path.exists(path):
+                os.remove(path)
+        if not review_ids:
+            raise ValueError(f"No reviews could be added from {payload['file_name']}")
+        self.update(job_id, progress=len(review_ids), total=len(review_ids))
+        sentiment_job = self.submit("sentiment", {"review_ids": review_ids}, parent_id=job_id)
+        return f"Added {len(review_ids)} reviews; sentiment job {sentiment_job[:8]}"
+
+    def run_sentiment(self, job_id, payload):
+        """Analyze each review in the payload, updating progress as it goes; reviews that fail stay in
+        review_pending for the next backfill"""
+        review_ids = payload['review_ids']
+        # Resume after the last finished review if this job was interrupted
+        done = int(self.get(job_id)['progress'] or 0)
+        self.update(job_id, total=len(review_ids))
+        failed_in_a_row = 0
+        for i, review_id in enumerate(review_ids[done:], start=done):
+            failed_in_a_row = 0 if self.sentiment_agent.process_single_review(review_id) else failed_in_a_row + 1
+            self.update(job_id, progress=i + 1)
+            if failed_in_a_row >= MAX_CONSECUTIVE_FAILURES:
+                raise RuntimeError(f"Stopped after {failed_in_a_row} reviews in a row could not be analyzed - "
+                                   "is the model server running?")
+        # Counted in the database, so reviews analyzed before an interruption are included
+        with self.engine.connect() as conn:
+            analyzed = len(fetch_in(conn, "SELECT review_id FROM review_sentiment WHERE review_id IN ({values})",
+                                    review_ids))
+        if review_ids and not analyzed:
+            raise RuntimeError("None of the reviews could be analyzed - is the model server running?")
+        failed = len(review_ids) - analyzed
+        return f"Analyzed {analyzed} of {len(review_ids)} reviews" + (f"; {failed} failed" if failed else "")
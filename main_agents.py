@@ -1,5 +1,6 @@
 from sentiment_agent import SentimentAgent
 from query_agent import QueryAgent
+from conversation import Conversation
 
 def main():
     """Main function to run both agents"""
@@ -10,6 +11,7 @@ def main():
     # Initialize agents
     sentiment_agent = SentimentAgent()
     query_agent = QueryAgent()
+    conversation = Conversation()  # follow-up questions refine the previous answer
     
     while True:
         print("\nChoose an option:")
@@ -67,7 +69,8 @@ def main():
                     # Add review to database
                     sentiment_agent.add_sentiment_column()
                     review_id = sentiment_agent.add_new_review(
-                        Comment, Rating, Country, Aircraft, TravellerType, Origin, Destination
+                        comment, int(rating) if rating.isdigit() else None, country, aircraft, traveller_type,
+                        origin, destination
                     )
                     
                     if review_id:
@@ -96,7 +99,7 @@ def main():
             
             question = input("\nYour question: ").strip()
             if question:
-                query_agent.answer_question(question)
+                print(conversation.ask(query_agent, question))
             
         elif choice == "3":
             print("👋 Goodbye!")
@@ -0,0 +1,220 @@
+import argparse
+import hashlib
+import re
+import zlib
+
+import numpy as np
+from sqlalchemy import inspect, text
+
+from sqlite_config import REVIEWS_TABLE, create_reviews_view, get_engine, prepare_review_tables
+
+# MinHash signature of 128 values split into 16 LSH bands of 8 rows: reviews with a
+# shingle Jaccard similarity of 0.8 share at least one band ~95% of the time, unrelated
+# reviews practically never. Band matches are then verified with the exact similarity.
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_WORDS = 3
+DUPLICATE_THRESHOLD = 0.8
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+_rng = np.random.default_rng(1)  # fixed: stored buckets must stay comparable across runs
+PERMUTATION_A = _rng.integers(1, 1 << 29, size=NUM_PERMUTATIONS, dtype=np.uint64)
+PERMUTATION_B = _rng.integers(0, (1 << 61) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+# ==============================
+# MinHash / LSH
+# ==============================
+def shingles(comment):
+    """Hashed word 3-grams of a comment (the whole comment when it is shorter than that)"""
+    words = re.findall(r"\w+", comment.lower()) if isinstance(comment, str) else []
+    if not words:
+        return set()
+    grams = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))]
+    return {zlib.crc32(gram.encode()) for gram in grams}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def signature(shingle_set):
+    """MinHash signature: per permutation, the smallest (a*x + b) mod p over the shingles"""
+    values = np.fromiter(shingle_set, dtype=np.uint64, count=len(shingle_set))
+    hashed = (PERMUTATION_A[:, None] * values[None, :] + PERMUTATION_B[:, None]) % MERSENNE_PRIME
+    return hashed.min(axis=1)
+
+
+def band_buckets(shingle_set):
+    """One signed 64-bit bucket key per band (the band number is part of the key)"""
+    if not shingle_set:
+        return []
+    bands = signature(shingle_set).reshape(BANDS, ROWS_PER_BAND)
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + rows.tobytes(), digest_size=8).digest(), 'big', signed=True)
+        for band, rows in enumerate(bands)
+    ]
+
+
+# ==============================
+# Storage
+# ==============================
+def create_near_duplicate_index(engine=None):
+    """Add ryanair_reviews.ClusterId and the review_lsh bucket table of cluster representatives"""
+    engine = engine or get_engine()
+    prepare_review_tables(engine)
+    existing = {c['name'].lower() for c in inspect(engine).get_columns(REVIEWS_TABLE)}
+    with engine.begin() as conn:
+        if 'clusterid' not in existing:
+            conn.execute(text(f"ALTER TABLE {REVIEWS_TABLE} ADD COLUMN ClusterId BIGINT"))
+            create_reviews_view(conn)
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_reviews_cluster ON {REVIEWS_TABLE} (ClusterId)"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS review_lsh (
+                bucket BIGINT NOT NULL,
+                review_id BIGINT NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_review_lsh_bucket ON review_lsh (bucket)"))
+
+
+def fetch_in(conn, sql, values, chunk_size=500):
+    """Rows of sql for values bound into its {values} IN-list, a chunk at a time"""
+    rows = []
+    values = list(values)
+    for start in range(0, len(values), chunk_size):
+        params = {f'v{i}': v for i, v in enumerate(values[start:start + chunk_size])}
+        rows += conn.execute(text(sql.format(values=', '.join(':' + name for name in params))), params).fetchall()
+    return rows
+
+
+def assign_clusters(conn, reviews, threshold=DUPLICATE_THRESHOLD):
+    """Give each (review_id, comment) a ClusterId, in order: the id of the first earlier review whose
+    comment is at least `threshold` similar, else its own id (it becomes a cluster representative).
+    Returns {review_id: cluster_id}."""
+    reviews = [(int(review_id), comment, shingles(comment)) for review_id, comment in reviews]
+    buckets = {review_id: band_buckets(shingle_set) for review_id, _, shingle_set in reviews}
+
+    # Representatives already in the database that share a band with any of these reviews
+    stored = {}
+    for bucket, representative in fetch_in(
+        conn, "SELECT bucket, review_id FROM review_lsh WHERE bucket IN ({values})",
+        {bucket for keys in buckets.values() for bucket in keys}
+    ):
+        stored.setdefault(bucket, set()).add(int(representative))
+    representative_shingles = {
+        int(review_id): shingles(comment) for review_id, comment in fetch_in(
+            conn, "SELECT id, Comment FROM ryanair_reviews WHERE id IN ({values})",
+            {r for ids in stored.values() for r in ids}
+        )
+    }
+
+    clusters, new_buckets = {}, []
+    for review_id, _, shingle_set in reviews:
+        candidates = {r for bucket in buckets[review_id] for r in stored.get(bucket, ())} - {review_id}
+        scored = [(jaccard(shingle_set, representative_shingles[r]), -r, r) for r in candidates
+                  if r in representative_shingles]
+        best = max(scored, default=None)
+        if best and best[0] >= threshold:
+            clusters[review_id] = best[2]
+            continue
+        # A new representative: later reviews in this batch can match it too
+        clusters[review_id] = review_id
+        representative_shingles[review_id] = shingle_set
+        for bucket in buckets[review_id]:
+            stored.setdefault(bucket, set()).add(review_id)
+            new_buckets.append({'bucket': bucket, 'review_id': review_id})
+
+    if new_buckets:
+        conn.execute(text("INSERT INTO review_lsh (bucket, review_id) VALUES (:bucket, :review_id)"), new_buckets)
+    if clusters:
+        conn.execute(text(f"UPDATE {REVIEWS_TABLE} SET ClusterId = :cluster_id WHERE id = :id"),
+                     [{'id': review_id, 'cluster_id': cluster_id} for review_id, cluster_id in clusters.items()])
+    return clusters
+
+
+def cluster_reviews(review_ids, engine=None, chunk_size=500):
+    """Cluster freshly inserted reviews; called right after they are written"""
+    engine = engine or get_engine()
+    clusters = {}
+    review_ids = [int(r) for r in review_ids]
+    for start in range(0, len(review_ids), chunk_size):
+        with engine.begin() as conn:
+            reviews = fetch_in(conn, "SELECT id, Comment FROM ryanair_reviews WHERE id IN ({values}) ORDER BY id",
+                               review_ids[start:start + chunk_size])
+            clusters.update(assign_clusters(conn, reviews))
+    return clusters
+
+
+def representative_sentiment(engine, review_ids):
+    """{review_id: {"sentiment", "reason", "model", "prompt_version"}} for reviews whose cluster
+    representative is already analyzed"""
+    if not review_ids:
+        return {}
+    with engine.connect() as conn:
+        rows = fetch_in(conn, f"""
+            SELECT d.id, s.Sentiment, s.SentimentReason, s.Model, s.PromptVersion
+            FROM {REVIEWS_TABLE} d JOIN review_sentiment s ON s.review_id = d.ClusterId
+            WHERE d.id IN ({{values}}) AND d.ClusterId != d.id AND s.Sentiment IS NOT NULL AND s.Sentiment != ''
+        """, [int(r) for r in review_ids])
+    return {
+        int(review_id): {'sentiment': sentiment, 'reason': reason or '', 'model': model, 'prompt_version': version}
+        for review_id, sentiment, reason, model, version in rows
+    }
+
+
+def add_near_duplicate_index(engine=None, chunk_size=500):
+    """Create the near-duplicate index and cluster every review without a ClusterId; cheap to re-run"""
+    try:
+        engine = engine or get_engine()
+        create_near_duplicate_index(engine)
+        with engine.connect() as conn:
+            pending = [int(r[0]) for r in conn.execute(text(
+                "SELECT id FROM ryanair_reviews WHERE ClusterId IS NULL AND id IS NOT NULL ORDER BY id"
+            )).fetchall()]
+        if not pending:
+            return 0
+        clusters = cluster_reviews(pending, engine, chunk_size)
+        duplicates = sum(review_id != cluster_id for review_id, cluster_id in clusters.items())
+        print(f"Clustered {len(clusters)} reviews: {duplicates} near-duplicates of earlier reviews")
+        return len(clusters)
+    except Exception as e:
+        print(f"Error building near-duplicate index: {e}")
+        return 0
+
+
+def report(engine=None, top=10):
+    """Print how many reviews are near-duplicates and the largest clusters"""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        total, unique = conn.execute(text(
+            "SELECT COUNT(*), COUNT(DISTINCT ClusterId) FROM ryanair_reviews WHERE ClusterId IS NOT NULL"
+        )).first()
+        largest = conn.execute(text("""
+            SELECT c.ClusterId, c.reviews, r.Comment FROM (
+                SELECT ClusterId, COUNT(*) AS reviews FROM ryanair_reviews
+                GROUP BY ClusterId HAVING COUNT(*) > 1
+            ) c JOIN ryanair_reviews r ON r.id = c.ClusterId
+            ORDER BY c.reviews DESC LIMIT :top
+        """), {'top': top}).fetchall()
+    print(f"{total} reviews in {unique} clusters ({total - unique} near-duplicates)")
+    for cluster_id, reviews, comment in largest:
+        print(f"  cluster {cluster_id}: {reviews} reviews - {str(comment)[:80]}")
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MinHash/LSH near-duplicate clusters of review comments")
+    parser.add_argument("--rebuild", action="store_true", help="Forget all clusters and recluster every review")
+    args = parser.parse_args()
+    engine = get_engine()
+    if args.rebuild:
+        create_near_duplicate_index(engine)
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM review_lsh"))
+            conn.execute(text(f"UPDATE {REVIEWS_TABLE} SET ClusterId = NULL"))
+    add_near_duplicate_index(engine)
+    report(engine)
@@ -0,0 +1,168 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+
+class OllamaEndpoint:
+    """One model server plus the load and health state the pool schedules on"""
+
+    def __init__(self, url, weight=1.0, max_concurrency=1):
+        self.url = url.rstrip("/")
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.latency = None  # EWMA of request latency in seconds
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+
+    @property
+    def available(self):
+        return time.time() >= self.ejected_until and self.in_flight < self.max_concurrency
+
+    def load(self):
+        """In-flight requests relative to weight (lower is better)"""
+        return (self.in_flight + 1) / self.weight
+
+    def __repr__(self):
+        return f"OllamaEndpoint({self.url!r}, in_flight={self.in_flight}, latency={self.latency})"
+
+
+class EndpointPool:
+    """Schedules requests over several Ollama servers.
+
+    strategy="least_loaded" picks the endpoint with the fewest in-flight requests per unit
+    of weight; strategy="weighted" spreads requests in proportion to weight. Endpoints
+    that fail repeatedly or are much slower than their peers are ejected for a cooldown
+    period, and a background health check brings them back once /api/tags answers again.
+    """
+
+    def __init__(self, urls, weights=None, max_concurrency=1, strategy="least_loaded",
+                 max_failures=3, slow_factor=3.0, eject_seconds=30, health_interval=10):
+        if isinstance(urls, str):
+            urls = [urls]
+        weights = weights or [1.0] * len(urls)
+        limits = max_concurrency if isinstance(max_concurrency, (list, tuple)) else [max_concurrency] * len(urls)
+        self.endpoints = [OllamaEndpoint(url, w, c) for url, w, c in zip(urls, weights, limits)]
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.slow_factor = slow_factor
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.condition = threading.Condition()
+        self._health_thread = None
+
+    def capacity(self):
+        """Total concurrent requests the pool accepts"""
+        return sum(e.max_concurrency for e in self.endpoints)
+
+    def pick(self, exclude=()):
+        """Choose an endpoint among those that are healthy and below their concurrency limit"""
+        candidates = [e for e in self.endpoints if e.available and e.url not in exclude]
+        if not candidates:
+            return None
+        if self.strategy == "weighted":
+            return min(candidates, key=lambda e: (e.requests + 1) / e.weight)
+        return min(candidates, key=lambda e: (e.load(), e.consecutive_failures, e.latency or 0.0))
+
+    @contextmanager
+    def acquire(self, timeout=None, exclude=()):
+        """Reserve a slot on an endpoint; blocks while every endpoint is busy or ejected.
+
+        Endpoints whose URL is in exclude (e.g. ones a retry already failed on) are skipped
+        unless no other endpoint exists.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        if all(e.url in exclude for e in self.endpoints):
+            exclude = ()
+        with self.condition:
+            endpoint = self.pick(exclude)
+            while endpoint is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("No Ollama endpoint available")
+                # Wake up periodically so ejection cooldowns can expire
+                self.condition.wait(min(remaining or 1.0, 1.0))
+                endpoint = self.pick(exclude)
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+
+        start = time.time()
+        ok = False
+        try:
+            yield endpoint
+            ok = True
+        finally:
+            self.release(endpoint, time.time() - start, ok)
+
+    def release(self, endpoint, latency, ok):
+        """Record the outcome of a request and eject the endpoint if it is failing or slow"""
+        with self.condition:
+            endpoint.in_flight -= 1
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.latency = latency if endpoint.latency is None else 0.8 * endpoint.latency + 0.2 * latency
+                peers = [e.latency for e in self.endpoints if e is not endpoint and e.latency is not None]
+                if peers and endpoint.latency > self.slow_factor * min(peers):
+                    self.eject(endpoint, "slow")
+            else:
+                endpoint.consecutive_failures += 1
+                if endpoint.consecutive_failures >= self.max_failures:
+                    self.eject(endpoint, "failing")
+            self.condition.notify_all()
+
+    def eject(self, endpoint, reason):
+        # Never eject the last healthy endpoint
+        healthy = [e for e in self.endpoints if time.time() >= e.ejected_until]
+        if healthy == [endpoint]:
+            return
+        endpoint.ejected_until = time.time() + self.eject_seconds
+        endpoint.latency = None  # start fresh when the cooldown ends
+        print(f"Ejected {endpoint.url} for {self.eject_seconds}s ({reason})")
+
+    def health_check(self):
+        """Probe every endpoint once; failures eject it, successes clear an ejection early"""
+        for endpoint in self.endpoints:
+            try:
+                requests.get(f"{endpoint.url}/api/tags", timeout=2).raise_for_status()
+                healthy = True
+            except requests.RequestException:
+                healthy = False
+            with self.condition:
+                if healthy and endpoint.consecutive_failures >= self.max_failures:
+                    endpoint.consecutive_failures = 0
+                    endpoint.latency = None
+                    endpoint.ejected_until = 0.0
+                elif not healthy:
+                    endpoint.consecutive_failures = self.max_failures
+                    self.eject(endpoint, "health check failed")
+                self.condition.notify_all()
+
+    def start_health_checks(self):
+        """Run health_check every health_interval seconds in a daemon thread"""
+        if self._health_thread is not None:
+            return
+
+        def loop():
+            while True:
+                self.health_check()
+                time.sleep(self.health_interval)
+
+        self._health_thread = threading.Thread(target=loop, daemon=True)
+        self._health_thread.start()
+
+    def stats(self):
+        """Per-endpoint request counts, in-flight requests, latency and ejection state"""
+        now = time.time()
+        return [
+            {
+                "url": e.url,
+                "requests": e.requests,
+                "in_flight": e.in_flight,
+                "latency_s": round(e.latency, 3) if e.latency is not None else None,
+                "ejected": now < e.ejected_until,
+            }
+            for e in self.endpoints
+        ]
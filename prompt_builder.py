@@ -0,0 +1,313 @@
+import re
+
+from review_topics import CANONICAL_TOPICS
+
+# ==============================
+# Schema knowledge for the ryanair_reviews table
+# ==============================
+# Each column: (description, sample value, keywords used for lexical matching)
+COLUMNS = {
+    "id": ("Unique review identifier.", "3", {"id", "identifier", "review"}),
+    "DatePublished": ("Raw posting date text (e.g., “2/3/2024”); filter and sort on DatePublishedISO instead.",
+                      '"2/3/2024"', {"published", "posted"}),
+    "DatePublishedISO": ("Posting date as sortable ISO text 'YYYY-MM-DD' (indexed); use for date ranges.",
+                         '"2024-02-03"', {"date", "dates", "published", "posted", "when", "recent", "latest",
+                                          "before", "after", "since", "between", "year", "time"}),
+    "DatePublishedMonth": ("Posting month 'YYYY-MM' (indexed); use for per-month or per-year trends.", '"2024-02"',
+                           {"month", "months", "monthly", "year", "years", "yearly", "trend", "trends", "over",
+                            "time", "per"}),
+    "OverallRating": ("Rating score (1–10).", "10",
+                      {"rating", "rated", "score", "overall", "average", "best", "worst", "stars"}),
+    "PassengerCountry": ("Passenger’s country of origin.", '"United Kingdom"',
+                         {"country", "countries", "nationality", "from", "passenger", "customer",
+                          "uk", "british", "german", "germany", "french", "france", "spain", "spanish",
+                          "italy", "italian", "turkish", "turkey", "irish", "ireland", "states", "american"}),
+    "TripVerified": ("“Trip Verified” or “Not Verified”.", '"Trip Verified"', {"verified", "trip", "unverified"}),
+    "CommentTitle": ("Title of the review.", '"Really impressed!"', {"title", "headline"}),
+    "Comment": ("Full text written by the passenger (fees, delays, rude staff, lost bags, etc.).",
+                '"Really impressed! You get what you pay for..."',
+                {"comment", "comments", "text", "review", "reviews", "said", "mention", "mentioned", "complain",
+                 "complained", "complaint", "complaints"}),
+    "Aircraft": ("Aircraft model (e.g., Boeing 737-800).", '"Boeing 737-800"',
+                 {"aircraft", "plane", "planes", "boeing", "airbus", "737", "model"}),
+    "TypeOfTraveller": ("Solo Leisure, Couple Leisure, Family Leisure, Business.", '"Couple Leisure"',
+                        {"traveller", "travellers", "traveler", "solo", "couple", "family", "business", "leisure"}),
+    "SeatType": ("Economy Class, Business Class.", '"Economy Class"', {"seat", "class", "economy", "cabin"}),
+    "Origin": ("Departure city.", '"Edinburgh"', {"origin", "departure", "departing", "from", "route", "routes", "city"}),
+    "Destination": ("Arrival city.", '"Paris Beauvais"',
+                    {"destination", "arrival", "to", "route", "routes", "city", "destinations"}),
+    "DateFlown": ("Raw month flown, year first (e.g., “23-Oct” = October 2023); use DateFlownMonth instead.",
+                  '"23-Oct"', {"flown", "flew"}),
+    "DateFlownMonth": ("Month flown as 'YYYY-MM' (indexed).", '"2023-10"',
+                       {"flown", "flew", "flight", "flights", "travelled", "month", "year", "when"}),
+    "SeatComfort": ("Seat comfort rating (1–5).", "5", {"seat", "seats", "comfort", "comfortable", "legroom"}),
+    "CabinStaffService": ("Cabin crew rating (1–5).", "5", {"staff", "crew", "cabin", "service", "attendant"}),
+    '"Food&Beverages"': ("Food and drinks rating (1–5).", "4", {"food", "beverage", "beverages", "drink", "drinks", "meal"}),
+    "GroundService": ("Airport service rating (1–5).", "5",
+                      {"ground", "airport", "check", "checkin", "boarding", "gate", "service"}),
+    "ValueForMoney": ("Value for money rating (1–5).", "5",
+                      {"value", "money", "price", "prices", "cheap", "expensive", "cost", "fee", "fees"}),
+    "Recommended": ("yes / no.", '"yes"', {"recommend", "recommended", "recommendation"}),
+    "InflightEntertainment": ("Entertainment rating (nullable).", "NULL", {"entertainment", "inflight", "movie"}),
+    '"Wifi&Connectivity"': ("WiFi rating (nullable).", "NULL", {"wifi", "internet", "connectivity"}),
+    "Sentiment": ("Positive, Neutral or Negative.", '"Positive"',
+                  {"sentiment", "positive", "negative", "neutral", "happy", "unhappy", "satisfied", "dissatisfied",
+                   "angry", "complain", "complained", "complaint", "complaints", "pleased"}),
+    "ClusterId": ("Near-duplicate cluster: id of the first review with an almost identical comment (indexed); "
+                  "COUNT(DISTINCT ClusterId) counts reviews without reposts.", "3",
+                  {"duplicate", "duplicates", "unique", "distinct", "deduplicated", "repost", "reposts", "copies"}),
+    "SentimentReason": ("AI-generated comma-separated topic tags, e.g. “impressed with price, soft seats”.",
+                        '"impressed with price, soft seats, plenty of legroom"',
+                        {"reason", "reasons", "topic", "topics", "theme", "themes", "why"}),
+}
+
+# Words that signal a free-text topic search over Comment and SentimentReason
+TOPIC_KEYWORDS = {
+    "fee", "fees", "charge", "charges", "expensive", "price", "prices", "hidden", "delay", "delays", "delayed",
+    "late", "waiting", "rude", "friendly", "staff", "service", "baggage", "bag", "bags", "luggage", "lost",
+    "legroom", "clean", "cleanliness", "dirty", "turbulence", "smooth", "food", "boarding", "complain",
+    "complained", "complaint", "complaints", "mention", "mentioned", "about", "cancelled", "cancellation",
+    "refund", "queue", "comfort", "cramped", "topic", "topics", "theme", "themes",
+}
+
+TOPIC_RULES = """When the question is about a topic in the reviews (fees, delays, staff, baggage, seats, cleanliness, food, boarding, ...),
+search BOTH Comment and SentimentReason with a hybrid filter of keywords and synonyms:
+WHERE (LOWER(Comment) LIKE '%<keyword>%' OR LOWER(Comment) LIKE '%<synonym>%')
+   OR (LOWER(SentimentReason) LIKE '%<keyword>%' OR LOWER(SentimentReason) LIKE '%<synonym>%')"""
+
+# Added after TOPIC_RULES when the budget allows: ranking topics is an indexed join, not a text scan
+TOPIC_TABLE_RULES = f"""For the most common topics, or topics per country/aircraft/sentiment, use table
+review_topics(review_id, topic, tag) JOIN ryanair_reviews ON id = review_id, counting COUNT(DISTINCT review_id).
+topic is one of: {', '.join(CANONICAL_TOPICS)}."""
+
+FEW_SHOT_EXAMPLES = [
+    {
+        "question": "How many customers complained about high fees?",
+        "sql": """SELECT COUNT(*)
+FROM ryanair_reviews
+WHERE (LOWER(Comment) LIKE '%fee%' OR LOWER(Comment) LIKE '%price%' OR LOWER(Comment) LIKE '%expensive%'
+       OR LOWER(Comment) LIKE '%charge%' OR LOWER(Comment) LIKE '%cost%')
+   OR (LOWER(SentimentReason) LIKE '%fee%' OR LOWER(SentimentReason) LIKE '%price%');""",
+    },
+    {
+        "question": "What are the most common complaint topics for each aircraft?",
+        "sql": """SELECT r.Aircraft, t.topic, COUNT(DISTINCT t.review_id) AS Reviews
+FROM review_topics t
+JOIN ryanair_reviews r ON r.id = t.review_id
+WHERE r.Sentiment = 'Negative'
+GROUP BY r.Aircraft, t.topic
+ORDER BY Reviews DESC
+LIMIT 20;""",
+    },
+    {
+        "question": "Retrieve all comments from Turkish passengers",
+        "sql": """SELECT Comment
+FROM ryanair_reviews
+WHERE PassengerCountry = 'Turkey';""",
+    },
+    {
+        "question": "What is the average overall rating by country?",
+        "sql": """SELECT PassengerCountry, AVG(OverallRating) AS AvgRating
+FROM ryanair_reviews
+GROUP BY PassengerCountry;""",
+    },
+    {
+        "question": "How many negative reviews are there for each aircraft?",
+        "sql": """SELECT Aircraft, COUNT(*) AS NegativeReviews
+FROM ryanair_reviews
+WHERE Sentiment = 'Negative'
+GROUP BY Aircraft
+ORDER BY NegativeReviews DESC;""",
+    },
+    {
+        "question": "Which routes have the lowest average value for money?",
+        "sql": """SELECT Origin, Destination, AVG(ValueForMoney) AS AvgValue, COUNT(*) AS Reviews
+FROM ryanair_reviews
+GROUP BY Origin, Destination
+HAVING COUNT(*) >= 3
+ORDER BY AvgValue ASC
+LIMIT 10;""",
+    },
+    {
+        "question": "How did the average rating change per month in 2023?",
+        "sql": """SELECT DatePublishedMonth, AVG(OverallRating) AS AvgRating, COUNT(*) AS Reviews
+FROM ryanair_reviews
+WHERE DatePublishedISO >= '2023-01-01' AND DatePublishedISO < '2024-01-01'
+GROUP BY DatePublishedMonth
+ORDER BY DatePublishedMonth;""",
+    },
+    {
+        "question": "What percentage of business travellers recommend Ryanair?",
+        "sql": """SELECT 100.0 * SUM(CASE WHEN LOWER(Recommended) = 'yes' THEN 1 ELSE 0 END) / COUNT(*) AS RecommendPct
+FROM ryanair_reviews
+WHERE TypeOfTraveller = 'Business';""",
+    },
+]
+
+# Dialect-specific rules, so generated SQL matches the backend it actually runs on
+DIALECT_NOTES = {
+    "SQLite": "Write SQLite SQL: use strftime('%Y', col) / strftime('%m', col) for date parts, "
+              "LIKE (no ILIKE), || for concatenation. Double-quote column names containing &.",
+    "PostgreSQL": "Write PostgreSQL SQL: use EXTRACT(YEAR FROM col) for date parts; ILIKE is available. "
+                  "Column names are stored lowercase, so write them unquoted.",
+}
+
+DEFAULT_TOKEN_BUDGET = 500
+DEFAULT_MAX_EXAMPLES = 3
+
+
+# ==============================
+# Lexical matching helpers
+# ==============================
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token)"""
+    return max(1, len(text) // 4)
+
+
+def tokenize(text):
+    """Lowercase word tokens with a naive plural strip"""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words} | set(words)
+
+
+def select_columns(question):
+    """Return the columns whose keywords overlap the question, best match first"""
+    words = tokenize(question)
+    scored = []
+    for column, (_, _, keywords) in COLUMNS.items():
+        name_words = tokenize(re.sub(r"([a-z])([A-Z])", r"\1 \2", column))
+        score = len(words & keywords) + 2 * len(words & name_words)
+        if score:
+            scored.append((score, column))
+    return [column for _, column in sorted(scored, key=lambda item: -item[0])]
+
+
+def is_topic_question(question):
+    """True when the question asks about a free-text topic in the comments"""
+    return bool(tokenize(question) & TOPIC_KEYWORDS)
+
+
+def rank_examples(question, examples=None):
+    """Rank few-shot examples by word overlap (Jaccard) with the question, dropping non-overlapping ones"""
+    words = tokenize(question)
+    scored = []
+    for example in examples if examples is not None else FEW_SHOT_EXAMPLES:
+        example_words = tokenize(example["question"])
+        union = words | example_words
+        score = len(words & example_words) / len(union) if union else 0.0
+        if score > 0:
+            scored.append((score, example))
+    return [example for score, example in sorted(scored, key=lambda item: -item[0])]
+
+
+def dialect_column(column, dialect):
+    """Column name as it must be written in the given dialect"""
+    if dialect == "PostgreSQL":
+        return column.strip('"').replace("&", "")
+    return column
+
+
+def format_example(example):
+    return f'User: "{example["question"]}"\nSQL:\n{example["sql"]}'
+
+
+# ==============================
+# Prompt builders
+# ==============================
+def build_query_prompt(user_question, token_budget=DEFAULT_TOKEN_BUDGET, examples=None, dialect="SQLite",
+                       max_examples=DEFAULT_MAX_EXAMPLES, retrieved_examples=None):
+    """Build a SQL-generation prompt containing only the schema and examples relevant to the question.
+
+    Sections are added in priority order until the token budget is used up. With
+    token_budget=None every column, the topic rules and all examples are included.
+    retrieved_examples (verified pairs from past successful queries) take priority
+    over the static few-shot examples. Returns (prompt, prompt_tokens).
+    """
+    header = (
+        f"You are an expert SQL assistant for a {dialect} table named `ryanair_reviews`.\n"
+        f"{DIALECT_NOTES.get(dialect, '')}\n"
+        f"Columns: {', '.join(dialect_column(c, dialect) for c in COLUMNS)}"
+    )
+    footer = f"Now generate SQL ONLY. No explanation.\n\nUser question:\n{user_question}\n\nSQL:\n"
+
+    if token_budget is None:
+        columns = list(COLUMNS)
+        topic = True
+    else:
+        columns = select_columns(user_question)
+        topic = is_topic_question(user_question)
+        if topic:
+            columns += [c for c in ("Comment", "SentimentReason") if c not in columns]
+
+    sections = [header]
+    used = estimate_tokens(header) + estimate_tokens(footer)
+
+    def add(section):
+        nonlocal used
+        cost = estimate_tokens(section)
+        if token_budget is not None and used + cost > token_budget:
+            return False
+        sections.append(section)
+        used += cost
+        return True
+
+    if columns:
+        lines = [f"- {dialect_column(c, dialect)}: {COLUMNS[c][0]} Example value: {COLUMNS[c][1]}" for c in columns]
+        described = ["Relevant columns:"]
+        for line in lines:
+            if token_budget is not None and used + estimate_tokens("\n".join(described + [line])) > token_budget:
+                break
+            described.append(line)
+        if len(described) > 1:
+            add("\n".join(described))
+
+    if topic:
+        add(TOPIC_RULES)
+        add(TOPIC_TABLE_RULES)
+
+    retrieved = list(retrieved_examples or [])
+    if token_budget is None:
+        candidates = retrieved + list(examples if examples is not None else FEW_SHOT_EXAMPLES)
+    else:
+        static = rank_examples(user_question, examples)
+        candidates = (retrieved + static)[:max(max_examples, len(retrieved))]
+    chosen = []
+    for example in candidates:
+        block = "Examples:\n\n" + "\n\n".join(format_example(e) for e in chosen + [example])
+        if token_budget is not None and used + estimate_tokens(block) > token_budget:
+            break
+        chosen.append(example)
+    if chosen:
+        add("Examples:\n\n" + "\n\n".join(format_example(e) for e in chosen))
+
+    sections.append(footer)
+    prompt = "\n\n".join(sections)
+    return prompt, estimate_tokens(prompt)
+
+
+def build_repair_prompt(bad_sql, error_msg, user_question, token_budget=DEFAULT_TOKEN_BUDGET, dialect="SQLite"):
+    """Build a compact SQL-repair prompt. Returns (prompt, prompt_tokens)."""
+    columns = select_columns(user_question)
+    rules = f"""You are an expert {dialect} SQL mechanic. Fix the broken SQL so it runs and answers the question.
+{DIALECT_NOTES.get(dialect, '')}
+Rules: use table ryanair_reviews (and review_topics(review_id, topic, tag) for topic counts); only use these columns: {', '.join(dialect_column(c, dialect) for c in COLUMNS)};
+include GROUP BY for aggregations; rewrite from scratch if the SQL is structurally wrong."""
+    body = f"""User question:
+{user_question}
+
+Broken SQL:
+{bad_sql}
+
+SQL Error:
+{error_msg}
+
+Return ONLY the fixed {dialect} SQL (no explanation)."""
+
+    sections = [rules]
+    if columns:
+        hints = "Relevant columns:\n" + "\n".join(f"- {dialect_column(c, dialect)}: {COLUMNS[c][0]}" for c in columns)
+        if token_budget is None or estimate_tokens(rules + hints + body) <= token_budget:
+            sections.append(hints)
+    sections.append(body)
+    prompt = "\n\n".join(sections)
+    return prompt, estimate_tokens(prompt)
@@ -1,162 +1,160 @@
 import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from sqlalchemy import text
-import streamlit as st
-from huggingface_hub import InferenceClient
-from sqlite_config import get_sqlite_engine
+from sqlite_config import get_dialect, get_engine, get_setting
+from prompt_builder import DEFAULT_TOKEN_BUDGET, build_query_prompt, build_repair_prompt
+from query_examples import SuccessfulQueryIndex
+from create_error_table import create_error_log_table, log_query_error, log_successful_query
+from review_dates import add_date_columns
+from review_topics import add_review_topics
+from near_duplicates import add_near_duplicate_index
+from review_sample import MIN_ROWS, add_review_sample, approximate_answer
+import os
 import re
+import threading
+import time
 
 
-class QueryAgent:
+class QueryResult:
+    """Everything one answer_question call produced. It is returned, never kept on the agent, so callers sharing an
+    agent (the Streamlit sessions) each get their own SQL and result."""
+
     def __init__(self):
-        # HF Token
-        self.token = st.secrets["HF_API_KEY"]
+        self.answer = None
+        self.sql = None  # the SQL that produced df (after any repair); None when no SQL ran successfully
+        self.df = None
+        self.repairs = 0
+        self.timings = {}
+        self.repair_attempts = []  # [{sql, error}] of a failed query and its repair candidates
+        self.repair_df = None  # result of the repair that succeeded, already run while it was chosen
 
-        # Main SQL generation (fast)
-        self.client_main = InferenceClient(
-            model="google/gemma-2-9b-it",#"meta-llama/Llama-3.2-1B-Instruct",
-            token=self.token
-        )
 
+class QueryAgent:
+    """Natural language → SQL over ryanair_reviews. UI-free: progress messages go to on_event.
+
+    on_event(kind, message) receives kind in {"caption", "info", "warning", "success", "code", "approximate",
+    "exact"}; without it messages are printed, so the agent runs the same in the CLI, batch jobs and Streamlit.
+    "approximate" carries a DataFrame (its attrs["caption"] says how it was estimated) that the following
+    "exact" message replaces.
+    """
+
+    def __init__(self, on_event=None):
+        # HF token from the environment or .streamlit/secrets.toml; clients are built on first use
+        self.token = get_setting("HF_API_KEY")
+        self.on_event = on_event
+
+        # Main SQL generation (fast); a model id or the URL of an OpenAI-compatible server
+        self.main_model = get_setting("QUERY_MAIN_MODEL", "google/gemma-2-9b-it")  # "meta-llama/Llama-3.2-1B-Instruct"
         # Strong repair & intent reinterpretation model
-        self.client_repair = InferenceClient(
-            model="google/gemma-2-9b-it",#"Qwen/Qwen2.5-7B-Instruct",
-            token=self.token
-        )
+        self.repair_model = get_setting("QUERY_REPAIR_MODEL", "google/gemma-2-9b-it")  # "Qwen/Qwen2.5-7B-Instruct"
+        self._client_main = None
+        self._client_repair = None
+
+        # Speculative repair: send this many repair candidates at once and keep the first that runs
+        # (0 = the sequential five attempts). Candidates cycle through the temperatures and through
+        # QUERY_REPAIR_MODELS (comma-separated model ids or URLs) when it is set.
+        self.speculative_repairs = int(get_setting("SPECULATIVE_REPAIRS", 0))
+        self.repair_temperatures = [0.0, 0.4, 0.7, 0.2, 0.9]
+        self.repair_models = [m.strip() for m in get_setting("QUERY_REPAIR_MODELS", "").split(",") if m.strip()]
+        self._repair_clients = {}
+
+        # DB connection (shared pool) and the SQL dialect the prompts must target
+        self.engine = get_engine()
+        self.dialect = get_dialect(self.engine)
+
+        # Optional DuckDB/Parquet engine for read-only aggregate queries (ANALYTICS_ENGINE=duckdb)
+        self.analytics = None
+        if os.environ.get("ANALYTICS_ENGINE", "").lower() == "duckdb":
+            from analytics_engine import AnalyticsEngine
+            self.analytics = AnalyticsEngine()
+
+        # Progressive answers: aggregate queries over at least APPROXIMATE_MIN_ROWS reviews first show an
+        # estimate from the review sample, then the exact result (PROGRESSIVE_ANSWERS=0 turns it off)
+        self.progressive = get_setting("PROGRESSIVE_ANSWERS", "1") != "0"
+        self.approximate_min_rows = int(get_setting("APPROXIMATE_MIN_ROWS", MIN_ROWS))
+
+        # Prompt size control (None = full schema and all examples)
+        self.prompt_token_budget = DEFAULT_TOKEN_BUDGET
+        self.last_prompt_tokens = 0
+        self.prompt_token_log = []
+
+        # Sortable date columns, the topic table and near-duplicate clusters that the prompts point questions at,
+        # and the uniform review sample behind approximate answers
+        add_date_columns(self.engine)
+        add_review_topics(self.engine)
+        add_near_duplicate_index(self.engine)
+        add_review_sample(self.engine)
+
+        # Verified question → SQL pairs from query_success_log, used as few-shot examples
+        create_error_log_table()
+        self.example_index = SuccessfulQueryIndex().load(self.engine)
+        self.use_retrieval = True
+        self.retrieval_k = 2
+        # Answered questions are logged to query_success_log and added to the index (benchmarks turn this off)
+        self.log_successes = True
+
+        # Repair-rate bookkeeping (see benchmark.py repair-rate)
+        self.stats = {"questions": 0, "repaired": 0, "failed": 0, "repair_attempts": 0}
 
-        # DB connection
-        self.engine = get_sqlite_engine()
+    # -----------------------------------------------------------
+    #================ CLIENTS AND UI EVENTS =====================
+    #------------------------------------------------------------
+    def make_client(self, model):
+        if not self.token:
+            raise RuntimeError("HF_API_KEY is not set (environment variable or .streamlit/secrets.toml)")
+        # Imported here: huggingface_hub is one of the slowest imports at start-up
+        from huggingface_hub import InferenceClient
+        return InferenceClient(model=model, token=self.token)
+
+    @property
+    def client_main(self):
+        if self._client_main is None:
+            self._client_main = self.make_client(self.main_model)
+        return self._client_main
+
+    @property
+    def client_repair(self):
+        if self._client_repair is None:
+            self._client_repair = self.make_client(self.repair_model)
+        return self._client_repair
+
+    def repair_client(self, model):
+        """Client for one of the speculative repair models (the repair slot's own model reuses client_repair)"""
+        if model == self.repair_model:
+            return self.client_repair
+        if model not in self._repair_clients:
+            self._repair_clients[model] = self.make_client(model)
+        return self._repair_clients[model]
+
+    def notify(self, kind, message):
+        if self.on_event is not None:
+            self.on_event(kind, message)
+        else:
+            print(message)
 
     # -----------------------------------------------------------
     #==================== PROMPT BUILDER ========================
     #------------------------------------------------------------
     def get_query_prompt(self, user_question: str) -> str:
-        return f"""
-You are an expert SQL assistant for a PostgreSQL table named `ryanair_reviews`.
-
-Below are ALL columns and their meanings:
-
-- id: Unique review identifier.
-- DatePublished: Date the review was posted (YYYY-MM-DD).
-- OverallRating: Rating score (1–10).
-- PassengerCountry: Passenger’s country of origin.
-- TripVerified: “Trip Verified” or “Not Verified”.
-- CommentTitle: Title of the review.
-- Comment: Full text written by the passenger. Contains issues like:
-  - fees, charges, expensive prices, delays, rude staff, lost bags, etc.
-- Aircraft: Aircraft model (e.g., Boeing 737-800).
-- TypeOfTraveller: Solo, Couple Leisure, Family Leisure, Business, etc.
-- SeatType: Economy Class, Business Class.
-- Origin: Departure city.
-- Destination: Arrival city.
-- DateFlown: Period flown (e.g., “Oct-23”).
-- SeatComfort: Seat comfort rating.
-- CabinStaffService: Cabin crew rating.
-- FoodBeverages: Food and drinks rating.
-- GroundService: Airport service rating.
-- ValueForMoney: Value for money rating.
-- Recommended: Yes / No.
-- InflightEntertainment: Entertainment rating (nullable).
-- WifiConnectivity: WiFi rating (nullable).
-- Sentiment: Positive or Negative.
-- SentimentReason: AI-generated list of topic tags summarizing main themes of the comment.
-  Example: “impressed with price, soft seats, plenty of legroom”.
-
-Example real row from the dataset:
-id: 3
-DatePublished: "2024-01-20"
-OverallRating: 10
-PassengerCountry: "United Kingdom"
-TripVerified: "Trip Verified"
-CommentTitle: "Really impressed!"
-Comment: "Really impressed! You get what you pay for... Highly recommend."
-Aircraft: "Boeing 737-800"
-TypeOfTraveller: "Couple Leisure"
-SeatType: "Economy Class"
-Origin: "Edinburgh"
-Destination: "Paris Beauvais"
-DateFlown: "Oct-23"
-SeatComfort: 5
-CabinStaffService: 5
-FoodBeverages: 4
-GroundService: 5
-ValueForMoney: 5
-Recommended: "yes"
-Sentiment: "Positive"
-SentimentReason: "impressed with price, soft seats, plenty of legroom"
-
-IMPORTANT:
-When the user asks about ANY topic in the reviews — whether positive, neutral, or negative —
-such as:
-
-- high fees, expensive prices, extra charges, hidden fees
-- delays, late flights, waiting times
-- rude staff, excellent staff, good service, bad service
-- lost baggage, baggage issues
-- seat comfort, legroom, soft seats
-- cleanliness, cabin condition
-- value for money, price satisfaction
-- turbulence, smooth flight
-- entertainment, WiFi
-- food quality, beverages
-- boarding experience, ground service
-
-You MUST search for these topics using a HYBRID FILTER on BOTH columns:
-1. Comment (long free text)
-2. SentimentReason (AI-generated list of topic keywords)
-
-Because:
-- The Comment may contain long descriptions.
-- SentimentReason contains extracted topics that help identify meaning.
-
-Always use SQL like:
-
-WHERE (
-    LOWER(Comment) LIKE '%<keyword1>%' OR
-    LOWER(Comment) LIKE '%<synonym1>%' OR
-    LOWER(Comment) LIKE '%<synonym2>%' 
-)
-OR (
-    LOWER(SentimentReason) LIKE '%<keyword1>%' OR
-    LOWER(SentimentReason) LIKE '%<synonym1>%'
-)
-
-Examples:
-
-User: "How many customers complained about high fees?"
-SQL:
-SELECT COUNT(*)
-FROM ryanair_reviews
-WHERE (
-    LOWER(Comment) LIKE '%fee%' OR
-    LOWER(Comment) LIKE '%price%' OR
-    LOWER(Comment) LIKE '%expensive%' OR
-    LOWER(Comment) LIKE '%charge%' OR
-    LOWER(Comment) LIKE '%cost%'
-)
-OR (
-    LOWER(SentimentReason) LIKE '%fee%' OR
-    LOWER(SentimentReason) LIKE '%price%'
-);
-
-User: "Retrieve all comments from Turkish passengers"
-SQL:
-SELECT comment
-FROM ryanair_reviews
-WHERE PassengerCountry = 'Turkey';
-
-User: "What is the average overall rating by country?"
-SQL:
-SELECT PassengerCountry, AVG(OverallRating) AS AvgRating
-FROM ryanair_reviews
-GROUP BY PassengerCountry;
-
-Now generate SQL ONLY. No explanation.
-
-User question:
-{user_question}
-
-SQL:
-"""
+        retrieved = []
+        if self.use_retrieval:
+            retrieved = self.example_index.nearest(user_question, k=self.retrieval_k)
+            if retrieved:
+                self.notify("caption", f"📚 Using {len(retrieved)} similar verified queries as examples")
+        prompt, tokens = build_query_prompt(
+            user_question, token_budget=self.prompt_token_budget, retrieved_examples=retrieved,
+            dialect=self.dialect
+        )
+        self.last_prompt_tokens = tokens
+        return prompt
+
+    def report_prompt_tokens(self, stage, estimated, response=None):
+        """Record and show the prompt token count for one LLM call"""
+        usage = getattr(response, "usage", None)
+        tokens = getattr(usage, "prompt_tokens", None) or estimated
+        self.prompt_token_log.append({"stage": stage, "prompt_tokens": tokens})
+        self.notify("caption", f"🧮 {stage} prompt: {tokens} tokens")
+        return tokens
 
     # -----------------------------------------------------------
     #============== INTENT CLEANING BEFORE SQL ==================
@@ -190,10 +188,11 @@ Rewritten:
                 max_tokens=200,
                 temperature=0.1
             )
+            self.report_prompt_tokens("generate_sql", self.last_prompt_tokens, response)
             raw = response.choices[0].message["content"]
             return self.clean_sql(raw)
         except Exception as e:
-            st.warning(f"SQL generation error: {e}")
+            self.notify("warning", f"SQL generation error: {e}")
             return None
 
     # -----------------------------------------------------------
@@ -208,44 +207,18 @@ Rewritten:
     # -----------------------------------------------------------
     #====================== SQL REPAIR ==========================
     #------------------------------------------------------------
-    def repair_sql(self, bad_sql, error_msg, user_question):
+    def repair_sql(self, bad_sql, error_msg, user_question, result):
+        result.repair_attempts = [{"sql": bad_sql, "error": error_msg}]
+        if self.speculative_repairs > 0:
+            return self.speculative_repair_sql(bad_sql, error_msg, user_question, result)
         for attempt in range(1, 6):
-            st.info(f"🔧 Attempt {attempt}/5 to fix SQL...")
-
-            prompt = f"""
-You are an expert PostgreSQL SQL mechanic. 
-Your job is to FIX invalid SQL queries so they successfully run.
-
-You MUST follow these rules:
-
-1. ALWAYS generate correct PostgreSQL SQL.
-2. ALWAYS use the correct table name: ryanair_reviews
-3. ONLY use existing column names:
-   id, DatePublished, OverallRating, PassengerCountry, TripVerified,
-   CommentTitle, Comment, Aircraft, TypeOfTraveller, SeatType, 
-   Origin, Destination, DateFlown, SeatComfort, CabinStaffService,
-   FoodBeverages, GroundService, ValueForMoney, Recommended,
-   InflightEntertainment, WifiConnectivity, Sentiment, SentimentReason
+            self.notify("info", f"🔧 Attempt {attempt}/5 to fix SQL...")
+            self.stats["repair_attempts"] += 1
+            result.repairs += 1
 
-4. When the query uses grouping or aggregation, ALWAYS include GROUP BY.
-5. Never guess column names. Only use the list above.
-6. If the user question requests a count by category, generate:
-   SELECT <column>, COUNT(*) FROM ryanair_reviews GROUP BY <column>
-7. If the query contains errors, FIX them step-by-step.
-8. If the SQL is structurally wrong, rewrite it from scratch.
-
-User question:
-{user_question}
-
-Broken SQL:
-{bad_sql}
-
-SQL Error:
-{error_msg}
-
-Now produce VALID PostgreSQL SQL that answers the question.
-Return ONLY the fixed SQL (no explanation)
-"""
+            prompt, prompt_tokens = build_repair_prompt(
+                bad_sql, error_msg, user_question, token_budget=self.prompt_token_budget, dialect=self.dialect
+            )
 
             try:
                 response = self.client_repair.chat_completion(
@@ -253,31 +226,148 @@ Return ONLY the fixed SQL (no explanation)
                     max_tokens=200,
                     temperature=0.0,
                 )
+                self.report_prompt_tokens(f"repair_sql #{attempt}", prompt_tokens, response)
                 candidate = self.clean_sql(response.choices[0].message["content"])
 
                 try:
-                    pd.read_sql(candidate, self.engine)
+                    result.repair_df = self.run_sql(candidate)
                     return candidate  # success!
-                except:
+                except Exception as err:
+                    result.repair_attempts.append({"sql": candidate, "error": str(err)})
                     continue
 
-            except:
+            except Exception as err:
+                result.repair_attempts.append({"sql": None, "error": str(err)})
                 continue
 
         return None
 
+    def validate_sql(self, sql_query):
+        """Have the primary database plan a query without running it; raises on an invalid query"""
+        with self.engine.connect() as conn:
+            conn.exec_driver_sql(f"EXPLAIN {sql_query}").fetchall()
+
+    def repair_candidate(self, model, temperature, prompt, cancelled):
+        """One speculative repair: generate a candidate and check that it plans. Returns (sql, response, error).
+        Runs on a worker thread, so it reports nothing itself."""
+        response = None
+        try:
+            response = self.repair_client(model).chat_completion(
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=200,
+                temperature=temperature,
+            )
+            candidate = self.clean_sql(response.choices[0].message["content"])
+        except Exception as err:
+            return None, response, str(err)
+        if cancelled.is_set():
+            return candidate, response, "cancelled: another candidate already ran"
+        try:
+            # EXPLAIN only: a losing candidate never runs in full
+            self.validate_sql(candidate)
+            return candidate, response, None
+        except Exception as err:
+            return candidate, response, str(err)
+
+    def speculative_repair_sql(self, bad_sql, error_msg, user_question, result):
+        """Send speculative_repairs candidates concurrently and run the first that plans through run_sql; once
+        one runs the rest are cancelled (queued ones never start, in-flight ones skip validation and are ignored)."""
+        k = self.speculative_repairs
+        self.notify("info", f"🔧 Trying {k} SQL fixes in parallel...")
+        prompt, prompt_tokens = build_repair_prompt(
+            bad_sql, error_msg, user_question, token_budget=self.prompt_token_budget, dialect=self.dialect
+        )
+        models = self.repair_models or [self.repair_model]
+        cancelled = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=k)
+        pending = {
+            executor.submit(self.repair_candidate, models[i % len(models)],
+                            self.repair_temperatures[i % len(self.repair_temperatures)], prompt, cancelled)
+            for i in range(k)
+        }
+        self.stats["repair_attempts"] += k
+        result.repairs += k
+        try:
+            attempt = 0
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    attempt += 1
+                    candidate, response, error = future.result()
+                    if response is not None:
+                        self.report_prompt_tokens(f"repair_sql #{attempt} (parallel)", prompt_tokens, response)
+                    if error is None:
+                        try:
+                            result.repair_df = self.run_sql(candidate)
+                            cancelled.set()
+                            return candidate
+                        except Exception as err:
+                            error = str(err)
+                    result.repair_attempts.append({"sql": candidate, "error": error})
+            return None
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     # -----------------------------------------------------------
     #==================== EXECUTE SQL ===========================
     #------------------------------------------------------------
-    def execute_query(self, sql_query, user_question):
+    def run_sql(self, sql_query):
+        """Run SQL on the analytical snapshot when its shape allows, else on the primary database"""
+        if self.analytics is not None:
+            self.analytics.maybe_refresh()
+            if self.analytics.should_route(sql_query):
+                try:
+                    df = self.analytics.query(sql_query)
+                    self.notify("caption", "🦆 Answered from the DuckDB analytical snapshot")
+                    return df
+                except Exception as err:
+                    print(f"Analytical engine could not run query, using primary database: {err}")
+        return pd.read_sql(sql_query, self.engine)
+
+    def show_approximate(self, sql_query, result):
+        """Show an estimate of an aggregate query from the review sample before it runs in full; True if shown"""
+        if not self.progressive:
+            return False
+        start = time.perf_counter()
         try:
-            return pd.read_sql(sql_query, self.engine)
+            approximate = approximate_answer(sql_query, self.engine, self.approximate_min_rows)
         except Exception as err:
-            fixed = self.repair_sql(sql_query, str(err), user_question)
-            if fixed:
-                st.success("✅ SQL fixed automatically!")
-                return pd.read_sql(fixed, self.engine)
+            print(f"No approximate answer, running the full query only: {err}")
+            return False
+        if approximate is None:
+            return False
+        result.timings["approximate_ms"] = int((time.perf_counter() - start) * 1000)
+        self.notify("approximate", approximate)
+        return True
+
+    def execute_query(self, sql_query, user_question, result):
+        result.sql = sql_query
+        approximate = self.show_approximate(sql_query, result)
+        start = time.perf_counter()
+        try:
+            return self.execute_exact(sql_query, user_question, result)
+        finally:
+            if approximate:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self.notify("exact", f"✅ Full query finished in {elapsed_ms:.0f} ms (replaces the estimate)")
 
+    def execute_exact(self, sql_query, user_question, result):
+        try:
+            return self.run_sql(sql_query)
+        except Exception as err:
+            self.stats["repaired"] += 1
+            repair_start = time.perf_counter()
+            fixed = self.repair_sql(sql_query, str(err), user_question, result)
+            result.timings["repair_ms"] = int((time.perf_counter() - repair_start) * 1000)
+            if fixed:
+                self.notify("success", "✅ SQL fixed automatically!")
+                result.sql = fixed
+                # repair_sql already ran the fix
+                return result.repair_df if result.repair_df is not None else self.run_sql(fixed)
+
+            self.stats["failed"] += 1
+            result.sql = None
+            log_query_error(user_question, result.repair_attempts[:5])
             return pd.DataFrame([{"UnfixableError": str(err)}])
 
     # -----------------------------------------------------------
@@ -298,16 +388,33 @@ Return ONLY the fixed SQL (no explanation)
     # -----------------------------------------------------------
     #======================== MAIN API ==========================
     #------------------------------------------------------------
-    def answer_question(self, user_question: str) -> str:
+    def answer_question(self, user_question: str) -> QueryResult:
+        """Answer one question; the returned QueryResult carries the answer text, SQL, DataFrame and timings"""
+        self.stats["questions"] += 1
+        result = QueryResult()
+        start = time.perf_counter()
 
         cleaned = self.interpret_question(user_question)
-        st.info(f"🧠 Rewritten question: `{cleaned}`")
+        result.timings["interpret_ms"] = int((time.perf_counter() - start) * 1000)
+        self.notify("info", f"🧠 Rewritten question: `{cleaned}`")
+        stage = time.perf_counter()
         sql_query = self.generate_sql(cleaned)
+        result.timings["generate_ms"] = int((time.perf_counter() - stage) * 1000)
 
         if not sql_query:
-            return "Couldn't generate SQL for that question."            
-        st.code(sql_query, language="sql")  # ⬅ SHOW GENERATED SQL
-
-
-        df = self.execute_query(sql_query, cleaned)
-        return self.format_answer(df)
+            result.answer = "Couldn't generate SQL for that question."
+            return result
+        self.notify("code", sql_query)  # ⬅ SHOW GENERATED SQL
+
+
+        stage = time.perf_counter()
+        result.df = self.execute_query(sql_query, cleaned, result)
+        result.timings["execute_ms"] = int((time.perf_counter() - stage) * 1000)
+        result.answer = self.format_answer(result.df)
+
+        # Verified pairs feed back into generation for similar future questions
+        if result.sql and self.log_successes:
+            elapsed_ms = int((time.perf_counter() - start) * 1000)
+            log_successful_query(cleaned, result.sql, result.answer, elapsed_ms)
+            self.example_index.add(cleaned, result.sql)
+        return result
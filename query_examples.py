@@ -0,0 +1,78 @@
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect
+
+from sqlite_config import get_engine
+
+
+class SuccessfulQueryIndex:
+    """In-memory similarity index over verified question → SQL pairs from query_success_log.
+
+    Questions are embedded as hashed character n-gram count vectors (L2-normalised),
+    so a lookup is a single matrix-vector product in NumPy.
+    """
+
+    def __init__(self, dim=4096, ngram=3):
+        self.dim = dim
+        self.ngram = ngram
+        self.questions = []
+        self.sql = []
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.questions)
+
+    def vectorize(self, question):
+        """Hashed character n-gram vector for one question"""
+        text = f" {re.sub(r'[^a-z0-9 ]+', ' ', question.lower())} "
+        text = re.sub(r"\s+", " ", text)
+        vector = np.zeros(self.dim, dtype=np.float32)
+        grams = [text[i:i + self.ngram] for i in range(max(1, len(text) - self.ngram + 1))]
+        # Python's str hash is salted per process; crc32 keeps vectors stable across runs
+        indices = [zlib.crc32(g.encode()) % self.dim for g in grams]
+        np.add.at(vector, indices, 1.0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, question, sql_query):
+        """Add a verified pair; an existing identical question is replaced by the newer SQL"""
+        key = question.strip().lower()
+        for i, existing in enumerate(self.questions):
+            if existing.strip().lower() == key:
+                self.sql[i] = sql_query
+                return
+        self.questions.append(question)
+        self.sql.append(sql_query)
+        self.vectors = np.vstack([self.vectors, self.vectorize(question)[None, :]])
+
+    def load(self, engine=None):
+        """(Re)build the index from query_success_log; a missing table leaves it empty"""
+        engine = engine or get_engine()
+        if not inspect(engine).has_table("query_success_log"):
+            return self
+        df = pd.read_sql(
+            "SELECT user_question, sql_query FROM query_success_log ORDER BY id", engine
+        )
+        # Keep the most recent SQL for each distinct question
+        df = df.drop_duplicates(subset="user_question", keep="last")
+        self.questions = df["user_question"].tolist()
+        self.sql = df["sql_query"].tolist()
+        if self.questions:
+            self.vectors = np.vstack([self.vectorize(q) for q in self.questions])
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        return self
+
+    def nearest(self, question, k=3, min_score=0.35):
+        """Return up to k {question, sql, score} examples most similar to the question"""
+        if not self.questions:
+            return []
+        scores = self.vectors @ self.vectorize(question)
+        top = np.argsort(-scores)[:k]
+        return [
+            {"question": self.questions[i], "sql": self.sql[i], "score": float(scores[i])}
+            for i in top if scores[i] >= min_score
+        ]
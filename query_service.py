@@ -0,0 +1,204 @@
+import argparse
+import json
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batch_questions import BatchRunner
+
+
+def normalize_question(question):
+    """Key under which identical questions are coalesced: case, spacing and trailing punctuation ignored"""
+    return re.sub(r'[\s?!.]+$', '', ' '.join(question.lower().split()))
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; concurrent callers with the same key share its future"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def submit(self, key, start):
+        """Return (future, shared): the in-flight future for key, or a new one from start()"""
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future, True
+            future = start()
+            self.in_flight[key] = future
+        future.add_done_callback(lambda _: self.forget(key, future))
+        return future, False
+
+    def forget(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+
+class QueryService:
+    """QueryAgent behind a bounded worker pool with single-flight coalescing.
+
+    Concurrent requests whose normalized question is already being answered wait
+    for that answer instead of starting their own LLM and SQL pipeline. Requests
+    beyond max_pending distinct computations are rejected so a burst cannot queue
+    unbounded work.
+    """
+
+    def __init__(self, workers=4, max_pending=64, timeout=120, coalesce=True, max_rows=100):
+        self.runner = BatchRunner(workers, max_rows)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.flights = SingleFlight()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.latencies = []  # ms of recent requests, for the metrics endpoint
+        self.counters = {'requests': 0, 'computations': 0, 'coalesced': 0, 'rejected': 0, 'errors': 0,
+                         'timeouts': 0}
+        self.started = time.time()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def compute(self, question):
+        try:
+            return self.runner.answer({'id': None, 'question': question})
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    def start(self, question):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise OverflowError(f"{self.pending} questions already pending")
+            self.pending += 1
+            self.counters['computations'] += 1
+        return self.executor.submit(self.compute, question)
+
+    def ask(self, question):
+        """Answer a question, sharing the computation with identical in-flight questions.
+
+        Returns (status, record) where status is an HTTP status code.
+        """
+        self.count('requests')
+        started = time.perf_counter()
+        try:
+            if self.coalesce:
+                future, shared = self.flights.submit(normalize_question(question), lambda: self.start(question))
+            else:
+                future, shared = self.start(question), False
+        except OverflowError as e:
+            self.count('rejected')
+            return 503, {'question': question, 'error': f"Service busy: {e}"}
+        if shared:
+            self.count('coalesced')
+
+        try:
+            record = dict(future.result(timeout=self.timeout))
+        except FutureTimeoutError:
+            self.count('timeouts')
+            return 504, {'question': question, 'error': f"No answer within {self.timeout}s"}
+        record['question'] = question
+        record['coalesced'] = shared
+        if record['error']:
+            self.count('errors')
+        with self.lock:
+            self.latencies = self.latencies[-999:] + [(time.perf_counter() - started) * 1000]
+        return 200, record
+
+    def health(self):
+        return {'status': 'ok', 'workers': self.workers, 'pending': self.pending,
+                'uptime_s': int(time.time() - self.started)}
+
+    def metrics(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = dict(self.counters, pending=self.pending, in_flight_keys=len(self.flights.in_flight))
+        if latencies:
+            metrics['latency_ms'] = {
+                'p50': round(statistics.median(latencies), 1),
+                'p95': round(latencies[int(0.95 * (len(latencies) - 1))], 1),
+                'max': round(latencies[-1], 1),
+            }
+        return metrics
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """POST /ask {"question": ...}; GET /health; GET /metrics"""
+
+    service = None
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, self.service.health())
+        elif self.path == '/metrics':
+            self.send_json(200, self.service.metrics())
+        else:
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != '/ask':
+            self.send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            question = str(body.get('question', '')).strip()
+        except (ValueError, AttributeError):
+            self.send_json(400, {'error': 'Body must be a JSON object with a "question"'})
+            return
+        if not question:
+            self.send_json(400, {'error': 'Missing "question"'})
+            return
+        self.send_json(*self.service.ask(question))
+
+
+def start_server(service, host='127.0.0.1', port=8000):
+    """Serve in a background thread; returns the server (server.server_port has the bound port)"""
+    handler = type('Handler', (QueryRequestHandler,), {'service': service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP service answering questions about the reviews")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4, help="Questions answered in parallel")
+    parser.add_argument("--max-pending", type=int, default=64, help="Distinct questions queued before 503s")
+    parser.add_argument("--timeout", type=int, default=120, help="Seconds a request waits for its answer")
+    parser.add_argument("--no-coalesce", action="store_true", help="Answer every request separately")
+    args = parser.parse_args()
+
+    service = QueryService(args.workers, args.max_pending, args.timeout, coalesce=not args.no_coalesce)
+    server = start_server(service, args.host, args.port)
+    print(f"Query service on http://{args.host}:{server.server_port} "
+          f"(POST /ask, GET /health, GET /metrics) with {args.workers} workers")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,432 @@
+import argparse
+import io
+import json
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from review_dates import add_date_columns
+from sqlite_config import get_engine, is_sqlite
+
+SUB_SCORES = ['SeatComfort', 'CabinStaffService', 'Food&Beverages', 'GroundService', 'ValueForMoney',
+              'InflightEntertainment', 'Wifi&Connectivity']
+TARGETS = ['OverallRating', 'Sentiment']
+VARIABLES = TARGETS + SUB_SCORES
+SENTIMENT_SCORES = {'positive': 1.0, 'mixed': 0.0, 'neutral': 0.0, 'negative': -1.0}
+
+# Dimension -> the columns its group key is made of ('all' is a single group of every review)
+DIMENSIONS = {
+    'all': [],
+    'country': ['PassengerCountry'],
+    'aircraft': ['Aircraft'],
+    'route': ['Origin', 'Destination'],
+    'month': ['DatePublishedMonth'],
+}
+ALL_KEY = 'All reviews'
+SOURCE_COLUMNS = VARIABLES + ['PassengerCountry', 'Aircraft', 'Origin', 'Destination', 'DatePublishedMonth']
+
+
+def column_key(name):
+    """'Food&Beverages' and PostgreSQL's 'foodbeverages' -> 'foodbeverages'"""
+    return re.sub(r'\W', '', name).lower()
+
+
+# ==============================
+# Running statistics
+# ==============================
+class RunningStats:
+    """Pairwise running statistics of VARIABLES for every group of one dimension.
+
+    For each group and pair of variables (i, j), over the reviews where both are
+    present, it keeps the count n[i, j], the mean of i mean[i, j], the sum of squared
+    deviations of i m2[i, j] and the co-moment c[i, j]. Batches are merged with Chan's
+    parallel form of Welford's update, so no statistic is ever recomputed from rows.
+    """
+
+    FIELDS = ('n', 'mean', 'm2', 'c')
+
+    def __init__(self, size=len(VARIABLES)):
+        self.size = size
+        self.keys = {}  # group key -> row in the arrays
+        for field in self.FIELDS:
+            setattr(self, field, np.zeros((0, size, size)))
+
+    def group_index(self, keys):
+        new = [key for key in dict.fromkeys(keys) if key not in self.keys]
+        if new:
+            for key in new:
+                self.keys[key] = len(self.keys)
+            for field in self.FIELDS:
+                grown = np.zeros((len(new), self.size, self.size))
+                setattr(self, field, np.concatenate([getattr(self, field), grown]))
+        return np.array([self.keys[key] for key in keys], dtype=np.int64)
+
+    @staticmethod
+    def moments(values, pairs):
+        """Per-row (count, x, x², x·y) of every pair: values is rows x variables (NaN when missing),
+        pairs is rows x variables x variables with 1 where the pair is a new observation"""
+        values = np.nan_to_num(values)
+        x = values[:, :, None] * pairs
+        return np.stack([pairs, x, x * values[:, :, None], x * values[:, None, :]], axis=1)
+
+    def update(self, keys, moments):
+        """Merge the rows' moments into their groups; negated moments take the rows back out"""
+        if not len(keys):
+            return
+        groups = self.group_index(keys)
+        order = np.argsort(groups, kind='stable')
+        groups = groups[order]
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        target = groups[starts]
+
+        # Batch statistics per group from the sums over its rows
+        count, sum_x, sum_xx, sum_xy = np.add.reduceat(moments[order], starts).transpose(1, 0, 2, 3)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count != 0, sum_x / count, 0.0)
+        m2 = sum_xx - sum_x * mean
+        c = sum_xy - sum_x * mean.swapaxes(1, 2)
+
+        # Merge with what each group has seen so far
+        seen = self.n[target]
+        total = seen + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(total != 0, count / total, 0.0)
+            weight = np.where(total != 0, seen * count / total, 0.0)
+        delta = mean - self.mean[target]
+        self.mean[target] += delta * share
+        self.m2[target] += m2 + delta ** 2 * weight
+        self.c[target] += c + delta * delta.swapaxes(1, 2) * weight
+        self.n[target] = total
+        # A pair whose last observation was removed starts again from nothing
+        empty = total == 0
+        for field in ('mean', 'm2', 'c'):
+            getattr(self, field)[target] = np.where(empty, 0.0, getattr(self, field)[target])
+
+    def spread(self, index=slice(None)):
+        """m2 with NaN where a variable does not vary: removing observations leaves rounding residue,
+        so sums of squares this close to zero are treated as zero rather than divided by"""
+        m2, mean = self.m2[index], self.mean[index]
+        flat = m2 <= 1e-9 * self.n[index] * np.maximum(1.0, mean ** 2)
+        return np.where(flat, np.nan, m2)
+
+    def correlation(self, index=slice(None)):
+        """Pearson correlation of every pair of variables"""
+        m2 = self.spread(index)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = np.clip(self.c[index] / np.sqrt(m2 * m2.swapaxes(-1, -2)), -1.0, 1.0)
+        return np.where(self.n[index] >= 2, corr, np.nan)
+
+    def slope(self, index=slice(None)):
+        """slope[i, j]: change in variable i per one-point change in variable j (least squares)"""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            slope = self.c[index] / self.spread(index).swapaxes(-1, -2)
+        return np.where(self.n[index] >= 2, slope, np.nan)
+
+    def arrays(self, prefix):
+        return {f'{prefix}_{field}': getattr(self, field) for field in self.FIELDS}
+
+    def load(self, keys, arrays, prefix):
+        self.keys = {key: i for i, key in enumerate(keys)}
+        for field in self.FIELDS:
+            setattr(self, field, arrays[f'{prefix}_{field}'])
+
+
+# ==============================
+# State tables
+# ==============================
+def create_rating_driver_tables(engine=None):
+    """Create the one-row rating_driver_state (statistics, high-water id, version) and rating_driver_sentiment,
+    the Sentiment each counted review was counted with. Both live beside the reviews and are dropped with them."""
+    engine = engine or get_engine()
+    blob_type = 'BLOB' if is_sqlite(engine) else 'BYTEA'
+    key_type = 'INTEGER' if is_sqlite(engine) else 'BIGINT'
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS rating_driver_state (
+                version BIGINT NOT NULL,
+                high_water_id BIGINT NOT NULL,
+                group_keys TEXT NOT NULL,
+                stats {blob_type} NOT NULL
+            )
+        """))
+        if not conn.execute(text("SELECT COUNT(*) FROM rating_driver_state")).scalar():
+            conn.execute(text("INSERT INTO rating_driver_state (version, high_water_id, group_keys, stats) "
+                              "VALUES (0, -1, '{}', :stats)"), {'stats': b''})
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS rating_driver_sentiment (
+                review_id {key_type} PRIMARY KEY,
+                sentiment TEXT
+            )
+        """))
+
+
+# ==============================
+# Rating drivers
+# ==============================
+class RatingDrivers:
+    """Running sub-score statistics of ryanair_reviews per country, aircraft, route and month.
+
+    refresh() folds in reviews above the high-water id. A review whose sentiment was
+    written or replaced after it was counted is taken back out with the Sentiment it was
+    counted with and added again with the current one. The statistics are stored in the
+    database next to the reviews, so a restart resumes where it left off and reloading
+    the reviews starts them over. Reports read only the per-group matrices: their cost
+    does not grow with the reviews.
+    """
+
+    def __init__(self, chunk_size=20000, refresh_interval=60):
+        self.chunk_size = chunk_size
+        self.refresh_interval = refresh_interval
+        self.last_refresh = 0.0
+        self.engine = get_engine()
+        self.lock = threading.Lock()
+        add_date_columns(self.engine)  # the month dimension
+        self.load()
+
+    # ------------------------------
+    # State
+    # ------------------------------
+    def load(self):
+        """Read the saved statistics (empty when the tables were just created, e.g. after a reload)"""
+        create_rating_driver_tables(self.engine)
+        self.stats = {dimension: RunningStats() for dimension in DIMENSIONS}
+        with self.engine.connect() as conn:
+            self.version, self.high_water_id, keys, blob = conn.execute(text(
+                "SELECT version, high_water_id, group_keys, stats FROM rating_driver_state")).first()
+        if self.high_water_id < 0:
+            return
+        keys = json.loads(keys)
+        with np.load(io.BytesIO(bytes(blob))) as arrays:
+            for dimension, stats in self.stats.items():
+                stats.load(keys[dimension], arrays, dimension)
+
+    def sync(self):
+        """Reload if another process saved newer statistics or the reviews were reloaded"""
+        if not inspect(self.engine).has_table('rating_driver_state'):
+            self.load()
+            return
+        with self.engine.connect() as conn:
+            version = conn.execute(text("SELECT version FROM rating_driver_state")).scalar()
+        if version != self.version:
+            self.load()
+
+    def save(self, counted, recounted):
+        """Store the statistics with the Sentiment of the reviews counted and recounted in this refresh.
+        Returns False, keeping nothing, if another process saved first."""
+        arrays = {}
+        for dimension, stats in self.stats.items():
+            arrays.update(stats.arrays(dimension))
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        keys = json.dumps({dimension: list(stats.keys) for dimension, stats in self.stats.items()})
+        with self.engine.begin() as conn:
+            updated = conn.execute(text("""
+                UPDATE rating_driver_state
+                SET version = version + 1, high_water_id = :high_water_id, group_keys = :keys, stats = :stats
+                WHERE version = :version
+            """), {'high_water_id': self.high_water_id, 'keys': keys, 'stats': buffer.getvalue(),
+                   'version': self.version}).rowcount
+            if not updated:
+                return False
+            if counted:
+                conn.execute(text("INSERT INTO rating_driver_sentiment (review_id, sentiment) "
+                                  "VALUES (:review_id, :sentiment)"), counted)
+            if recounted:
+                conn.execute(text("UPDATE rating_driver_sentiment SET sentiment = :sentiment "
+                                  "WHERE review_id = :review_id"), recounted)
+        self.version += 1
+        return True
+
+    def reset(self):
+        """Forget all statistics; the next refresh rebuilds them from every review"""
+        with self.lock:
+            create_rating_driver_tables(self.engine)
+            with self.engine.begin() as conn:
+                conn.execute(text("DELETE FROM rating_driver_sentiment"))
+                conn.execute(text("UPDATE rating_driver_state SET version = version + 1, high_water_id = -1"))
+            self.load()
+
+    # ------------------------------
+    # Ingestion
+    # ------------------------------
+    def select_list(self):
+        """SELECT list of id and SOURCE_COLUMNS, NULL for columns this database does not have yet"""
+        actual = {column_key(c['name']): c['name'] for c in inspect(self.engine).get_columns('ryanair_reviews')}
+        names = [actual.get(column_key(name)) for name in SOURCE_COLUMNS]
+        return 'id, ' + ', '.join(f'"{name}"' if name else 'NULL' for name in names), 'sentiment' in actual
+
+    @staticmethod
+    def values(df):
+        """rows x VARIABLES matrix with NaN for missing values and Sentiment scored -1..1"""
+        values = np.empty((len(df), len(VARIABLES)))
+        for i, name in enumerate(VARIABLES):
+            if name == 'Sentiment':
+                values[:, i] = df[name].astype(str).str.strip().str.lower().map(SENTIMENT_SCORES).to_numpy(float)
+            else:
+                values[:, i] = pd.to_numeric(df[name], errors='coerce').to_numpy(float)
+        return values
+
+    @staticmethod
+    def counted_sentiment(df):
+        """rating_driver_sentiment rows: the Sentiment each review is counted with, None if it has none"""
+        return [{'review_id': int(review_id), 'sentiment': value if isinstance(value, str) and value else None}
+                for review_id, value in zip(df['id'], df['Sentiment'])]
+
+    @staticmethod
+    def dimension_keys(df, dimension):
+        """Group key per row for a dimension, None where the row has no value for it"""
+        columns = DIMENSIONS[dimension]
+        if not columns:
+            return pd.Series(ALL_KEY, index=df.index)
+        present = df[columns].notna().all(axis=1) & (df[columns].astype(str) != '').all(axis=1)
+        keys = df[columns[0]].astype(str)
+        for column in columns[1:]:
+            keys = keys + ' → ' + df[column].astype(str)
+        return keys.where(present, None)
+
+    def ingest(self, df, sign=1.0):
+        """Add the rows' observations to every dimension (sign -1 takes them back out)"""
+        values = self.values(df)
+        present = ~np.isnan(values)
+        moments = sign * RunningStats.moments(values, (present[:, :, None] & present[:, None, :]).astype(float))
+        for dimension, stats in self.stats.items():
+            keys = self.dimension_keys(df, dimension)
+            rows = keys.notna().to_numpy()
+            stats.update(keys[rows].tolist(), moments[rows])
+
+    def read(self, sql, params):
+        chunks = pd.read_sql(text(sql), self.engine, params=params, chunksize=self.chunk_size)
+        for chunk in chunks:
+            if chunk.empty:
+                continue
+            chunk.columns = ['id'] + SOURCE_COLUMNS
+            yield chunk
+
+    def changed_sentiment(self):
+        """{review_id: Sentiment it was counted with} for the reviews whose sentiment has since changed.
+        Both tables are narrow and keyed by review id, so this never reads the review rows."""
+        with self.engine.connect() as conn:
+            return dict(conn.execute(text("""
+                SELECT c.review_id, c.sentiment
+                FROM rating_driver_sentiment c LEFT JOIN review_sentiment s ON s.review_id = c.review_id
+                WHERE COALESCE(s.Sentiment, '') != COALESCE(c.sentiment, '')
+            """)).fetchall())
+
+    def refresh(self):
+        """Fold new reviews and new or changed sentiment into the statistics; returns (new, updated)"""
+        with self.lock:
+            self.sync()
+            select_list, has_sentiment = self.select_list()
+            counted, recounted = [], []
+
+            for chunk in self.read(f"SELECT {select_list} FROM ryanair_reviews WHERE id > :high_water_id ORDER BY id",
+                                   {'high_water_id': self.high_water_id}):
+                self.ingest(chunk)
+                counted += self.counted_sentiment(chunk)
+                self.high_water_id = int(chunk['id'].max())
+
+            # Sentiment written or replaced since a review was counted: swap the counted row for the current one
+            changed = self.changed_sentiment() if has_sentiment else {}
+            ids = sorted(changed)
+            for start in range(0, len(ids), 500):
+                params = {f'id{i}': v for i, v in enumerate(ids[start:start + 500])}
+                placeholders = ', '.join(':' + name for name in params)
+                sql = f"SELECT {select_list} FROM ryanair_reviews WHERE id IN ({placeholders})"
+                for chunk in self.read(sql, params):
+                    self.ingest(chunk.assign(Sentiment=chunk['id'].map(changed)), sign=-1.0)
+                    self.ingest(chunk)
+                    recounted += self.counted_sentiment(chunk)
+
+            if (counted or recounted) and not self.save(counted, recounted):
+                # Another process refreshed first: take its statistics, the next refresh adds what is left
+                self.load()
+                counted, recounted = [], []
+            self.last_refresh = time.time()
+        if counted or recounted:
+            print(f"Rating drivers refreshed: {len(counted)} new reviews, {len(recounted)} sentiment updates")
+        return len(counted), len(recounted)
+
+    def maybe_refresh(self):
+        """Refresh if the statistics are older than refresh_interval seconds"""
+        if time.time() - self.last_refresh >= self.refresh_interval:
+            self.refresh()
+
+    # ------------------------------
+    # Reports
+    # ------------------------------
+    def groups(self, dimension, min_reviews=20):
+        """Group keys of a dimension with at least min_reviews rated reviews, largest first"""
+        stats = self.stats[dimension]
+        counts = stats.n[:, 0, 0]
+        keys = np.array(list(stats.keys), dtype=object)
+        order = np.argsort(-counts, kind='stable')
+        return [keys[i] for i in order if counts[i] >= min_reviews]
+
+    def drivers(self, dimension='all', key=ALL_KEY):
+        """How each sub-score relates to OverallRating and Sentiment within one group"""
+        stats = self.stats[dimension]
+        if key not in stats.keys:
+            return pd.DataFrame()
+        g = stats.keys[key]
+        corr, slope = stats.correlation(g), stats.slope(g)
+        subs = slice(len(TARGETS), None)
+        return pd.DataFrame({
+            'SubScore': SUB_SCORES,
+            'Reviews': stats.n[g, 0, subs].astype(int),
+            'MeanScore': stats.mean[g, subs, 0],
+            'CorrRating': corr[0, subs],
+            'CorrSentiment': corr[1, subs],
+            'RatingPerPoint': slope[0, subs],
+        }).sort_values('CorrRating', ascending=False, na_position='last').reset_index(drop=True)
+
+    def compare(self, dimension, score, target='OverallRating', min_reviews=20):
+        """One sub-score's relation to the target across every group of a dimension"""
+        stats = self.stats[dimension]
+        i, j = VARIABLES.index(target), VARIABLES.index(score)
+        corr, slope = stats.correlation()[:, i, j], stats.slope()[:, i, j]
+        df = pd.DataFrame({
+            dimension.capitalize(): list(stats.keys),
+            'Reviews': stats.n[:, i, j].astype(int),
+            'MeanScore': stats.mean[:, j, i],
+            'MeanTarget': stats.mean[:, i, j],
+            'Corr': corr,
+            'TargetPerPoint': slope,
+        })
+        df = df[df['Reviews'] >= min_reviews]
+        return df.sort_values('Corr', ascending=False, na_position='last').reset_index(drop=True)
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Which sub-scores drive the overall rating and sentiment")
+    parser.add_argument("--dimension", choices=list(DIMENSIONS), default='all')
+    parser.add_argument("--key", help="Group to report (default: the largest of the dimension)")
+    parser.add_argument("--score", choices=SUB_SCORES, help="Compare one sub-score across the dimension's groups")
+    parser.add_argument("--min-reviews", type=int, default=20)
+    parser.add_argument("--rebuild", action="store_true", help="Forget the saved statistics and start over")
+    args = parser.parse_args()
+
+    drivers = RatingDrivers()
+    if args.rebuild:
+        drivers.reset()
+    start = time.time()
+    drivers.refresh()
+    print(f"Statistics up to date in {time.time() - start:.2f}s")
+
+    start = time.perf_counter()
+    if args.score:
+        report = drivers.compare(args.dimension, args.score, min_reviews=args.min_reviews)
+    else:
+        groups = drivers.groups(args.dimension, args.min_reviews)
+        key = args.key or (groups[0] if groups else ALL_KEY)
+        print(f"{args.dimension}: {key}")
+        report = drivers.drivers(args.dimension, key)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    print(report.to_string(index=False, float_format=lambda v: f"{v:.2f}"))
+    print(f"Report computed in {elapsed_ms:.2f} ms")
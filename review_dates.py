@@ -0,0 +1,107 @@
+from datetime import date, datetime
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from sqlite_config import REVIEWS_TABLE, create_reviews_view, get_engine, prepare_review_tables
+
+# Sortable columns derived from the free-form DatePublished / DateFlown text:
+#   DatePublishedISO   'YYYY-MM-DD'
+#   DatePublishedMonth 'YYYY-MM'
+#   DateFlownMonth     'YYYY-MM'
+DATE_COLUMNS = ['DatePublishedISO', 'DatePublishedMonth', 'DateFlownMonth']
+DATE_INDEXES = {
+    'idx_reviews_date_published_iso': 'DatePublishedISO',
+    'idx_reviews_date_published_month': 'DatePublishedMonth',
+    'idx_reviews_date_flown_month': 'DateFlownMonth',
+}
+PUBLISHED_FORMATS = ['%m/%d/%Y', '%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y']
+# DateFlown is a month: '24-Jan' (year first), 'Oct-23', 'October 2023' or already '2023-10'
+FLOWN_FORMATS = ['%y-%b', '%b-%y', '%B %Y', '%b %Y', '%Y-%m']
+
+
+def parse_date(value, formats):
+    if isinstance(value, (datetime, date)):
+        return value
+    if not isinstance(value, str) or not value.strip():
+        return None
+    for fmt in formats:
+        try:
+            return datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_date_published(value):
+    """'2/3/2024' -> '2024-02-03'; None when the value cannot be parsed"""
+    parsed = parse_date(value, PUBLISHED_FORMATS)
+    return parsed.strftime('%Y-%m-%d') if parsed else None
+
+
+def normalize_date_flown(value):
+    """'24-Jan' / 'Jan-24' -> '2024-01'; None when the value cannot be parsed"""
+    parsed = parse_date(value, FLOWN_FORMATS)
+    return parsed.strftime('%Y-%m') if parsed else None
+
+
+def date_columns(date_published=None, date_flown=None):
+    """Values of the derived date columns for one review, ready to bind into an INSERT"""
+    published = normalize_date_published(date_published)
+    return {
+        'DatePublishedISO': published,
+        'DatePublishedMonth': published[:7] if published else None,
+        'DateFlownMonth': normalize_date_flown(date_flown),
+    }
+
+
+def add_date_columns(engine=None, batch_size=5000):
+    """Add, backfill and index the derived date columns; cheap to re-run.
+
+    Only rows whose derived columns are still empty are read, so after the first
+    run this touches just the reviews inserted without them.
+    """
+    try:
+        engine = engine or get_engine()
+        prepare_review_tables(engine)  # the backfill updates rows by id
+        existing = {c['name'].lower() for c in inspect(engine).get_columns(REVIEWS_TABLE)}
+        with engine.begin() as conn:
+            missing = [column for column in DATE_COLUMNS if column.lower() not in existing]
+            for column in missing:
+                conn.execute(text(f"ALTER TABLE {REVIEWS_TABLE} ADD COLUMN {column} TEXT"))
+            if missing:
+                create_reviews_view(conn)
+            # Built first so finding rows that still need normalizing is an index lookup
+            for name, column in DATE_INDEXES.items():
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {REVIEWS_TABLE} ({column})"))
+
+        pending = pd.read_sql(text(f"""
+            SELECT id, DatePublished, DateFlown FROM {REVIEWS_TABLE}
+            WHERE (DatePublishedISO IS NULL AND DatePublished IS NOT NULL)
+               OR (DateFlownMonth IS NULL AND DateFlown IS NOT NULL)
+        """), engine)
+        pending.columns = ['id', 'DatePublished', 'DateFlown']
+        updates = [
+            {'id': int(row.id), **date_columns(row.DatePublished, row.DateFlown)}
+            for row in pending.itertuples(index=False)
+        ]
+        updates = [u for u in updates if u['DatePublishedISO'] or u['DateFlownMonth']]
+        for start in range(0, len(updates), batch_size):
+            with engine.begin() as conn:
+                conn.execute(text(f"""
+                    UPDATE {REVIEWS_TABLE}
+                    SET DatePublishedISO = :DatePublishedISO,
+                        DatePublishedMonth = :DatePublishedMonth,
+                        DateFlownMonth = :DateFlownMonth
+                    WHERE id = :id
+                """), updates[start:start + batch_size])
+        if updates:
+            print(f"Normalized dates for {len(updates)} reviews")
+        return len(updates)
+    except Exception as e:
+        print(f"Error normalizing review dates: {e}")
+        return 0
+
+
+if __name__ == "__main__":
+    add_date_columns()
@@ -0,0 +1,293 @@
+import argparse
+import math
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from analytics_engine import AGGREGATE_PATTERN, WRITE_PATTERN
+from conversation import restrict_reviews
+from sqlite_config import REVIEWS_TABLE, get_engine, prepare_review_tables
+
+# A uniform sample of SAMPLE_SIZE reviews, kept as a reservoir: every review gets a uniform random key
+# when it is first seen and the sample is the SAMPLE_SIZE smallest keys so far. Each sampled review also
+# falls in one of REPLICATES random buckets; the spread of an estimate across buckets gives its error bound.
+SAMPLE_SIZE = 10000
+REPLICATES = 10
+MIN_ROWS = 100000  # below this many reviews the exact query is quick enough on its own
+# Two-sided 95% Student t quantiles by degrees of freedom (replicates - 1)
+T_95 = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262}
+
+EXTENSIVE_PATTERN = re.compile(r"\b(COUNT|SUM|TOTAL)\s*\(", re.IGNORECASE)
+FUNCTION_PATTERN = re.compile(r"\b(COUNT|SUM|TOTAL|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+# Aggregates a sample cannot estimate by scaling or averaging
+UNSUPPORTED_PATTERN = re.compile(
+    r"\bCOUNT\s*\(\s*DISTINCT\b|\bOVER\s*\(|\b(UNION|INTERSECT|EXCEPT)\b|"
+    r"\b(GROUP_CONCAT|STRING_AGG|ARRAY_AGG|MEDIAN|PERCENTILE\w*)\s*\(", re.IGNORECASE
+)
+
+_rng = np.random.default_rng()
+
+
+# ==============================
+# Reservoir
+# ==============================
+def create_review_sample_tables(engine=None):
+    """Create review_sample and the one-row review_sample_state (high-water id, reviews seen)"""
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        # In SQLite an INTEGER PRIMARY KEY is the rowid: the sample is stored, and read, in review id order
+        key_type = 'INTEGER' if conn.dialect.name == 'sqlite' else 'BIGINT'
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS review_sample (
+                review_id {key_type} PRIMARY KEY,
+                sample_key DOUBLE PRECISION NOT NULL,
+                bucket INTEGER NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_review_sample_key ON review_sample (sample_key)"))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS review_sample_state (
+                high_water_id BIGINT NOT NULL,
+                seen BIGINT NOT NULL
+            )
+        """))
+        if not conn.execute(text("SELECT COUNT(*) FROM review_sample_state")).scalar():
+            conn.execute(text("INSERT INTO review_sample_state (high_water_id, seen) VALUES (-1, 0)"))
+
+
+def sample_new_reviews(engine=None, sample_size=SAMPLE_SIZE, chunk_size=100000):
+    """Reservoir step for the reviews above the high-water id; called right after reviews are written.
+    Returns the number of reviews that entered the sample."""
+    engine = engine or get_engine()
+    added = 0
+    while True:
+        with engine.begin() as conn:
+            high_water, seen = conn.execute(text("SELECT high_water_id, seen FROM review_sample_state")).first()
+            ids = np.array([row[0] for row in conn.execute(text(
+                f"SELECT id FROM {REVIEWS_TABLE} WHERE id > :high_water ORDER BY id LIMIT :limit"
+            ), {'high_water': int(high_water), 'limit': chunk_size})], dtype=np.int64)
+            if not len(ids):
+                return added
+
+            keys = _rng.random(len(ids))
+            buckets = _rng.integers(REPLICATES, size=len(ids))
+            size, largest = conn.execute(text("SELECT COUNT(*), MAX(sample_key) FROM review_sample")).first()
+            entering = np.argsort(keys)[:sample_size]
+            if size >= sample_size:
+                # A full reservoir only takes keys below its current largest one
+                entering = entering[keys[entering] < largest]
+            if len(entering):
+                conn.execute(text(
+                    "INSERT INTO review_sample (review_id, sample_key, bucket) VALUES (:review_id, :sample_key, :bucket)"
+                ), [{'review_id': int(ids[i]), 'sample_key': float(keys[i]), 'bucket': int(buckets[i])}
+                    for i in entering])
+                excess = size + len(entering) - sample_size
+                if excess > 0:
+                    conn.execute(text("""
+                        DELETE FROM review_sample WHERE review_id IN (
+                            SELECT review_id FROM review_sample ORDER BY sample_key DESC LIMIT :excess
+                        )
+                    """), {'excess': excess})
+            # Conditional on the old high-water id: a concurrent refresh makes this one roll back
+            updated = conn.execute(text(
+                "UPDATE review_sample_state SET high_water_id = :new, seen = :seen WHERE high_water_id = :old"
+            ), {'new': int(ids[-1]), 'seen': int(seen) + len(ids), 'old': int(high_water)}).rowcount
+            if updated != 1:
+                raise RuntimeError("review_sample was refreshed concurrently")
+            added += len(entering)
+
+
+def add_review_sample(engine=None):
+    """Create the review sample and bring it up to date with every review; cheap to re-run"""
+    try:
+        engine = engine or get_engine()
+        prepare_review_tables(engine)
+        create_review_sample_tables(engine)
+        added = sample_new_reviews(engine)
+        if added:
+            print(f"Review sample: {added} reviews entered the reservoir")
+        return added
+    except Exception as e:
+        print(f"Error maintaining review sample: {e}")
+        return 0
+
+
+# ==============================
+# Approximate Answers
+# ==============================
+def select_items(statement):
+    """Top-level expressions of the outer SELECT list, or None when the statement has none"""
+    match = re.match(r"\s*SELECT\s+(?:DISTINCT\s+)?", statement, re.IGNORECASE)
+    if not match:
+        return None
+    items, start, depth, quoted = [], match.end(), 0, False
+    for position in range(match.end(), len(statement)):
+        char = statement[position]
+        if char == "'":
+            quoted = not quoted
+        if quoted:
+            continue
+        depth += (char == '(') - (char == ')')
+        if depth:
+            continue
+        if char == ',':
+            items.append(statement[start:position].strip())
+            start = position + 1
+        elif re.match(r"FROM\b", statement[position:], re.IGNORECASE) and not re.match(r"\w", statement[position - 1]):
+            items.append(statement[start:position].strip())
+            return items
+    return None
+
+
+def measure_kind(expression):
+    """'key' (no aggregate), 'extensive' (COUNT/SUM: scaled to the whole table), 'extreme' (MIN/MAX only:
+    the sample's value, no bound) or 'intensive' (AVG, ratios and shares: estimated as is)"""
+    functions = {f.upper() for f in FUNCTION_PATTERN.findall(expression)}
+    if not functions:
+        return 'key'
+    if functions <= {'MIN', 'MAX'}:
+        return 'extreme'
+    if EXTENSIVE_PATTERN.search(expression) and '/' not in expression:
+        return 'extensive'
+    return 'intensive'
+
+
+def row_keys(df, keys):
+    """Hashable group key of each row (its position when there are no key columns); any missing value is None"""
+    if not keys:
+        return [(i,) for i in range(len(df))]
+    return [tuple(None if pd.isna(v) else v for v in row) for row in df[keys].itertuples(index=False, name=None)]
+
+
+def approximable(statement):
+    """Select list of a single read-only aggregate over ryanair_reviews that a sample can estimate, else None"""
+    if ';' in statement or not AGGREGATE_PATTERN.search(statement) or WRITE_PATTERN.search(statement):
+        return None
+    if UNSUPPORTED_PATTERN.search(statement) or restrict_reviews(statement, 'TRUE') is None:
+        return None
+    having = re.search(r"\bHAVING\b(.+?)(?=\bORDER\b|\bLIMIT\b|$)", statement, re.IGNORECASE | re.DOTALL)
+    if having and EXTENSIVE_PATTERN.search(having.group(1)):
+        return None  # a threshold on sample counts would drop the wrong groups
+    items = select_items(statement)
+    if not items or any(item == '*' or item.endswith('.*') for item in items):
+        return None
+    return items
+
+
+def approximate_answer(sql, engine=None, min_rows=MIN_ROWS):
+    """Estimate of an aggregate query's result from review_sample, with a "<column> ±" 95% bound after each
+    estimated column, or None when the query is not a supported aggregate or there are fewer than min_rows
+    reviews. COUNT/SUM columns are scaled up to the whole table; groups absent from the sample are missing."""
+    statement = sql.strip().rstrip(';')
+    items = approximable(statement)
+    if items is None:
+        return None
+    engine = engine or get_engine()
+    start = time.perf_counter()
+    # Read-only: the insert paths keep the reservoir current, so asking never waits on a write transaction
+    with engine.connect() as conn:
+        seen = conn.execute(text("SELECT seen FROM review_sample_state")).scalar()
+        if not seen or seen < min_rows:
+            return None
+        # The sampled rows are read once, only the columns the query names, in review id order (CROSS JOIN
+        # keeps SQLite from scanning the reviews instead); the query and its per-bucket replicates run on this copy
+        columns = [c['name'] for c in inspect(conn).get_columns('ryanair_reviews')
+                   if re.search(rf'(?<![\w&]){re.escape(c["name"])}(?![\w&])', statement, re.IGNORECASE)]
+        conn.execute(text("DROP TABLE IF EXISTS sampled_reviews"))
+        conn.execute(text(f"""
+            CREATE TEMP TABLE sampled_reviews AS
+            SELECT {''.join(f'r."{c}", ' for c in columns)}s.bucket AS sample_bucket
+            FROM review_sample s CROSS JOIN ryanair_reviews r WHERE r.id = s.review_id
+        """))
+        sizes = dict(conn.execute(text(
+            "SELECT sample_bucket, COUNT(*) FROM sampled_reviews GROUP BY sample_bucket"
+        )).fetchall())
+        df = pd.read_sql(restrict_reviews(statement, 'TRUE', 'sampled_reviews'), conn)
+        replicates = [
+            pd.read_sql(restrict_reviews(statement, f"sample_bucket = {b}", 'sampled_reviews'), conn)
+            for b in range(REPLICATES)
+        ]
+        conn.execute(text("DROP TABLE sampled_reviews"))
+    if len(df.columns) != len(items) or df.empty:
+        return None
+
+    kinds = dict(zip(df.columns, (measure_kind(item) for item in items)))
+    keys = [column for column, kind in kinds.items() if kind == 'key']
+    sampled = sum(sizes.values())
+    finite_population = math.sqrt(max(0.0, 1 - sampled / seen))
+    result = df[keys].copy() if keys else pd.DataFrame(index=df.index)
+    # Row of each bucket's result that holds each row of the sample result, -1 when the group is absent
+    # from the bucket: a zero count or sum there, and no average
+    base_keys = row_keys(df, keys)
+    positions = []
+    for replicate in replicates:
+        lookup = {key: i for i, key in enumerate(row_keys(replicate, keys))}
+        positions.append(np.array([lookup.get(key, -1) for key in base_keys], dtype=np.int64))
+    for column in df.columns:
+        kind = kinds[column]
+        if kind == 'key':
+            continue
+        values = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=float)
+        if kind == 'extreme':
+            result[column] = df[column]
+            continue
+
+        estimates = np.full((len(df), REPLICATES), np.nan)
+        for bucket, (replicate, position) in enumerate(zip(replicates, positions)):
+            bucket_values = pd.to_numeric(replicate[column], errors='coerce').to_numpy(dtype=float)
+            bucket_values = np.append(bucket_values, np.nan)[position]  # -1 picks the appended NaN
+            if kind == 'extensive':
+                bucket_values = np.nan_to_num(bucket_values) * seen / max(sizes.get(bucket, 0), 1)
+            estimates[:, bucket] = bucket_values
+
+        counts = np.isfinite(estimates).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.nansum(estimates, axis=1) / counts
+            variance = np.nansum((estimates - mean[:, None]) ** 2, axis=1) / (counts - 1)
+            t = np.array([T_95.get(c - 1, np.nan) for c in counts])
+            bound = t * np.sqrt(variance / counts) * finite_population
+        estimate = values * seen / sampled if kind == 'extensive' else values
+        if kind == 'extensive':
+            result[column] = pd.Series(np.round(estimate), index=df.index).astype('Int64')
+            result[f"{column} ±"] = pd.Series(np.round(bound), index=df.index).astype('Int64')
+        else:
+            result[column] = estimate
+            result[f"{column} ±"] = np.round(bound, 3)
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    result.attrs['caption'] = (
+        f"≈ Estimated from a uniform sample of {sampled:,} of {seen:,} reviews in {elapsed_ms:.0f} ms "
+        f"(± is a 95% bound); the exact result replaces it when the full query finishes"
+    )
+    return result
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Uniform review sample for approximate aggregate answers")
+    parser.add_argument("sql", nargs="?", help="Aggregate query to estimate and then run exactly")
+    parser.add_argument("--rebuild", action="store_true", help="Draw a new sample over every review")
+    args = parser.parse_args()
+    engine = get_engine()
+    if args.rebuild:
+        create_review_sample_tables(engine)
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM review_sample"))
+            conn.execute(text("UPDATE review_sample_state SET high_water_id = -1, seen = 0"))
+    add_review_sample(engine)
+    if args.sql:
+        approximate = approximate_answer(args.sql, engine, min_rows=0)
+        if approximate is None:
+            print("Not an aggregate query the sample can estimate")
+        else:
+            print(approximate.attrs['caption'])
+            print(approximate.to_string(index=False))
+        start = time.perf_counter()
+        exact = pd.read_sql(args.sql, engine)
+        print(f"Exact result in {(time.perf_counter() - start) * 1000:.0f} ms")
+        print(exact.to_string(index=False))
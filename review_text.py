@@ -0,0 +1,199 @@
+import argparse
+import os
+import time
+
+from sqlalchemy import inspect, text
+
+from sqlite_config import (REVIEWS_TABLE, TEXT_COLUMNS, create_reviews_view, get_engine, is_sqlite,
+                           prepare_review_tables)
+
+try:
+    import zstandard
+except ImportError:  # optional dependency: pip install zstandard
+    zstandard = None
+
+DICTIONARY_SIZE = 112640  # zstd's default dictionary size (110 KB)
+TRAINING_SAMPLES = 20000
+# With the dictionary, level 9 compresses within 10% of level 19 at about 8x its speed; decompression is
+# equally fast at every level
+COMPRESSION_LEVEL = 9
+# Only rows whose text has not been moved yet: near-empty once the archive is compressed
+PLAIN_TEXT_FILTER = ' OR '.join(f'"{name}" IS NOT NULL' for name in TEXT_COLUMNS)
+
+
+# ==============================
+# Storage
+# ==============================
+def is_compressed(engine):
+    """True when review text is kept in the review_text blob table"""
+    return inspect(engine).has_table('review_text')
+
+
+def text_columns(engine):
+    """Those of TEXT_COLUMNS that reviews_base actually has"""
+    existing = {c['name'].lower() for c in inspect(engine).get_columns(REVIEWS_TABLE)}
+    return [name for name in TEXT_COLUMNS if name.lower() in existing]
+
+
+def create_review_text_tables(conn):
+    """review_text: one row of zstd frames per review; review_text_dictionary: the trained dictionaries"""
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS review_text (
+            review_id INTEGER PRIMARY KEY,
+            {', '.join(f'"{name}" BLOB' for name in TEXT_COLUMNS)}
+        )
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS review_text_dictionary (
+            dict_id INTEGER PRIMARY KEY,
+            dictionary BLOB NOT NULL,
+            trained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_reviews_plain_text ON {REVIEWS_TABLE} (id) "
+                      f"WHERE {PLAIN_TEXT_FILTER}"))
+
+
+def train_dictionary(engine, samples=TRAINING_SAMPLES, size=DICTIONARY_SIZE):
+    """Train a zstd dictionary on a random sample of review texts and store it; returns its id"""
+    columns = text_columns(engine)
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            f"SELECT {', '.join(columns)} FROM ryanair_reviews ORDER BY RANDOM() LIMIT :samples"
+        ), {'samples': samples}).fetchall()
+    texts = [str(value).encode() for row in rows for value in row if value]
+    # zstd wants roughly 100x the dictionary size in samples; small archives get a smaller dictionary
+    size = max(4096, min(size, sum(len(t) for t in texts) // 100))
+    dictionary = zstandard.train_dictionary(size, texts)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO review_text_dictionary (dict_id, dictionary) VALUES (:dict_id, :dictionary)"),
+                     {'dict_id': dictionary.dict_id(), 'dictionary': dictionary.as_bytes()})
+    print(f"Trained a {len(dictionary.as_bytes()) // 1024} KB dictionary on {len(texts)} review texts")
+    return dictionary.dict_id()
+
+
+def compressor(conn, level=COMPRESSION_LEVEL):
+    """Compressor with the most recently trained dictionary"""
+    data = conn.execute(text(
+        "SELECT dictionary FROM review_text_dictionary ORDER BY trained_at DESC, rowid DESC LIMIT 1"
+    )).scalar()
+    dictionary = zstandard.ZstdCompressionDict(data) if data else None
+    return zstandard.ZstdCompressor(level=level, dict_data=dictionary)
+
+
+def compress_new_reviews(engine=None, chunk_size=5000):
+    """Move the text of reviews written since the last run into review_text; called right after reviews
+    are written. Returns the number of reviews moved (0 when the compressed mode is off)."""
+    engine = engine or get_engine()
+    if not is_sqlite(engine) or not is_compressed(engine):
+        return 0
+    columns = text_columns(engine)
+    quoted = [f'"{name}"' for name in columns]
+    moved = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text(f"""
+                SELECT id, {', '.join(quoted)} FROM {REVIEWS_TABLE}
+                WHERE ({PLAIN_TEXT_FILTER}) AND id IS NOT NULL ORDER BY id LIMIT :limit
+            """), {'limit': chunk_size}).fetchall()
+            if not rows:
+                return moved
+            zstd = compressor(conn)
+            conn.execute(text(f"""
+                INSERT INTO review_text (review_id, {', '.join(quoted)})
+                VALUES (:review_id, {', '.join(f':v{i}' for i in range(len(columns)))})
+                ON CONFLICT (review_id) DO UPDATE SET {', '.join(f'{q} = excluded.{q}' for q in quoted)}
+            """), [
+                {'review_id': int(row[0]),
+                 **{f'v{i}': zstd.compress(str(value).encode()) if value is not None else None
+                    for i, value in enumerate(row[1:])}}
+                for row in rows
+            ])
+            conn.execute(text(f"UPDATE {REVIEWS_TABLE} SET {', '.join(f'{q} = NULL' for q in quoted)} WHERE id = :id"),
+                         [{'id': int(row[0])} for row in rows])
+            moved += len(rows)
+
+
+def compress_review_text(engine=None, retrain=False):
+    """Switch to compressed storage: Comment/CommentTitle move to review_text as zstd frames and the
+    ryanair_reviews view decompresses them when a query reads them. Cheap to re-run."""
+    engine = engine or get_engine()
+    if not is_sqlite(engine):
+        print("Compressed review text is SQLite-only; PostgreSQL already compresses long text out of line "
+              f"(TOAST), e.g. ALTER TABLE {REVIEWS_TABLE} ALTER COLUMN comment SET COMPRESSION lz4")
+        return 0
+    if zstandard is None:
+        print("Compressed review text needs zstandard: pip install zstandard")
+        return 0
+    prepare_review_tables(engine)
+    with engine.begin() as conn:
+        create_review_text_tables(conn)
+        create_reviews_view(conn)
+        trained = conn.execute(text("SELECT COUNT(*) FROM review_text_dictionary")).scalar()
+    if retrain or not trained:
+        train_dictionary(engine)
+    start = time.perf_counter()
+    moved = compress_new_reviews(engine)
+    if moved:
+        print(f"Compressed the text of {moved} reviews in {time.perf_counter() - start:.1f}s")
+    return moved
+
+
+def decompress_review_text(engine=None):
+    """Switch back to plain text in reviews_base and drop the blob tables"""
+    engine = engine or get_engine()
+    if not is_compressed(engine):
+        return 0
+    columns = text_columns(engine)
+    with engine.begin() as conn:
+        restored = conn.execute(text(f"""
+            UPDATE {REVIEWS_TABLE} SET {', '.join(
+                f'"{n}" = COALESCE("{n}", (SELECT review_text(t."{n}") FROM review_text t '
+                f'WHERE t.review_id = {REVIEWS_TABLE}.id))' for n in columns)}
+            WHERE id IN (SELECT review_id FROM review_text)
+        """)).rowcount
+        conn.execute(text("DROP INDEX IF EXISTS idx_reviews_plain_text"))
+        conn.execute(text("DROP TABLE review_text"))
+        conn.execute(text("DROP TABLE review_text_dictionary"))
+        create_reviews_view(conn)
+    print(f"Restored the plain text of {restored} reviews")
+    return restored
+
+
+def vacuum(engine):
+    """Rebuild the SQLite file so space freed by moving text is returned to the file system"""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+
+
+def storage_report(engine):
+    """{object name: bytes} of the review tables and their indexes, plus the whole file as 'file'"""
+    with engine.connect() as conn:
+        sizes = dict(conn.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).fetchall())
+        path = conn.execute(text("PRAGMA database_list")).fetchone()[2]
+    sizes['file'] = os.path.getsize(path)
+    return sizes
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Optional zstd-compressed storage of review text (SQLite)")
+    parser.add_argument("--compress", action="store_true", help="Move review text into the compressed blob table")
+    parser.add_argument("--decompress", action="store_true", help="Move review text back into reviews_base")
+    parser.add_argument("--retrain", action="store_true", help="Train a new dictionary for reviews compressed from now on")
+    args = parser.parse_args()
+    engine = get_engine()
+    if args.compress or args.decompress:
+        before = storage_report(engine)['file']
+        if args.compress:
+            compress_review_text(engine, args.retrain)
+        else:
+            decompress_review_text(engine)
+        vacuum(engine)
+        print(f"Database file: {before / 2**20:.1f} MB -> {storage_report(engine)['file'] / 2**20:.1f} MB")
+    sizes = storage_report(engine)
+    for name in (REVIEWS_TABLE, 'review_text', 'review_text_dictionary', 'file'):
+        if name in sizes:
+            print(f"  {name}: {sizes[name] / 2**20:.1f} MB")
@@ -0,0 +1,126 @@
+import re
+
+import pandas as pd
+from sqlalchemy import inspect, text
+
+from sqlite_config import get_engine, prepare_review_tables
+
+# Canonical topics and the tag wording that maps to them. A tag can name several
+# topics ("rude staff, long queue" -> staff, boarding); tags that match none are
+# kept as their own topic so they stay countable.
+CANONICAL_TOPICS = {
+    'delays': r'\bdelay|\blate\b|\bwait',
+    'punctuality': r'\bon time\b|\bpunctual|\bearly (arrival|departure)',
+    'fees': r'\bfees?\b|\bcharge|\bovercharg|\bpenalt|\bhidden cost|\boverpriced|\bexpensive|\brip off\b',
+    'value for money': r'\bvalue\b|\bcheap|\bprices?\b|\bpricing\b|\baffordable|\bcost\b',
+    'staff': r'\bstaff|\bcrew|\battendant|\bemployee|\bmanager|\bagents?\b',
+    'customer service': r'\bservice\b|\bcommunication|\bcomplaints? handling',
+    'check-in': r'\bcheck in\b|\bcheckin\b',
+    'boarding': r'\bboarding|\bqueue|\bgate\b',
+    'baggage': r'\bbag\b|\bbags\b|\bbaggage|\bluggage|\bbag drop\b',
+    'seats': r'\bseat|\blegroom\b|\bleg room\b',
+    'comfort': r'\bcomfort|\bcramped|\bspace\b|\buncomfortable',
+    'cleanliness': r'\bclean|\bdirty|\bfilthy',
+    'cancellation': r'\bcancel',
+    'refunds': r'\brefund|\bcompensation',
+    'food and drinks': r'\bfood\b|\bdrinks?\b|\bmeals?\b|\beating\b|\bbeverage',
+    'policies': r'\bpolic|\brules?\b',
+    'booking': r'\bbooking|\bwebsite\b|\bapp\b',
+}
+# Placeholder reasons written when the model reply could not be used
+IGNORED_TAGS = {'analysis failed', ''}
+MAX_TAG_LENGTH = 80
+
+
+def normalize_tag(tag):
+    """'  Rude-Staff. ' -> 'rude staff'"""
+    tag = re.sub(r'[-_/]+', ' ', tag.lower())
+    tag = re.sub(r"[^\w\s&']", ' ', tag)
+    tag = re.sub(r'^(and|but|also|some|very)\s+', '', ' '.join(tag.split()))
+    return tag[:MAX_TAG_LENGTH].strip()
+
+
+def split_reason(reason):
+    """Normalized, de-duplicated tags of a comma-separated SentimentReason"""
+    if not isinstance(reason, str):
+        return []
+    tags = []
+    for part in re.split(r'[,;]', reason):
+        tag = normalize_tag(part)
+        if tag not in IGNORED_TAGS and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def canonical_topics(tag):
+    """Canonical topics a normalized tag mentions, or the tag itself when it matches none"""
+    topics = [topic for topic, pattern in CANONICAL_TOPICS.items() if re.search(pattern, tag)]
+    return topics or [tag]
+
+
+def topic_rows(review_id, reason):
+    """(review_id, topic, tag) rows for one review, ready to bind into an INSERT"""
+    rows, seen = [], set()
+    for tag in split_reason(reason):
+        for topic in canonical_topics(tag):
+            if (topic, tag) not in seen:
+                seen.add((topic, tag))
+                rows.append({'review_id': int(review_id), 'topic': topic, 'tag': tag})
+    return rows
+
+
+def save_review_topics(conn, review_id, reason):
+    """Replace one review's topics; call inside the transaction that writes its SentimentReason"""
+    conn.execute(text("DELETE FROM review_topics WHERE review_id = :review_id"), {'review_id': int(review_id)})
+    rows = topic_rows(review_id, reason)
+    if rows:
+        conn.execute(text("INSERT INTO review_topics (review_id, topic, tag) VALUES (:review_id, :topic, :tag)"),
+                     rows)
+    return len(rows)
+
+
+def create_review_topics_table(engine=None):
+    """Create review_topics and its indexes: by topic for counts and joins, by review for rewrites"""
+    engine = engine or get_engine()
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS review_topics (
+                review_id BIGINT NOT NULL,
+                topic TEXT NOT NULL,
+                tag TEXT NOT NULL
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_review_topics_topic ON review_topics (topic, review_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_review_topics_review ON review_topics (review_id)"))
+
+
+def add_review_topics(engine=None, batch_size=5000):
+    """Create review_topics and backfill it for analyzed reviews that have no topics yet; cheap to re-run"""
+    try:
+        engine = engine or get_engine()
+        prepare_review_tables(engine)
+        create_review_topics_table(engine)
+        if not inspect(engine).has_table('review_sentiment'):
+            return 0  # no reviews loaded yet
+
+        pending = pd.read_sql(text("""
+            SELECT s.review_id, s.SentimentReason FROM review_sentiment s
+            WHERE s.SentimentReason IS NOT NULL AND s.SentimentReason != ''
+              AND NOT EXISTS (SELECT 1 FROM review_topics t WHERE t.review_id = s.review_id)
+        """), engine)
+        pending.columns = ['id', 'SentimentReason']
+        rows = [row for review in pending.itertuples(index=False) for row in topic_rows(review.id, review.SentimentReason)]
+        for start in range(0, len(rows), batch_size):
+            with engine.begin() as conn:
+                conn.execute(text("INSERT INTO review_topics (review_id, topic, tag) VALUES (:review_id, :topic, :tag)"),
+                             rows[start:start + batch_size])
+        if rows:
+            print(f"Tagged {len({row['review_id'] for row in rows})} reviews with {len(rows)} topics")
+        return len(rows)
+    except Exception as e:
+        print(f"Error backfilling review topics: {e}")
+        return 0
+
+
+if __name__ == "__main__":
+    add_review_topics()
@@ -1,100 +1,276 @@
 import requests
+import hashlib
 import json
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine, text
 import pandas as pd
 
 # Database configuration
-from sqlite_config import get_sqlite_engine
+from sqlite_config import REVIEWS_TABLE, get_engine, new_review_id, prepare_review_tables
+from ollama_pool import EndpointPool
+from review_dates import add_date_columns, date_columns
+from review_topics import add_review_topics, save_review_topics
+from near_duplicates import add_near_duplicate_index, cluster_reviews, representative_sentiment
+from review_sample import add_review_sample, sample_new_reviews
+from review_text import compress_new_reviews
+from datetime import date
+
+# Compact output contract: a short label code plus a short reason. The review
+# text is never echoed back, so output tokens no longer grow with comment length.
+SENTIMENT_LABELS = {"pos": "Positive", "neu": "Neutral", "neg": "Negative"}
+
+SENTIMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "label": {"type": "string", "enum": list(SENTIMENT_LABELS)},
+        "reason": {"type": "string", "maxLength": 80}
+    },
+    "required": ["label", "reason"],
+    "additionalProperties": False
+}
+
+def save_sentiments(conn, rows):
+    """Bulk UPSERT of results into review_sentiment; rows are dicts with review_id, sentiment,
+    reason, model and prompt_version. A re-analyzed review's previous result is replaced, and analyzed
+    reviews leave the review_pending queue."""
+    if rows:
+        conn.execute(text("""
+            INSERT INTO review_sentiment (review_id, Sentiment, SentimentReason, Model, PromptVersion, AnalyzedAt)
+            VALUES (:review_id, :sentiment, :reason, :model, :prompt_version, CURRENT_TIMESTAMP)
+            ON CONFLICT (review_id) DO UPDATE
+            SET Sentiment = excluded.Sentiment, SentimentReason = excluded.SentimentReason,
+                Model = excluded.Model, PromptVersion = excluded.PromptVersion, AnalyzedAt = excluded.AnalyzedAt
+        """), rows)
+        conn.execute(text("DELETE FROM review_pending WHERE review_id = :review_id"),
+                     [{'review_id': row['review_id']} for row in rows])
+    return len(rows)
+
+
+def queue_for_sentiment(conn, review_id):
+    """Add a freshly inserted review to the review_pending queue; call in the transaction that inserts it"""
+    conn.execute(text("INSERT INTO review_pending (review_id) VALUES (:review_id) ON CONFLICT DO NOTHING"),
+                 {'review_id': int(review_id)})
+
+
+DASHBOARD_COLUMNS = ['id', 'Comment', 'Sentiment', 'SentimentReason', 'OverallRating',
+                     'PassengerCountry', 'Aircraft', 'DatePublished', 'DatePublishedISO']
+
+
+def load_sentiment_data(engine=None):
+    """Analyzed reviews for the sentiment dashboard, newest first"""
+    query = f"""
+        SELECT {', '.join(DASHBOARD_COLUMNS)}
+        FROM ryanair_reviews 
+        WHERE Sentiment IS NOT NULL AND Sentiment != ''
+        ORDER BY id DESC
+    """
+    # PostgreSQL returns lowercase column names; map them back
+    df = pd.read_sql(query, engine or get_engine())
+    return df.rename(columns={col.lower(): col for col in DASHBOARD_COLUMNS})
+
+
+class StreamingJSONParser:
+    """Incremental parser that collects exactly one top-level JSON object from streamed chunks"""
+
+    def __init__(self):
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.complete = False
+
+    def feed(self, chunk):
+        """Consume a chunk; return True once the top-level object has closed"""
+        for char in chunk:
+            if self.complete:
+                break
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                    self.buffer.append(char)
+                elif not char.isspace():
+                    raise ValueError(f"Unexpected text before JSON object: {char!r}")
+                continue
+
+            self.buffer.append(char)
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == "{":
+                self.depth += 1
+            elif char == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.complete = True
+        return self.complete
+
+    def result(self):
+        """Return the parsed object (strict json.loads of the collected text)"""
+        if not self.complete:
+            raise ValueError("JSON object was not closed")
+        return json.loads("".join(self.buffer))
+
 
 class SentimentAgent:
-    def __init__(self, ollama_url="http://localhost:11434"):
-        self.ollama_url = ollama_url
+    def __init__(self, ollama_url="http://localhost:11434", ollama_urls=None, max_concurrency=1,
+                 strategy="least_loaded", weights=None):
+        # A pool of model servers; a single ollama_url is a pool of one
+        urls = ollama_urls or [ollama_url]
+        self.ollama_url = urls[0]
+        self.pool = EndpointPool(urls, weights=weights, max_concurrency=max_concurrency, strategy=strategy)
+        if len(urls) > 1:
+            self.pool.start_health_checks()
         self.model = "llama3.2"  # Change to your preferred Ollama model
+        self.max_output_tokens = 64
+        self.max_attempts = 3
+        self.last_output_tokens = 0
+        self.page_size = 500  # pending reviews fetched per query in process_reviews
+        # Stored with every result; changes whenever the prompt template is edited
+        self.prompt_version = hashlib.sha1(self.get_sentiment_prompt("").encode()).hexdigest()[:12]
+        add_date_columns()
+        add_review_topics()
+        add_near_duplicate_index()
+        add_review_sample()
         
     def get_sentiment_prompt(self, review_text):
         """Create few-shot prompt for sentiment analysis"""
-        return f"""You are a sentiment analysis expert. You will receive customer reviews and classify sentiment as "Positive", "Neutral", or "Negative". Respond ONLY in JSON format.
+        return f"""You are a sentiment analysis expert. Classify the customer review sentiment with a label code: "pos" (Positive), "neu" (Neutral) or "neg" (Negative). Respond ONLY with a JSON object containing "label" and a short "reason" (a few comma-separated topic tags). Do not repeat the review.
 
 Examples:
 Review: "The check-in process was smooth and the flight was on time. Great service overall!"
-{{"review": "The check-in process was smooth and the flight was on time. Great service overall!", "sentiment": "Positive", "reason": "smooth check-in, on time, great service"}}
+{{"label": "pos", "reason": "smooth check-in, on time, great service"}}
 
 Review: "It was okay, nothing special. Seats were a bit cramped."
-{{"review": "It was okay, nothing special. Seats were a bit cramped.", "sentiment": "Neutral", "reason": "okay experience, minor complaint about seats"}}
+{{"label": "neu", "reason": "okay experience, cramped seats"}}
 
 Review: "Very disappointed with the delay and rude staff."
-{{"review": "Very disappointed with the delay and rude staff.", "sentiment": "Negative", "reason": "disappointed, delay, rude staff"}}
+{{"label": "neg", "reason": "delay, rude staff"}}
 
 Now analyze this review:
 Review: "{review_text}"
 """
 
-    def analyze_sentiment(self, review_text):
-        """Send review to Ollama for sentiment analysis"""
-        try:
-            prompt = self.get_sentiment_prompt(review_text)
-            
+    def parse_sentiment(self, data):
+        """Validate a compact reply and map it to the sentiment/reason fields used by the database"""
+        if not isinstance(data, dict) or set(data) - {"label", "reason"}:
+            raise ValueError(f"Unexpected sentiment object: {data!r}")
+        label = data.get("label")
+        if label not in SENTIMENT_LABELS:
+            raise ValueError(f"Unknown sentiment label: {label!r}")
+        reason = data.get("reason", "")
+        if isinstance(reason, list):
+            reason = ', '.join(str(r) for r in reason)
+        return {"sentiment": SENTIMENT_LABELS[label], "reason": str(reason)}
+
+    def result_row(self, review_id, sentiment_result):
+        """review_sentiment row for a result; reused near-duplicate results keep their own provenance"""
+        reason = sentiment_result['reason']
+        # Ensure reason is a string (handle list responses)
+        if isinstance(reason, list):
+            reason = ', '.join(reason)
+        elif not isinstance(reason, str):
+            reason = str(reason)
+        return {
+            'review_id': int(review_id),
+            'sentiment': sentiment_result['sentiment'],
+            'reason': reason,
+            'model': sentiment_result.get('model') or self.model,
+            'prompt_version': sentiment_result.get('prompt_version') or self.prompt_version,
+        }
+
+    def request_sentiment(self, prompt, tried=None):
+        """Stream one generation from the least-loaded endpoint; returns the filled parser"""
+        parser = StreamingJSONParser()
+        output_tokens = 0
+
+        with self.pool.acquire(exclude=tried or ()) as endpoint:
+            if tried is not None:
+                tried.add(endpoint.url)
+            # Stream the reply so generation can be cut off as soon as the object closes
             response = requests.post(
-                f"{self.ollama_url}/api/generate",
+                f"{endpoint.url}/api/generate",
                 json={
                     "model": self.model,
                     "prompt": prompt,
-                    "stream": False
-                }
+                    "stream": True,
+                    "format": SENTIMENT_SCHEMA,
+                    "options": {"temperature": 0, "num_predict": self.max_output_tokens}
+                },
+                stream=True
             )
-            
-            if response.status_code == 200:
-                result = response.json()
-                # Parse JSON from response
-                try:
-                    sentiment_data = json.loads(result['response'])
-                    return sentiment_data
-                except:
-                    # Fallback if JSON parsing fails
-                    return {
-                        "review": review_text,
-                        "sentiment": "Neutral",
-                        "reason": "Analysis failed"
-                    }
-            else:
-                return None
-                
-        except Exception as e:
-            print(f"Error analyzing sentiment: {e}")
-            return None
+            try:
+                # A non-200 reply counts as a failure for this endpoint
+                response.raise_for_status()
+                # Each streamed line carries one generated token
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    output_tokens += 1
+                    if parser.feed(chunk.get("response", "")) or chunk.get("done"):
+                        break
+            finally:
+                # Closing the connection tells Ollama to stop generating
+                response.close()
+
+        self.last_output_tokens = output_tokens
+        return parser
+
+    def analyze_sentiment(self, review_text):
+        """Send review to Ollama for sentiment analysis; None when it fails (the review stays pending)"""
+        return self.try_sentiment(review_text)[0]
+
+    def try_sentiment(self, review_text):
+        """analyze_sentiment that also says why it failed: (result, None) or (None, error message)"""
+        prompt = self.get_sentiment_prompt(review_text)
+        # With several endpoints a failed request is retried on another one
+        attempts = 1 if len(self.pool.endpoints) == 1 else self.max_attempts
+        tried = set()
+        for attempt in range(attempts):
+            try:
+                parser = self.request_sentiment(prompt, tried)
+                break
+            except Exception as e:
+                if attempt == attempts - 1:
+                    print(f"Error analyzing sentiment: {e}")
+                    return None, f"No response from model server: {e}"
+
+        try:
+            return self.parse_sentiment(parser.result()), None
+        except ValueError as e:
+            # An unparseable reply is a failure, not a Neutral result: nothing is saved and the review is retried
+            print(f"Unusable sentiment reply: {e}")
+            return None, f"Unusable model reply: {e}"
+
+    def analyze_many(self, review_texts):
+        """Analyze several reviews concurrently across the endpoint pool, keeping input order"""
+        with ThreadPoolExecutor(max_workers=self.pool.capacity()) as executor:
+            return list(executor.map(self.analyze_sentiment, review_texts))
 
     def add_sentiment_column(self):
-        """Add sentiment columns to database table"""
+        """Make sure the review_sentiment table and the ryanair_reviews view exist; no-op once they do"""
         try:
-            engine = get_sqlite_engine()
-            with engine.connect() as conn:
-                # SQLite ALTER TABLE syntax
-                try:
-                    conn.execute(text("ALTER TABLE ryanair_reviews ADD COLUMN Sentiment TEXT"))
-                except:
-                    pass  # Column already exists
-                try:
-                    conn.execute(text("ALTER TABLE ryanair_reviews ADD COLUMN SentimentReason TEXT"))
-                except:
-                    pass  # Column already exists
-                conn.commit()
-            print("Sentiment columns ready")
+            prepare_review_tables(get_engine())
+            print("Sentiment table ready")
         except Exception as e:
-            print(f"Error adding columns: {e}")
+            print(f"Error preparing sentiment table: {e}")
 
     def process_reviews(self):
         """Process reviews and update with sentiment analysis"""
         try:
-            engine = get_sqlite_engine()
+            engine = get_engine()
             
-            # Count unprocessed reviews first
-            count_query = """
-                SELECT COUNT(*) as unprocessed_count
-                FROM ryanair_reviews 
-                WHERE (Sentiment IS NULL OR Sentiment = '') AND Comment IS NOT NULL AND Comment != ''
-            """
-            count_df = pd.read_sql(count_query, engine)
-            total_unprocessed = count_df.iloc[0]['unprocessed_count']
+            # Both queries only walk the review_pending queue
+            count_df = pd.read_sql("SELECT COUNT(*) as unprocessed_count FROM review_pending", engine)
+            total_unprocessed = int(count_df.iloc[0]['unprocessed_count'])
             
             if total_unprocessed == 0:
                 print("All reviews already have sentiment analysis!")
@@ -102,63 +278,66 @@ Review: "{review_text}"
             
             print(f"Found {total_unprocessed} reviews without sentiment analysis")
             
-            query = """
-                SELECT id, Comment as comment 
-                FROM ryanair_reviews 
-                WHERE (Sentiment IS NULL OR Sentiment = '') 
-                AND Comment IS NOT NULL AND Comment != ''
-                ORDER BY id
-            """
-            
-            df = pd.read_sql(query, engine)
-            print(f"Processing {len(df)} reviews for sentiment analysis...")
-            
-            for idx, row in df.iterrows():
-                review_id = row['id']
-                comment = row['comment']
-                
-                print(f"Analyzing review {idx+1}/{len(df)}...")
-                
-                # Get sentiment analysis
-                sentiment_result = self.analyze_sentiment(comment)
-                
-                if sentiment_result:
-                    # Ensure reason is a string (handle list responses)
-                    reason = sentiment_result['reason']
-                    if isinstance(reason, list):
-                        reason = ', '.join(reason)
-                    elif not isinstance(reason, str):
-                        reason = str(reason)
-                    
-                    # Update database
-                    with engine.connect() as conn:
-                        conn.execute(text("""
-                            UPDATE ryanair_reviews 
-                            SET Sentiment = :sentiment, SentimentReason = :reason 
-                            WHERE id = :id
-                        """), {
-                            'sentiment': sentiment_result['sentiment'],
-                            'reason': reason,
-                            'id': review_id
-                        })
-                        conn.commit()
-                    
-                    print(f"Updated review {review_id}: {sentiment_result['sentiment']}")
+            # Keyset pagination: one page of comments in memory at a time
+            query = text("""
+                SELECT r.id, r.Comment as comment
+                FROM review_pending p JOIN ryanair_reviews r ON r.id = p.review_id
+                WHERE p.review_id > :last_id
+                ORDER BY p.review_id
+                LIMIT :page_size
+            """)
+            last_id = -1
+            done = 0
+            while True:
+                df = pd.read_sql(query, engine, params={'last_id': last_id, 'page_size': self.page_size})
+                if df.empty:
+                    break
+                last_id = int(df['id'].iloc[-1])
+                self.process_page(engine, df, done, total_unprocessed)
+                done += len(df)
                 
         except Exception as e:
             print(f"Error processing reviews: {e}")
+
+    def process_page(self, engine, df, done, total):
+        """Analyze one page of pending reviews and write the results back"""
+        # Analyze one batch per pool capacity so every endpoint stays busy
+        batch_size = self.pool.capacity()
+        for start in range(0, len(df), batch_size):
+            batch = df.iloc[start:start + batch_size]
+            print(f"Analyzing reviews {done+start+1}-{done+start+len(batch)}/{total}...")
+            # Near-duplicates of an analyzed review take its result instead of another LLM call
+            reused = representative_sentiment(engine, batch['id'].tolist())
+            fresh = batch[~batch['id'].isin(list(reused))]
+            analyzed = dict(zip(fresh['id'].tolist(), self.analyze_many(fresh['comment'].tolist())))
+            results = [reused.get(review_id) or analyzed.get(review_id) for review_id in batch['id'].tolist()]
+            rows = [self.result_row(review_id, result) for review_id, result in zip(batch['id'].tolist(), results)
+                    if result]
+
+            # One bulk UPSERT per batch; the reviews' topic rows change in the same transaction
+            with engine.begin() as conn:
+                save_sentiments(conn, rows)
+                for row in rows:
+                    save_review_topics(conn, row['review_id'], row['reason'])
+
+            for row in rows:
+                print(f"Updated review {row['review_id']}: {row['sentiment']}")
     
     def add_new_review(self, comment, rating=None, country=None, aircraft=None, traveller_type=None, origin=None, destination=None):
         """Add new review to database and return its ID"""
         try:
-            engine = get_sqlite_engine()
+            engine = get_engine()
             with engine.connect() as conn:
-                result = conn.execute(text("""
-                    INSERT INTO ryanair_reviews (
-                        Comment, OverallRating, PassengerCountry, Aircraft, 
-                        TypeOfTraveller, Origin, Destination, DatePublished
+                result = conn.execute(text(f"""
+                    INSERT INTO {REVIEWS_TABLE} (
+                        id, Comment, OverallRating, PassengerCountry, Aircraft, 
+                        TypeOfTraveller, Origin, Destination, DatePublished,
+                        DatePublishedISO, DatePublishedMonth, DateFlownMonth
                     )
-                    VALUES (:comment, :rating, :country, :aircraft, :traveller_type, :origin, :destination, date('now'))
+                    VALUES ({new_review_id(engine)},
+                            :comment, :rating, :country, :aircraft, :traveller_type, :origin, :destination, CURRENT_DATE,
+                            :DatePublishedISO, :DatePublishedMonth, :DateFlownMonth)
+                    RETURNING id
                 """), {
                     'comment': comment,
                     'rating': rating,
@@ -166,10 +345,17 @@ Review: "{review_text}"
                     'aircraft': aircraft,
                     'traveller_type': traveller_type,
                     'origin': origin,
-                    'destination': destination
+                    'destination': destination,
+                    **date_columns(date.today())
                 })
+                review_id = result.scalar()
+                if comment:
+                    queue_for_sentiment(conn, review_id)
                 conn.commit()
-                return result.lastrowid
+            cluster_reviews([review_id], engine)
+            sample_new_reviews(engine)
+            compress_new_reviews(engine)
+            return review_id
         except Exception as e:
             print(f"Error adding review: {e}")
             return None
@@ -185,7 +371,7 @@ Review: "{review_text}"
             df.columns = df.columns.str.strip().str.replace(' ', '_').str.lower()
             
             review_ids = []
-            engine = get_sqlite_engine()
+            engine = get_engine()
             
             for _, row in df.iterrows():
                 # Extract data from row
@@ -196,15 +382,20 @@ Review: "{review_text}"
                 traveller_type = row.get('type_of_traveller', row.get('traveller_type', None))
                 origin = row.get('origin', None)
                 destination = row.get('destination', None)
+                date_flown = row.get('date_flown', None)
                 
                 if comment:  # Only add if comment exists
                     with engine.connect() as conn:
-                        result = conn.execute(text("""
-                            INSERT INTO ryanair_reviews (
-                                Comment, OverallRating, PassengerCountry, Aircraft,
-                                TypeOfTraveller, Origin, Destination, DatePublished
+                        result = conn.execute(text(f"""
+                            INSERT INTO {REVIEWS_TABLE} (
+                                id, Comment, OverallRating, PassengerCountry, Aircraft,
+                                TypeOfTraveller, Origin, Destination, DatePublished, DateFlown,
+                                DatePublishedISO, DatePublishedMonth, DateFlownMonth
                             )
-                            VALUES (:comment, :rating, :country, :aircraft, :traveller_type, :origin, :destination, date('now'))
+                            VALUES ({new_review_id(engine)},
+                            :comment, :rating, :country, :aircraft, :traveller_type, :origin, :destination, CURRENT_DATE,
+                            :date_flown, :DatePublishedISO, :DatePublishedMonth, :DateFlownMonth)
+                            RETURNING id
                         """), {
                             'comment': comment,
                             'rating': rating,
@@ -212,11 +403,19 @@ Review: "{review_text}"
                             'aircraft': aircraft,
                             'traveller_type': traveller_type,
                             'origin': origin,
-                            'destination': destination
+                            'destination': destination,
+                            'date_flown': date_flown if isinstance(date_flown, str) else None,
+                            **date_columns(date.today(), date_flown)
                         })
+                        review_id = result.scalar()
+                        queue_for_sentiment(conn, review_id)
                         conn.commit()
-                        review_ids.append(result.lastrowid)
+                        review_ids.append(review_id)
             
+            # One pass over the upload, so reposts within the file cluster together too
+            cluster_reviews(review_ids, engine)
+            sample_new_reviews(engine)
+            compress_new_reviews(engine)
             return review_ids
             
         except Exception as e:
@@ -224,51 +423,44 @@ Review: "{review_text}"
             return []
     
     def process_single_review(self, review_id):
-        """Process sentiment analysis for a single review"""
+        """Process sentiment analysis for a single review; returns True once its result is stored"""
         try:
-            engine = get_sqlite_engine()
+            engine = get_engine()
             
             # Get the specific review
-            query = "SELECT id, Comment as comment FROM ryanair_reviews WHERE id = ? AND Comment IS NOT NULL"
-            df = pd.read_sql(query, engine, params=[review_id])
+            query = text("SELECT id, Comment as comment FROM ryanair_reviews WHERE id = :id AND Comment IS NOT NULL")
+            df = pd.read_sql(query, engine, params={'id': int(review_id)})
             
             if df.empty:
                 print("Review not found or has no comment")
-                return
+                return False
             
-            review_id = df.iloc[0]['id']
+            review_id = int(df.iloc[0]['id'])  # numpy ints do not bind as SQLite integers
             comment = df.iloc[0]['comment']
             
             print(f"Analyzing review: {comment[:100]}...")
             
-            # Get sentiment analysis
-            sentiment_result = self.analyze_sentiment(comment)
-            
+            # Get sentiment analysis; a near-duplicate reuses its cluster representative's
+            sentiment_result = representative_sentiment(engine, [review_id]).get(review_id)
             if sentiment_result:
-                # Ensure reason is a string (handle list responses)
-                reason = sentiment_result['reason']
-                if isinstance(reason, list):
-                    reason = ', '.join(reason)
-                elif not isinstance(reason, str):
-                    reason = str(reason)
-                
-                # Update database
-                with engine.connect() as conn:
-                    conn.execute(text("""
-                        UPDATE ryanair_reviews 
-                        SET Sentiment = :sentiment, SentimentReason = :reason 
-                        WHERE id = :id
-                    """), {
-                        'sentiment': sentiment_result['sentiment'],
-                        'reason': reason,
-                        'id': review_id
-                    })
-                    conn.commit()
-                
-                print(f"Sentiment: {sentiment_result['sentiment']} - {sentiment_result['reason']}")
+                print("Near-duplicate of an analyzed review - reusing its sentiment")
+            else:
+                sentiment_result = self.analyze_sentiment(comment)
             
+            if not sentiment_result:
+                return False
+            row = self.result_row(review_id, sentiment_result)
+            # Store the result; the review's topic rows change in the same transaction
+            with engine.begin() as conn:
+                save_sentiments(conn, [row])
+                save_review_topics(conn, review_id, row['reason'])
+
+            print(f"Sentiment: {sentiment_result['sentiment']} - {sentiment_result['reason']}")
+            return True
+
         except Exception as e:
             print(f"Error processing single review: {e}")
+            return False
 
 # Usage example
 if __name__ == "__main__":
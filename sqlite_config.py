@@ -1,23 +1,348 @@
 import sqlite3
+import threading
+from contextlib import closing
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 import os
 
+# ==============================
+# Backend Configuration
+# ==============================
+# DB_BACKEND selects the database: "sqlite" (default, local file) or "postgresql".
+# DATABASE_URL overrides the connection URL for either backend.
+DB_BACKEND = os.environ.get('DB_BACKEND', 'sqlite').lower()
+
+POSTGRES_CONFIG = {
+    'host': os.environ.get('PGHOST', 'localhost'),
+    'database': os.environ.get('PGDATABASE', 'ryanaircs'),
+    'user': os.environ.get('PGUSER', 'postgres'),
+    'password': os.environ.get('PGPASSWORD', 'admin'),  # change if needed
+    'port': os.environ.get('PGPORT', '5432')
+}
+
+# Credentials (e.g. HF_API_KEY) come from the environment first, then a Streamlit secrets file
+SECRETS_PATHS = [
+    os.path.join(os.path.dirname(__file__), '.streamlit', 'secrets.toml'),
+    os.path.join(os.path.expanduser('~'), '.streamlit', 'secrets.toml'),
+]
+
+_engines = {}
+
+
+def get_setting(name, default=None):
+    """Setting or credential from the environment, else from .streamlit/secrets.toml (read without Streamlit)"""
+    if os.environ.get(name):
+        return os.environ[name]
+    for path in SECRETS_PATHS:
+        if os.path.exists(path):
+            import tomllib
+            with open(path, 'rb') as f:
+                secrets = tomllib.load(f)
+            if name in secrets:
+                return secrets[name]
+    return default
+
+
+def get_database_url():
+    """Connection URL for the configured backend"""
+    if os.environ.get('DATABASE_URL'):
+        return os.environ['DATABASE_URL']
+    if DB_BACKEND == 'postgresql':
+        return (
+            f"postgresql://{POSTGRES_CONFIG['user']}:{POSTGRES_CONFIG['password']}@"
+            f"{POSTGRES_CONFIG['host']}:{POSTGRES_CONFIG['port']}/{POSTGRES_CONFIG['database']}"
+        )
+    db_path = os.path.join(os.path.dirname(__file__), 'ryanair_reviews.db')
+    return f'sqlite:///{db_path}'
+
+
+def get_engine():
+    """Shared, pooled engine for the configured backend (one per process)"""
+    # Pools must not be shared across fork(), so engines are cached per process
+    pid = os.getpid()
+    if pid not in _engines:
+        url = get_database_url()
+        if url.startswith('sqlite'):
+            engine = create_engine(
+                url,
+                pool_size=5,
+                max_overflow=10,
+                connect_args={'timeout': 30, 'check_same_thread': False}
+            )
+            event.listen(engine, 'connect', register_sqlite_functions)
+            event.listen(engine, 'checkout', refresh_text_view)
+        else:
+            engine = create_engine(url, pool_size=5, max_overflow=10, pool_pre_ping=True)
+        _engines[pid] = engine
+    return _engines[pid]
+
+
+def reset_engine():
+    """Close this process's shared engine, so the next get_engine() follows a changed DATABASE_URL"""
+    engine = _engines.pop(os.getpid(), None)
+    if engine is not None:
+        engine.dispose()
+
+
 def get_sqlite_engine():
     """Create SQLite engine for local/cloud deployment"""
-    db_path = os.path.join(os.path.dirname(__file__), 'ryanair_reviews.db')
-    return create_engine(f'sqlite:///{db_path}')
+    # Kept for existing callers; returns the shared engine of the configured backend
+    return get_engine()
+
+
+def get_dialect(engine=None):
+    """Human-readable SQL dialect of the active backend ("SQLite" or "PostgreSQL")"""
+    name = (engine or get_engine()).dialect.name
+    return {'sqlite': 'SQLite', 'postgresql': 'PostgreSQL'}.get(name, name)
+
+
+def is_sqlite(engine=None):
+    return (engine or get_engine()).dialect.name == 'sqlite'
+
+
+def autoincrement_pk(engine=None):
+    """Column definition for an auto-incrementing integer primary key"""
+    return 'INTEGER PRIMARY KEY AUTOINCREMENT' if is_sqlite(engine) else 'SERIAL PRIMARY KEY'
+
+
+def new_review_id(engine=None):
+    """VALUES expression for the id of an inserted review: the id column's default in PostgreSQL, where
+    concurrent MAX(id) + 1 inserts would race; SQLite serializes writers, so there it is safe"""
+    return f"(SELECT COALESCE(MAX(id), -1) + 1 FROM {REVIEWS_TABLE})" if is_sqlite(engine) else "DEFAULT"
+
+
+# ==============================
+# Review Tables
+# ==============================
+# Review rows live in reviews_base and sentiment results in the narrow review_sentiment
+# table, so writing a result never rewrites a row holding the long Comment text.
+# ryanair_reviews is a view joining the two: every query written against the old
+# single table (Sentiment, SentimentReason, ...) keeps working unchanged.
+REVIEWS_TABLE = 'reviews_base'
+SENTIMENT_COLUMNS = ('sentiment', 'sentimentreason')
+# Long text columns that review_text.py can keep zstd-compressed in the review_text table (SQLite only)
+TEXT_COLUMNS = ('Comment', 'CommentTitle')
+
+# Reviews still waiting for sentiment, as a filter on the ryanair_reviews view. It reads every row, so it
+# only fills the review_pending queue once per load; from then on the queue is kept up on insert.
+PENDING_FILTER = "(Sentiment IS NULL OR Sentiment = '') AND Comment IS NOT NULL AND Comment != ''"
+
+_text_dictionaries = {}  # zstd dictionary id -> trained dictionary bytes, shared by every connection
+_text_local = threading.local()  # decompressors are not thread-safe: one set per thread
+
 
-def setup_sqlite_db():
+def review_text_function(database_path):
+    """SQLite function review_text(blob): text of a compressed review_text value, decompressed with the
+    dictionary its zstd frame names; plain text and NULL pass through"""
+    def review_text(value):
+        if value is None or isinstance(value, str):
+            return value
+        import zstandard
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        decompressors = _text_local.__dict__.setdefault('decompressors', {})
+        if dict_id not in decompressors:
+            if dict_id and dict_id not in _text_dictionaries:
+                # A separate connection: the calling one is in the middle of a statement
+                with closing(sqlite3.connect(database_path)) as conn:
+                    _text_dictionaries.update(conn.execute("SELECT dict_id, dictionary FROM review_text_dictionary"))
+            dictionary = zstandard.ZstdCompressionDict(_text_dictionaries[dict_id]) if dict_id else None
+            decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressors[dict_id].decompress(value).decode()
+    return review_text
+
+
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """Functions the decompressing review view calls, registered on every new SQLite connection"""
+    database_path = dbapi_connection.execute("PRAGMA database_list").fetchone()[2]
+    dbapi_connection.create_function('review_text', 1, review_text_function(database_path), deterministic=True)
+
+
+def create_text_view(dbapi_connection):
+    """In compressed text mode, shadow the stored ryanair_reviews view on this connection with a TEMP view
+    that decompresses the text columns. The stored view never calls review_text(), so the sqlite3 shell and
+    other clients can still read it (compressed text shows as NULL there)."""
+    dbapi_connection.execute("DROP VIEW IF EXISTS temp.ryanair_reviews")
+    names = {row[0] for row in dbapi_connection.execute("SELECT name FROM main.sqlite_master")}
+    if {'review_text', 'ryanair_reviews', REVIEWS_TABLE} <= names:
+        columns = [row[1] for row in dbapi_connection.execute(f"PRAGMA main.table_info({REVIEWS_TABLE})")]
+        dbapi_connection.execute(f"CREATE TEMP VIEW ryanair_reviews AS {reviews_view_select(columns, True)}")
+
+
+def refresh_text_view(dbapi_connection, connection_record, connection_proxy):
+    """Rebuild the connection's TEMP view whenever the stored schema changed since the last checkout"""
+    version = dbapi_connection.execute("PRAGMA schema_version").fetchone()[0]
+    if connection_record.info.get('schema_version') != version:
+        create_text_view(dbapi_connection)
+        connection_record.info['schema_version'] = version
+
+
+def drop_text_view(conn):
+    """Drop this connection's TEMP view, so DDL on ryanair_reviews reaches the stored one"""
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text("DROP VIEW IF EXISTS temp.ryanair_reviews"))
+
+
+def create_review_sentiment_table(conn):
+    """Sentiment results keyed by review id, with the model and prompt version that produced them"""
+    # In SQLite an INTEGER PRIMARY KEY is the rowid, so the view's join is a single B-tree lookup
+    key_type = 'INTEGER' if conn.dialect.name == 'sqlite' else 'BIGINT'
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS review_sentiment (
+            review_id {key_type} PRIMARY KEY,
+            Sentiment TEXT,
+            SentimentReason TEXT,
+            Model TEXT,
+            PromptVersion TEXT,
+            AnalyzedAt TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    # Covers the dashboard's sentiment filters and counts, and the join back to the reviews
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_review_sentiment_filter ON review_sentiment (Sentiment, review_id)"))
+
+
+def create_review_pending_table(conn):
+    """review_pending: ids of the reviews awaiting sentiment, so finding work costs O(pending), not O(table).
+    Filled from the reviews here; inserts add new reviews and saved results remove them."""
+    key_type = 'INTEGER' if conn.dialect.name == 'sqlite' else 'BIGINT'
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS review_pending (review_id {key_type} PRIMARY KEY)"))
+    conn.execute(text(f"""
+        INSERT INTO review_pending (review_id)
+        SELECT id FROM ryanair_reviews WHERE {PENDING_FILTER} AND id IS NOT NULL
+        ON CONFLICT (review_id) DO NOTHING
+    """))
+
+
+def reviews_view_select(columns, decompress=False):
+    """SELECT of the ryanair_reviews view over the given reviews_base columns"""
+    compressed = {name.lower() for name in TEXT_COLUMNS} if decompress else set()
+    # Compressed text mode: text not yet moved is still in reviews_base; the rest is decompressed only
+    # when a query reads the column
+    select_list = ', '.join(
+        f'COALESCE({REVIEWS_TABLE}."{name}", (SELECT review_text(t."{name}") FROM review_text t '
+        f'WHERE t.review_id = {REVIEWS_TABLE}.id)) AS "{name}"' if name.lower() in compressed
+        else f'{REVIEWS_TABLE}."{name}"'
+        for name in columns if name.lower() not in SENTIMENT_COLUMNS
+    )
+    return f"""
+        SELECT {select_list}, review_sentiment.Sentiment, review_sentiment.SentimentReason
+        FROM {REVIEWS_TABLE} LEFT JOIN review_sentiment ON review_sentiment.review_id = {REVIEWS_TABLE}.id
+    """
+
+
+def create_reviews_view(conn):
+    """(Re)create the ryanair_reviews view; call again after adding columns to reviews_base"""
+    columns = [c['name'] for c in inspect(conn).get_columns(REVIEWS_TABLE)]
+    drop_text_view(conn)
+    conn.execute(text("DROP VIEW IF EXISTS ryanair_reviews"))
+    conn.execute(text(f"CREATE VIEW ryanair_reviews AS {reviews_view_select(columns)}"))
+    if conn.dialect.name == 'sqlite':
+        create_text_view(conn.connection.dbapi_connection)
+
+
+def split_review_sentiment(engine):
+    """Turn a ryanair_reviews table, as the loaders write it, into reviews_base, review_sentiment and
+    the ryanair_reviews view. Existing results are moved over. Returns False when there is nothing to do."""
+    inspector = inspect(engine)
+    if 'ryanair_reviews' not in inspector.get_table_names():
+        return False  # already split, or nothing loaded yet
+    columns = {c['name'].lower(): c['name'] for c in inspector.get_columns('ryanair_reviews')}
+    with engine.begin() as conn:
+        drop_text_view(conn)
+        create_review_sentiment_table(conn)
+        # A reviews_base left from an earlier load is superseded by the freshly loaded table
+        conn.execute(text(f"DROP TABLE IF EXISTS {REVIEWS_TABLE}"))
+        conn.execute(text("DROP TABLE IF EXISTS review_pending"))
+        if 'sentiment' in columns:
+            reason = f'"{columns["sentimentreason"]}"' if 'sentimentreason' in columns else 'NULL'
+            conn.execute(text(f"""
+                INSERT INTO review_sentiment (review_id, Sentiment, SentimentReason)
+                SELECT id, "{columns['sentiment']}", {reason} FROM ryanair_reviews
+                WHERE id IS NOT NULL AND "{columns['sentiment']}" IS NOT NULL AND "{columns['sentiment']}" != ''
+                ON CONFLICT (review_id) DO UPDATE
+                SET Sentiment = excluded.Sentiment, SentimentReason = excluded.SentimentReason
+            """))
+        if engine.dialect.name != 'sqlite' or sqlite3.sqlite_version_info >= (3, 35):
+            if engine.dialect.name == 'sqlite':
+                # SQLite cannot drop a column an index still refers to (e.g. the old pending-review index)
+                for name, sql in conn.execute(text(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'ryanair_reviews' "
+                    "AND sql IS NOT NULL"
+                )).fetchall():
+                    if any(column in sql.lower() for column in SENTIMENT_COLUMNS):
+                        conn.execute(text(f'DROP INDEX "{name}"'))
+            for column in SENTIMENT_COLUMNS:
+                if column in columns:
+                    conn.execute(text(f'ALTER TABLE ryanair_reviews DROP COLUMN "{columns[column]}"'))
+        # On an older SQLite the legacy columns stay in reviews_base; the view leaves them out
+        conn.execute(text(f"ALTER TABLE ryanair_reviews RENAME TO {REVIEWS_TABLE}"))
+        create_reviews_view(conn)
+    print(f"Moved sentiment results to review_sentiment; ryanair_reviews is now a view over {REVIEWS_TABLE}")
+    return True
+
+
+def prepare_review_tables(engine=None):
+    """Make sure the reviews are split into reviews_base and review_sentiment, that the review_pending
+    queue exists and that review ids are indexed. Cheap once done; schema upkeep starts with it.
+
+    Tables loaded with pandas have no key, so every UPDATE ... WHERE id = :id would scan the table. In
+    PostgreSQL id becomes an identity primary key, so inserts take new ids from its sequence.
+    """
+    engine = engine or get_engine()
+    try:
+        split_review_sentiment(engine)
+        if not inspect(engine).has_table(REVIEWS_TABLE):
+            return
+        if not inspect(engine).has_table('review_pending'):
+            with engine.begin() as conn:
+                create_review_pending_table(conn)
+        if 'id' in inspect(engine).get_pk_constraint(REVIEWS_TABLE).get('constrained_columns', []):
+            return
+        with engine.begin() as conn:
+            if is_sqlite(engine):
+                conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_reviews_id ON {REVIEWS_TABLE} (id)"))
+                return
+            next_id = conn.execute(text(f"SELECT COALESCE(MAX(id), -1) + 1 FROM {REVIEWS_TABLE}")).scalar()
+            conn.execute(text(f"ALTER TABLE {REVIEWS_TABLE} ALTER COLUMN id SET NOT NULL"))
+            if not conn.execute(text(
+                f"SELECT pg_get_serial_sequence('{REVIEWS_TABLE}', 'id')"
+            )).scalar():
+                conn.execute(text(f"ALTER TABLE {REVIEWS_TABLE} ALTER COLUMN id "
+                                  f"ADD GENERATED BY DEFAULT AS IDENTITY (START WITH {int(next_id)})"))
+            conn.execute(text(f"ALTER TABLE {REVIEWS_TABLE} ADD PRIMARY KEY (id)"))
+    except Exception as e:
+        print(f"Could not prepare the review tables: {e}")
+
+
+def drop_review_tables(engine):
+    """Remove the reviews, their sentiment results and pending queue, compressed text, the review sample, topics,
+    near-duplicate buckets, the rating driver statistics and the analytics snapshot marker before loading a fresh
+    set"""
+    with engine.begin() as conn:
+        drop_text_view(conn)
+        if 'ryanair_reviews' in inspect(conn).get_view_names():
+            conn.execute(text("DROP VIEW ryanair_reviews"))
+        for table in ('ryanair_reviews', REVIEWS_TABLE, 'review_sentiment', 'review_pending', 'review_text',
+                      'review_text_dictionary', 'review_sample', 'review_sample_state', 'review_topics',
+                      'review_lsh', 'rating_driver_state', 'rating_driver_sentiment', 'analytics_snapshot_state'):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+
+
+def setup_sqlite_db(csv_path='ryanair_reviews.csv'):
     """Convert CSV to SQLite database"""
-    engine = get_sqlite_engine()
-    
+    engine = get_engine()
+
     # Read CSV and create database
-    df = pd.read_csv('ryanair_reviews.csv')
+    df = pd.read_csv(csv_path)
+    if not is_sqlite(engine):
+        # Unquoted identifiers fold to lowercase in PostgreSQL, so store lowercase
+        # names and the same SQL (PassengerCountry, Sentiment, ...) runs on both backends
+        df.columns = [col.replace('&', '').lower() for col in df.columns]
+    drop_review_tables(engine)
     df.to_sql('ryanair_reviews', engine, if_exists='replace', index=False)
-    
-    print(f"SQLite database created with {len(df)} reviews")
+    prepare_review_tables(engine)
+
+    print(f"{get_dialect(engine)} database created with {len(df)} reviews")
     return engine
 
 if __name__ == "__main__":
-    setup_sqlite_db()
\ No newline at end of file
+    setup_sqlite_db()
@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
-from sentiment_agent import SentimentAgent
+from sentiment_agent import SentimentAgent, load_sentiment_data as load_analyzed_reviews
 from query_agent import QueryAgent
+from job_queue import JobQueue
+from conversation import Conversation
+from rating_drivers import ALL_KEY, DIMENSIONS, SUB_SCORES, RatingDrivers
 import uuid
 from datetime import datetime
 
@@ -12,18 +15,50 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize agents
+# Agents and the job queue are built on first use, not before the first paint
+def show_agent_event(kind, message):
+    """Render QueryAgent progress messages with the matching Streamlit element"""
+    if kind == "code":
+        st.code(message, language="sql")
+    elif kind == "approximate":
+        # Estimate from the review sample, cleared when the exact result arrives
+        placeholder = st.empty()
+        with placeholder.container():
+            st.caption(message.attrs.get("caption", ""))
+            st.dataframe(message, hide_index=True)
+        st.session_state.approximate_placeholder = placeholder
+    elif kind == "exact":
+        placeholder = st.session_state.pop("approximate_placeholder", None)
+        if placeholder is not None:
+            placeholder.empty()
+        st.caption(message)
+    else:
+        getattr(st, kind, st.write)(message)
+
+@st.cache_resource
+def get_sentiment_agent():
+    return SentimentAgent()
+
 @st.cache_resource
-def get_agents():
-    return SentimentAgent(), QueryAgent()
+def get_query_agent():
+    return QueryAgent(on_event=show_agent_event)
 
-sentiment_agent, query_agent = get_agents()
+# Background jobs run in worker threads shared by all sessions
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(get_sentiment_agent(), workers=4)
+
+@st.cache_resource
+def get_rating_drivers():
+    return RatingDrivers()
 
 # Initialize session state
 if 'chat_tabs' not in st.session_state:
-    st.session_state.chat_tabs = {"Chat 1": {"id": str(uuid.uuid4()), "messages": []}}
+    st.session_state.chat_tabs = {"Chat 1": {"id": str(uuid.uuid4()), "messages": [], "conversation": Conversation()}}
 if 'active_tab' not in st.session_state:
     st.session_state.active_tab = "Chat 1"
+if 'job_ids' not in st.session_state:
+    st.session_state.job_ids = []
 
 # Sidebar
 st.sidebar.title("🛫 Ryanair Analysis")
@@ -45,7 +80,8 @@ if page == "💬 Chat Analysis":
         # Add new tab
         if st.button("➕ New Chat"):
             new_tab_name = f"Chat {len(st.session_state.chat_tabs) + 1}"
-            st.session_state.chat_tabs[new_tab_name] = {"id": str(uuid.uuid4()), "messages": []}
+            st.session_state.chat_tabs[new_tab_name] = {"id": str(uuid.uuid4()), "messages": [],
+                                                        "conversation": Conversation()}
             st.session_state.active_tab = new_tab_name
             st.rerun()
     
@@ -78,7 +114,9 @@ if page == "💬 Chat Analysis":
         # Get AI response
         with st.chat_message("assistant"):
             with st.spinner("Analyzing your question..."):
-                response = query_agent.answer_question(prompt)
+                # Follow-ups ("now only Germany", "sort by rating") refine this tab's last result
+                conversation = current_chat.setdefault("conversation", Conversation())
+                response = conversation.ask(get_query_agent(), prompt)
                 st.markdown(response)  # Use markdown for better formatting
                 
                 # Add assistant message
@@ -91,23 +129,11 @@ if page == "💬 Chat Analysis":
     with st.sidebar.expander("Upload Excel File"):
         uploaded_file = st.file_uploader("Choose Excel file", type=['xlsx', 'xls'])
         if uploaded_file and st.button("Upload & Analyze"):
-            with st.spinner("Processing Excel file..."):
-                # Save uploaded file temporarily
-                temp_path = f"temp_{uploaded_file.name}"
-                with open(temp_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                
-                # Process file
-                sentiment_agent.add_sentiment_column()
-                review_ids = sentiment_agent.add_reviews_from_excel(temp_path)
-                
-                if review_ids:
-                    st.success(f"✅ Added {len(review_ids)} reviews")
-                    for review_id in review_ids:
-                        sentiment_agent.process_single_review(review_id)
-                    st.success("✅ Sentiment analysis completed!")
-                else:
-                    st.error("❌ Failed to process Excel file")
+            # Ingestion and sentiment analysis run in the background job queue
+            get_sentiment_agent().add_sentiment_column()
+            job_id = get_job_queue().submit_upload(uploaded_file.name, uploaded_file.getbuffer())
+            st.session_state.job_ids.append(job_id)
+            st.success(f"✅ Queued upload (job {job_id[:8]})")
     
     with st.sidebar.expander("Manual Entry"):
         with st.form("manual_review"):
@@ -119,6 +145,7 @@ if page == "💬 Chat Analysis":
             if st.form_submit_button("Add & Analyze"):
                 if comment.strip():
                     with st.spinner("Adding review..."):
+                        sentiment_agent = get_sentiment_agent()
                         sentiment_agent.add_sentiment_column()
                         review_id = sentiment_agent.add_new_review(
                             comment, rating, country or None, aircraft or None
@@ -126,13 +153,34 @@ if page == "💬 Chat Analysis":
                         
                         if review_id:
                             st.success(f"✅ Review added (ID: {review_id})")
-                            sentiment_agent.process_single_review(review_id)
-                            st.success("✅ Sentiment analysis completed!")
+                            job_id = get_job_queue().submit("sentiment", {"review_ids": [review_id]})
+                            st.session_state.job_ids.append(job_id)
+                            st.success("✅ Sentiment analysis queued!")
                         else:
                             st.error("❌ Failed to add review")
                 else:
                     st.error("❌ Comment is required!")
 
+    # Background job progress (polled without blocking the page)
+    @st.fragment(run_every="2s")
+    def show_jobs():
+        jobs = get_job_queue().recent(st.session_state.job_ids)
+        if jobs.empty:
+            return
+        st.subheader("⏳ Background Jobs")
+        for _, job in jobs.iterrows():
+            label = f"{job['kind'].title()} job {job['job_id'][:8]} - {job['status']}"
+            if job['status'] == 'FAILED':
+                st.error(f"{label}: {job['message']}")
+            elif job['status'] == 'DONE':
+                st.success(f"{label}: {job['message']}")
+            else:
+                fraction = job['progress'] / job['total'] if job['total'] else 0.0
+                st.progress(min(fraction, 1.0), text=f"{label} ({job['progress']}/{job['total']})")
+
+    with st.sidebar:
+        show_jobs()
+
 elif page == "📊 Sentiment Dashboard":
     st.title("📊 Sentiment Analysis Dashboard")
     
@@ -140,24 +188,31 @@ elif page == "📊 Sentiment Dashboard":
     @st.cache_data(ttl=60)  # Cache for 1 minute
     def load_sentiment_data():
         try:
-            from sqlite_config import get_sqlite_engine
-            engine = get_sqlite_engine()
-            
-            query = """
-                SELECT id, Comment as Comment, Sentiment, SentimentReason, 
-                       "OverallRating" as OverallRating, 
-                       "PassengerCountry" as PassengerCountry, 
-                       Aircraft as Aircraft, "DatePublished" as DatePublished
-                FROM ryanair_reviews 
-                WHERE Sentiment IS NOT NULL AND Sentiment != ''
-                ORDER BY id DESC
-            """
-            
-            return pd.read_sql(query, engine)
+            return load_analyzed_reviews()
         except Exception as e:
             st.error(f"Error loading data: {e}")
             return pd.DataFrame()
     
+    @st.cache_data(ttl=60)
+    def load_monthly_trend(start_date, end_date):
+        """Reviews, rating and negative share per month; a range scan on the DatePublishedISO index"""
+        try:
+            from sqlite_config import get_engine
+            from sqlalchemy import text
+            columns = ['DatePublishedMonth', 'Reviews', 'AvgRating', 'NegativePct']
+            trend = pd.read_sql(text("""
+                SELECT DatePublishedMonth, COUNT(*) AS Reviews, AVG(OverallRating) AS AvgRating,
+                       100.0 * SUM(CASE WHEN Sentiment = 'Negative' THEN 1 ELSE 0 END) / COUNT(*) AS NegativePct
+                FROM ryanair_reviews
+                WHERE DatePublishedISO BETWEEN :start_date AND :end_date
+                GROUP BY DatePublishedMonth
+                ORDER BY DatePublishedMonth
+            """), get_engine(), params={'start_date': start_date, 'end_date': end_date})
+            return trend.rename(columns={col.lower(): col for col in columns}).set_index('DatePublishedMonth')
+        except Exception as e:
+            st.error(f"Error loading monthly trend: {e}")
+            return pd.DataFrame()
+
     df = load_sentiment_data()
     
     if not df.empty:
@@ -183,6 +238,39 @@ elif page == "📊 Sentiment Dashboard":
         st.subheader("📈 Sentiment Distribution")
         sentiment_counts = df['Sentiment'].value_counts()
         st.bar_chart(sentiment_counts)
+
+        # Monthly trend over a date range
+        st.subheader("📅 Monthly Trend")
+        dates = pd.to_datetime(df['DatePublishedISO'], errors='coerce').dropna()
+        if not dates.empty:
+            date_range = st.date_input("Published between", (dates.min().date(), dates.max().date()))
+            if len(date_range) == 2:
+                trend = load_monthly_trend(date_range[0].isoformat(), date_range[1].isoformat())
+                if not trend.empty:
+                    st.line_chart(trend[['AvgRating', 'NegativePct']])
+                    st.bar_chart(trend['Reviews'])
+
+        # Sub-score drivers, read from running statistics instead of rescanning the reviews
+        st.subheader("🎯 Rating Drivers")
+        try:
+            drivers = get_rating_drivers()
+            drivers.maybe_refresh()
+            col1, col2 = st.columns(2)
+            with col1:
+                dimension = st.selectbox("Break down by", list(DIMENSIONS), format_func=str.capitalize)
+            with col2:
+                group = st.selectbox("Group", drivers.groups(dimension) or [ALL_KEY])
+            report = drivers.drivers(dimension, group)
+            if report.empty:
+                st.info("Not enough rated reviews in this group yet.")
+            else:
+                st.bar_chart(report.set_index('SubScore')[['CorrRating', 'CorrSentiment']])
+                st.dataframe(report, hide_index=True)
+            if dimension != 'all':
+                score = st.selectbox("Compare a sub-score across groups", SUB_SCORES)
+                st.dataframe(drivers.compare(dimension, score), hide_index=True)
+        except Exception as e:
+            st.error(f"Error loading rating drivers: {e}")
         
         # Filters
         st.subheader("🔍 Filter Reviews")
@@ -221,7 +309,7 @@ elif page == "📊 Sentiment Dashboard":
                 with col2:
                     st.write("**Aircraft:**", row['Aircraft'] or "N/A")
                 with col3:
-                    st.write("**Date:**", row['DatePublished'])
+                    st.write("**Date:**", row['DatePublishedISO'] or row['DatePublished'])
         
         # Refresh button
         if st.button("🔄 Refresh Data"):
@@ -235,3 +323,6 @@ elif page == "📊 Sentiment Dashboard":
 st.sidebar.markdown("---")
 st.sidebar.markdown("**🛫 Ryanair Review Analysis System**")
 st.sidebar.markdown("Powered by HuggingFace & Streamlit")
+
+# Resume jobs left queued by a previous run once the page has rendered
+get_job_queue()
@@ -0,0 +1,204 @@
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from sqlite_config import drop_review_tables
+
+SOURCE_CSV = os.path.join(os.path.dirname(__file__), 'ryanair_reviews.csv')
+
+CSV_COLUMNS = [
+    'id', 'DatePublished', 'OverallRating', 'PassengerCountry', 'TripVerified', 'CommentTitle', 'Comment',
+    'Aircraft', 'TypeOfTraveller', 'SeatType', 'Origin', 'Destination', 'DateFlown', 'SeatComfort',
+    'CabinStaffService', 'Food&Beverages', 'GroundService', 'ValueForMoney', 'Recommended',
+    'InflightEntertainment', 'Wifi&Connectivity'
+]
+CATEGORICAL_COLUMNS = ['PassengerCountry', 'TripVerified', 'Aircraft', 'TypeOfTraveller', 'SeatType', 'CommentTitle']
+# Sampled together from one real review so the ratings stay correlated with each other
+RATING_COLUMNS = [
+    'OverallRating', 'SeatComfort', 'CabinStaffService', 'Food&Beverages', 'GroundService', 'ValueForMoney',
+    'InflightEntertainment', 'Wifi&Connectivity'
+]
+# Excel headers in the format add_reviews_from_excel reads
+EXCEL_COLUMNS = {
+    'Comment': 'Comment', 'OverallRating': 'Overall Rating', 'PassengerCountry': 'Passenger Country',
+    'Aircraft': 'Aircraft', 'TypeOfTraveller': 'Type Of Traveller', 'Origin': 'Origin',
+    'Destination': 'Destination', 'DateFlown': 'Date Flown'
+}
+EXCEL_MAX_ROWS = 1048575  # one sheet, minus the header row
+UNIX_EPOCH_ORDINAL = pd.Timestamp('1970-01-01').toordinal()
+
+SENTIMENT_TAGS = {
+    'Positive': ['on time', 'friendly crew', 'good value', 'smooth boarding', 'clean cabin', 'cheap fare',
+                 'quick check-in', 'comfortable seats'],
+    'Neutral': ['average experience', 'no frills', 'cramped seats', 'slight delay', 'basic service', 'as expected'],
+    'Negative': ['delay', 'hidden fees', 'rude staff', 'lost baggage', 'cramped seats', 'cancellation',
+                 'refund refused', 'long queue', 'dirty cabin', 'baggage charge'],
+}
+
+
+class ReviewProfile:
+    """Empirical distributions of the real reviews, used to draw synthetic ones.
+
+    Categorical columns and (Origin, Destination) routes follow their observed
+    frequencies (including missing values), rating vectors are drawn from real
+    reviews as a whole, comments are stitched from real sentences of reviews in
+    the same rating band up to a sampled real comment length, and publication
+    dates follow the real date distribution.
+    """
+
+    def __init__(self, df):
+        self.categorical = {col: self.frequencies(df[col]) for col in CATEGORICAL_COLUMNS}
+        routes = df[['Origin', 'Destination']].astype(object).where(df[['Origin', 'Destination']].notna(), None)
+        self.routes = self.frequencies(pd.Series(list(map(tuple, routes.values))))
+        self.ratings = df[RATING_COLUMNS].to_numpy(dtype='float64')
+        self.published = pd.to_datetime(df['DatePublished'], format='%m/%d/%Y', errors='coerce').dropna()
+        self.published = self.published.map(pd.Timestamp.toordinal).to_numpy()
+        self.flown_missing = df['DateFlown'].isna().mean()
+
+        # Comment material per rating band: 'high' (6-10) and 'low' (1-5 or unrated)
+        band = np.where(df['OverallRating'].fillna(0) >= 6, 'high', 'low')
+        self.sentences, self.lengths, self.words_per_sentence = {}, {}, {}
+        for name in ('high', 'low'):
+            comments = df.loc[band == name, 'Comment'].dropna()
+            self.sentences[name] = np.array(
+                [s for c in comments for s in re.split(r'(?<=[.!?])\s+', c.strip()) if len(s.split()) >= 4],
+                dtype=object
+            )
+            self.lengths[name] = comments.str.split().str.len().to_numpy()
+            self.words_per_sentence[name] = np.mean([len(s.split()) for s in self.sentences[name]])
+
+    @staticmethod
+    def frequencies(series):
+        counts = series.astype(object).where(series.notna(), None).value_counts(dropna=False)
+        return counts.index.to_numpy(dtype=object), (counts / counts.sum()).to_numpy()
+
+    @classmethod
+    def from_csv(cls, path=SOURCE_CSV):
+        return cls(pd.read_csv(path))
+
+    def choice(self, rng, distribution, n):
+        values, probabilities = distribution
+        return values[rng.choice(len(values), size=n, p=probabilities)]
+
+    def comments(self, rng, bands):
+        """Real sentences from each review's rating band, as many as a sampled real comment length needs"""
+        comments = np.empty(len(bands), dtype=object)
+        for name in ('high', 'low'):
+            rows = np.flatnonzero(bands == name)
+            targets = self.lengths[name][rng.integers(len(self.lengths[name]), size=len(rows))]
+            counts = np.maximum(1, np.rint(targets / self.words_per_sentence[name]).astype(int))
+            chosen = self.sentences[name][rng.integers(len(self.sentences[name]), size=counts.sum())]
+            ends = np.cumsum(counts)
+            comments[rows] = [' '.join(chosen[end - count:end]) for count, end in zip(counts, ends)]
+        return comments
+
+    def sample(self, rng, n, start_id=0, with_sentiment=False, pending_fraction=0.1):
+        """Draw n synthetic reviews as a DataFrame with the CSV's columns"""
+        df = pd.DataFrame({'id': np.arange(start_id, start_id + n, dtype='int64')})
+
+        published = self.published[rng.integers(len(self.published), size=n)] + rng.integers(-15, 16, size=n)
+        published_dates = pd.to_datetime(published - UNIX_EPOCH_ORDINAL, unit='D')
+        df['DatePublished'] = (published_dates.month.astype(str) + '/' + published_dates.day.astype(str) + '/'
+                               + published_dates.year.astype(str))
+
+        ratings = self.ratings[rng.integers(len(self.ratings), size=n)]
+        for i, col in enumerate(RATING_COLUMNS):
+            df[col] = ratings[:, i]
+        for col in CATEGORICAL_COLUMNS:
+            df[col] = self.choice(rng, self.categorical[col], n)
+        routes = self.choice(rng, self.routes, n)
+        df['Origin'] = [route[0] for route in routes]
+        df['Destination'] = [route[1] for route in routes]
+
+        # Flown up to two months before publication, as '23-Oct' (year first)
+        flown = published_dates - pd.to_timedelta(rng.integers(0, 60, size=n), unit='D')
+        df['DateFlown'] = np.where(rng.random(n) < self.flown_missing, None, flown.strftime('%y-%b'))
+
+        bands = np.where(np.nan_to_num(ratings[:, 0]) >= 6, 'high', 'low')
+        df['Comment'] = self.comments(rng, bands)
+        df['Recommended'] = np.where(bands == 'high', 'yes', 'no')
+        df = df[CSV_COLUMNS]
+
+        if with_sentiment:
+            overall = np.nan_to_num(ratings[:, 0], nan=5.0)
+            sentiment = np.where(overall >= 7, 'Positive', np.where(overall >= 4, 'Neutral', 'Negative'))
+            # Two distinct tags per review from its sentiment's tag list
+            reasons = np.empty(n, dtype=object)
+            for label, tags in SENTIMENT_TAGS.items():
+                rows = np.flatnonzero(sentiment == label)
+                tags = np.array(tags, dtype=object)
+                first = rng.integers(len(tags), size=len(rows))
+                second = (first + 1 + rng.integers(len(tags) - 1, size=len(rows))) % len(tags)
+                reasons[rows] = tags[first] + ', ' + tags[second]
+            pending = rng.random(n) < pending_fraction
+            df['Sentiment'] = np.where(pending, None, sentiment)
+            df['SentimentReason'] = np.where(pending, None, reasons)
+        return df
+
+
+def generate(rows, seed=42, chunk_size=100000, with_sentiment=False, pending_fraction=0.1, profile=None):
+    """Yield DataFrame chunks of synthetic reviews; the same (rows, seed, chunk_size) gives the same data"""
+    profile = profile or ReviewProfile.from_csv()
+    for chunk_index, start in enumerate(range(0, rows, chunk_size)):
+        rng = np.random.default_rng([seed, chunk_index])
+        yield profile.sample(rng, min(chunk_size, rows - start), start, with_sentiment, pending_fraction)
+
+
+# ==============================
+# Writers
+# ==============================
+def write_csv(path, rows, seed=42, chunk_size=100000):
+    """Write a CSV in the same format as ryanair_reviews.csv"""
+    for i, chunk in enumerate(generate(rows, seed, chunk_size)):
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    print(f"Wrote {rows} synthetic reviews to {path}")
+
+
+def write_excel(path, rows, seed=42):
+    """Write an upload file in the format add_reviews_from_excel reads"""
+    if rows > EXCEL_MAX_ROWS:
+        print(f"Excel holds at most {EXCEL_MAX_ROWS} rows per sheet; writing the first {EXCEL_MAX_ROWS}")
+        rows = EXCEL_MAX_ROWS
+    df = pd.concat(generate(rows, seed))
+    df[list(EXCEL_COLUMNS)].rename(columns=EXCEL_COLUMNS).to_excel(path, index=False)
+    print(f"Wrote {rows} synthetic reviews to {path}")
+
+
+def write_sqlite(path, rows, seed=42, chunk_size=100000, pending_fraction=0.1):
+    """Write a SQLite database with an analyzed ryanair_reviews table (pending_fraction left unanalyzed)"""
+    engine = create_engine(f"sqlite:///{os.path.abspath(path)}")
+    drop_review_tables(engine)  # the agents split the table into reviews and sentiment on first start
+    chunks = generate(rows, seed, chunk_size, with_sentiment=True, pending_fraction=pending_fraction)
+    for i, chunk in enumerate(chunks):
+        chunk.to_sql('ryanair_reviews', engine, if_exists='replace' if i == 0 else 'append', index=False)
+    engine.dispose()
+    print(f"Wrote {rows} synthetic reviews to {path}")
+
+
+# ==============================
+# Run Script
+# ==============================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic synthetic Ryanair reviews")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sqlite", help="Write a SQLite database to this path")
+    parser.add_argument("--csv", help="Write a CSV in the ryanair_reviews.csv format to this path")
+    parser.add_argument("--excel", help="Write an upload spreadsheet to this path")
+    args = parser.parse_args()
+    if not (args.sqlite or args.csv or args.excel):
+        parser.error("choose at least one of --sqlite, --csv, --excel")
+
+    start = time.time()
+    if args.csv:
+        write_csv(args.csv, args.rows, args.seed)
+    if args.sqlite:
+        write_sqlite(args.sqlite, args.rows, args.seed)
+    if args.excel:
+        write_excel(args.excel, args.rows, args.seed)
+    print(f"Done in {time.time() - start:.1f}s")